@@ -0,0 +1,162 @@
+"""
+Analytics queries over a user's nutrition entries.
+
+Everything here reads aggregates only: daily, weekly or monthly sums come from
+storage.aggregate_entries (a MongoDB aggregation pipeline, or its in-memory
+equivalent), which projects the total fields before grouping, so meal arrays
+are never transferred or turned into NutritionEntry objects.
+
+Chart series are downsampled with largest-triangle-three-buckets (LTTB) to at
+most CHART_POINTS points, which keeps peaks and trends visible while the
+payload and the chart's render time stay the same for a week or a year.
+"""
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app import storage
+from models import NutritionEntry, NutritionRollup, NutritionTrend
+
+# Selectable analytics periods and the number of days they cover
+PERIODS = {
+    'week': 7,
+    'month': 30,
+    '3months': 90,
+    '6months': 182,
+    'year': 365
+}
+
+GROUPS = ('day', 'week', 'month')
+
+# Summed fields of each aggregate row
+FIELDS = NutritionRollup.FIELDS
+
+# Chartable metrics: label and summed field
+METRICS = {
+    'calories': ('Calories', 'total_calories'),
+    'protein': ('Protein (g)', 'total_protein'),
+    'carbs': ('Carbs (g)', 'total_carbs'),
+    'fat': ('Fat (g)', 'total_fat'),
+    'fiber': ('Fiber (g)', 'total_fiber'),
+    'water': ('Water (ml)', 'water_intake')
+}
+
+# Points a chart series is downsampled to, and the most a caller may ask for
+CHART_POINTS = int(os.environ.get('ANALYTICS_CHART_POINTS', 60))
+MAX_CHART_POINTS = 400
+
+
+def period_range(period, end=None):
+    """(start, end) midnights of the last PERIODS[period] days up to end (today if omitted)"""
+    if period not in PERIODS:
+        raise ValueError(f'Unknown analytics period: {period!r}')
+    end = NutritionEntry.day_start(end or datetime.utcnow())
+    return end - timedelta(days=PERIODS[period] - 1), end
+
+
+def entry_totals(user_id, start, end, group='day'):
+    """Sums of the user's entries within [start, end] per day, week or month, oldest first.
+
+    Rows are {'start', 'days', 'total_calories', ..., 'water_intake'}; days is
+    the number of entries in the group.
+    """
+    if group not in GROUPS:
+        raise ValueError(f'Unknown analytics grouping: {group!r}')
+    return storage.aggregate_entries(user_id, NutritionEntry.day_start(start), NutritionEntry.day_start(end),
+                                     group, FIELDS)
+
+
+def summarize(rows, start, end):
+    """Per tracked day averages and the completion rate of [start, end] from aggregate rows"""
+    days_tracked = sum(row['days'] for row in rows)
+    averages = {field: round(sum(row[field] for row in rows) / days_tracked, 1) if days_tracked else 0
+                for field in FIELDS}
+    period_days = (end - start).days + 1
+    return {
+        'avg_calories': int(averages['total_calories']),
+        'avg_protein': averages['total_protein'],
+        'avg_carbs': averages['total_carbs'],
+        'avg_fat': averages['total_fat'],
+        'avg_fiber': averages['total_fiber'],
+        'avg_water': int(averages['water_intake']),
+        'days_tracked': days_tracked,
+        'completion_rate': f'{round(100 * days_tracked / period_days)}%' if period_days > 0 else '0%'
+    }
+
+
+def user_analytics(user_id, period='week', group='day', end=None):
+    """Summary, aggregate rows and last-day trend of one of the PERIODS, as the analytics views use them"""
+    start, end = period_range(period, end)
+    rows = entry_totals(user_id, start, end, group)
+    return {
+        'period': period,
+        'group': group,
+        'start': start,
+        'end': end,
+        'summary': summarize(rows, start, end),
+        'rows': rows,
+        'trend': NutritionTrend.get(user_id, end)
+    }
+
+
+def lttb(x, y, threshold):
+    """Indices of the points largest-triangle-three-buckets keeps to draw (x, y) with threshold points.
+
+    The first and last points are always kept; every bucket in between
+    contributes the point forming the largest triangle with the previously kept
+    point and the average of the next bucket. x must be increasing.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    
+    # Bucket boundaries between the first and the last point, in exact integer arithmetic
+    edges = np.arange(threshold - 1) * (n - 2) // (threshold - 2) + 1
+    kept = [0]
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        following = slice(end, edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x, avg_y = x[following].mean(), y[following].mean()
+        a = kept[-1]
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        kept.append(start + int(np.argmax(areas)))
+    kept.append(n - 1)
+    return kept
+
+
+def metric_series(user_id, metric, period='month', points=None, end=None):
+    """Daily values of one of the METRICS over a period, downsampled to at most points points.
+
+    Untracked days are left out rather than charted as zero. Returns
+    {'metric', 'label', 'period', 'points', 'labels', 'data'} with dates as
+    YYYY-MM-DD; points is the number of tracked days before downsampling.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of {', '.join(METRICS)}")
+    points = min(max(int(points or CHART_POINTS), 3), MAX_CHART_POINTS)
+    label, field = METRICS[metric]
+    start, end = period_range(period, end)
+    rows = entry_totals(user_id, start, end, 'day')
+    
+    days = [(row['start'] - start).days for row in rows]
+    values = [row[field] for row in rows]
+    kept = lttb(days, values, points)
+    return {
+        'metric': metric,
+        'label': label,
+        'period': period,
+        'points': len(rows),
+        'labels': [rows[i]['start'].strftime('%Y-%m-%d') for i in kept],
+        'data': [round(values[i], 1) for i in kept]
+    }
+
+
+def chart_data(series):
+    """Chart.js data of a metric_series, the chart_data nutrition_analytics.html renders"""
+    return {
+        'labels': series['labels'],
+        'datasets': [{'label': series['label'], 'data': series['data']}]
+    }
@@ -7,6 +7,8 @@ from flask_pymongo import PyMongo
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_login import LoginManager
 
+from storage import MemoryStorage, MongoStorage
+
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 
@@ -20,26 +22,23 @@ app.config['FIREBASE_API_KEY'] = os.environ.get('FIREBASE_API_KEY')
 app.config['FIREBASE_APP_ID'] = os.environ.get('FIREBASE_APP_ID')
 app.config['FIREBASE_PROJECT_ID'] = os.environ.get('FIREBASE_PROJECT_ID')
 
+# Bearer token that lets monitoring read /api/metrics without a user session
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
 # configure MongoDB
 app.config["MONGO_URI"] = os.environ.get("MONGODB_URI", "mongodb://localhost:27017/nutrition_app")
 try:
     mongo = PyMongo(app)
     mongo.db.users.find_one({})  # Test the connection
+    storage = MongoStorage(mongo.db)
     app.logger.info("MongoDB connection established successfully")
 except Exception as e:
     app.logger.error(f"MongoDB connection error: {str(e)}")
     app.logger.warning("Using in-memory data storage as MongoDB fallback")
     
-    # Create in-memory storage for development/testing
-    class MemoryStorage:
-        def __init__(self):
-            self.db = type('obj', (object,), {
-                'users': [],
-                'nutrition_recommendations': [],
-                'nutrition_entries': []
-            })
-    
-    mongo = MemoryStorage()
+    # Indexed in-memory storage for development/testing
+    mongo = None
+    storage = MemoryStorage()
 
 # Setup LoginManager
 login_manager = LoginManager()
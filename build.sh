@@ -16,6 +16,7 @@ pip install flask-login==0.6.3
 pip install flask-sqlalchemy==3.1.1
 pip install flask-wtf==1.2.2
 pip install requests==2.32.3
+pip install "numpy>=1.26.0"
 pip install werkzeug==3.1.3
 
 # Explicitly install gunicorn
@@ -28,7 +29,7 @@ pip install pycryptodome==3.18.0
 
 # Explicitly install cryptography
 echo "Installing cryptography..."
-pip install cryptography>=41.0.0
+pip install "cryptography>=41.0.0"
 
 # Install pyrebase4 with specific version
 echo "Installing pyrebase4..."
@@ -49,11 +50,11 @@ pip install flask-pymongo==2.3.0
 
 # Install remaining packages
 echo "Installing remaining dependencies..."
-pip install email-validator>=2.2.0
-pip install psycopg2-binary>=2.9.10
-pip install trafilatura>=2.0.0
-pip install wtforms>=3.2.1
-pip install oauthlib>=3.2.2
+pip install "email-validator>=2.2.0"
+pip install "psycopg2-binary>=2.9.10"
+pip install "trafilatura>=2.0.0"
+pip install "wtforms>=3.2.1"
+pip install "oauthlib>=3.2.2"
 
 # Verify key packages are installed correctly
 echo "Verifying installations..."
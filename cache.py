@@ -0,0 +1,223 @@
+"""
+Small caching primitives used in front of slow or metered services.
+
+LRUCache keeps recent values in process memory. SQLiteCache keeps values in a
+SQLite file on local disk, so they survive restarts and are shared by every
+worker process on the same host. TwoTierCache layers the two and keeps
+hit/miss counters for monitoring.
+
+Values must be JSON-serializable and are treated as read-only by the caches;
+callers that want to modify a cached value should copy it first.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with per-entry time-to-live"""
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Size-bounded key/value cache persisted in a local SQLite database.
+
+    SQLite handles locking between processes, so several gunicorn workers can
+    point at the same file. Each thread gets its own connection.
+    """
+
+    def __init__(self, path, max_entries=50000, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            ' key TEXT PRIMARY KEY,'
+            ' value TEXT NOT NULL,'
+            ' expires_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute('SELECT value, expires_at FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        now = time.time()
+        if expires_at < now:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+            return None
+        conn.execute('UPDATE cache SET accessed_at = ? WHERE key = ?', (now, key))
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+            (key, json.dumps(value), expires_at, now)
+        )
+        self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        """Drop expired rows, then the least recently used rows above max_entries"""
+        conn.execute('DELETE FROM cache WHERE expires_at < ?', (now,))
+        conn.execute(
+            'DELETE FROM cache WHERE key IN ('
+            ' SELECT key FROM cache ORDER BY accessed_at ASC'
+            ' LIMIT MAX(0, (SELECT COUNT(*) FROM cache) - ?))',
+            (self.max_entries,)
+        )
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+class TwoTierCache:
+    """Memory LRU in front of an optional persistent store, with hit/miss counters"""
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'sets': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return value
+
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except sqlite3.Error as e:
+                logging.warning(f"Persistent cache read failed: {str(e)}")
+                self._count('errors')
+                value = None
+            if value is not None:
+                # Promote to the memory tier so the next hit skips the disk
+                self.memory.set(key, value)
+                self._count('disk_hits')
+                return value
+
+        self._count('misses')
+        return None
+
+    def peek(self, key):
+        """Look key up in both tiers without touching the hit/miss counters"""
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except sqlite3.Error as e:
+                logging.warning(f"Persistent cache read failed: {str(e)}")
+                return None
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.memory.set(key, value, ttl=ttl)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value, ttl=ttl)
+            except sqlite3.Error as e:
+                logging.warning(f"Persistent cache write failed: {str(e)}")
+                self._count('errors')
+        self._count('sets')
+
+    def delete(self, key):
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        stats['memory_entries'] = len(self.memory)
+        stats['persistent'] = self.disk is not None
+        return stats
+
+
+def build_two_tier_cache(path, memory_entries, disk_entries, ttl):
+    """Create a TwoTierCache, falling back to memory only if the SQLite file is unusable"""
+    memory = LRUCache(max_entries=memory_entries, ttl=ttl)
+    disk = None
+    if path:
+        try:
+            disk = SQLiteCache(path, max_entries=disk_entries, ttl=ttl)
+        except (sqlite3.Error, OSError) as e:
+            logging.warning(f"Persistent cache unavailable at {path}, using memory only: {str(e)}")
+    return TwoTierCache(memory, disk)
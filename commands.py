@@ -0,0 +1,137 @@
+"""
+Flask CLI commands for deployment and maintenance tasks.
+
+    flask --app main indexes ensure    create the indexes declared by the models
+    flask --app main indexes check     report missing/unused indexes, exit 1 if a critical one is missing
+    flask --app main recommendations recompute [--batch-size N] [--checkpoint PATH] [--restart]
+                                       regenerate every user's recommendation after the tables changed
+    flask --app main rollups rebuild [--email EMAIL] [--batch-size N]
+                                       recompute the weekly and monthly rollups and the daily trends
+                                       from the nutrition entries
+    flask --app main export history EMAIL [--format csv|ndjson] [--gzip] [-o PATH]
+                                       stream a user's nutrition history to a file or stdout
+"""
+import json
+import os
+import sys
+
+import click
+from flask.cli import AppGroup
+
+from app import app, storage
+from indexes import ensure_indexes, index_report
+from export import FORMATS as EXPORT_FORMATS, export_filename, export_history
+from models import MODELS, NutritionRollup, User
+from recompute import recompute_recommendations
+from storage import MongoStorage
+
+indexes_cli = AppGroup('indexes', help='Manage the MongoDB indexes declared by the models.')
+recommendations_cli = AppGroup('recommendations', help='Maintain stored nutrition recommendations.')
+export_cli = AppGroup('export', help="Export users' data.")
+rollups_cli = AppGroup('rollups', help='Maintain the nutrition rollups and trends derived from the entries.')
+
+
+def _mongo_db():
+    if not isinstance(storage, MongoStorage):
+        click.echo('MongoDB is not connected; the in-memory storage maintains its own indexes.')
+        sys.exit(0)
+    return storage.db
+
+
+@indexes_cli.command('ensure')
+def ensure_indexes_command():
+    """Create missing indexes (idempotent), running their data migrations first."""
+    result = ensure_indexes(_mongo_db(), MODELS)
+    for name, outcome in result['migrated'].items():
+        click.echo(f'migrated {name}: {outcome}')
+    for name in result['created']:
+        click.echo(f'created  {name}')
+    for name, error in result['failed'].items():
+        click.echo(f'FAILED   {name}: {error}', err=True)
+    if not result['created'] and not result['failed']:
+        click.echo('All declared indexes exist.')
+    sys.exit(1 if result['failed'] else 0)
+
+
+@indexes_cli.command('check')
+def check_indexes_command():
+    """Report missing, undeclared and unused indexes."""
+    report = index_report(_mongo_db(), MODELS)
+    click.echo(json.dumps(report, indent=2))
+    sys.exit(1 if report['critical_missing'] else 0)
+
+
+@recommendations_cli.command('recompute')
+@click.option('--batch-size', default=5000, show_default=True, help='Users read and written per batch.')
+@click.option('--checkpoint', default='recompute.checkpoint', show_default=True,
+              help='File recording the last finished user; a rerun resumes after it.')
+@click.option('--restart', is_flag=True, help='Ignore an existing checkpoint and start from the first user.')
+def recompute_command(batch_size, checkpoint, restart):
+    """Regenerate every user's recommendation from the current tables.
+
+    Users keep the diet type and health focus of their latest recommendation;
+    users without one are skipped. Safe to interrupt and rerun.
+    """
+    after = None
+    if not restart and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            after = json.load(f)['after']
+        click.echo(f'Resuming after user {after}')
+
+    seen = written = 0
+    with click.progressbar(length=storage.count_users(after), label='Recomputing', show_pos=True) as bar:
+        for last_id, users, inserted in recompute_recommendations(storage, batch_size=batch_size, after=after):
+            seen += users
+            written += inserted
+            # Write the checkpoint atomically so an interrupted run never leaves a torn file
+            with open(checkpoint + '.tmp', 'w') as f:
+                json.dump({'after': str(last_id), 'users': seen, 'written': written}, f)
+            os.replace(checkpoint + '.tmp', checkpoint)
+            bar.update(users)
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    click.echo(f'{seen} users processed, {written} recommendations written.')
+
+
+@rollups_cli.command('rebuild')
+@click.option('--email', default=None, help="Only rebuild this user's rollups and trends.")
+@click.option('--batch-size', default=1000, show_default=True, help='Entries fetched per round trip.')
+def rebuild_rollups_command(email, batch_size):
+    """Recompute rollups and trends from the nutrition entries (after a failed write or a data fix)."""
+    user_id = None
+    if email:
+        user = User.get_by_email(email)
+        if user is None:
+            click.echo(f'No user with email {email}', err=True)
+            sys.exit(1)
+        user_id = user.id
+    users = NutritionRollup.rebuild(user_id, batch_size=batch_size)
+    click.echo(f'Rebuilt rollups of {users} users.')
+
+
+@export_cli.command('history')
+@click.argument('email')
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+@click.option('--batch-size', default=None, type=int, help='Entries fetched per round trip.')
+@click.option('-o', '--output', default=None,
+              help='File to write; "-" for stdout. Defaults to nutrition-history-<date>.<format>[.gz].')
+def export_history_command(email, fmt, compress, batch_size, output):
+    """Stream a user's whole nutrition history, oldest day first."""
+    user = User.get_by_email(email)
+    if user is None:
+        click.echo(f'No user with email {email}', err=True)
+        sys.exit(1)
+    output = output or export_filename(fmt, compress)
+    with click.open_file(output, 'wb') as f:
+        for chunk in export_history(user.id, fmt, compress, batch_size):
+            f.write(chunk)
+    if output != '-':
+        click.echo(f'Wrote {output}')
+
+
+app.cli.add_command(indexes_cli)
+app.cli.add_command(recommendations_cli)
+app.cli.add_command(rollups_cli)
+app.cli.add_command(export_cli)
@@ -0,0 +1,104 @@
+"""
+Streaming export of a user's nutrition history.
+
+Entries are read through storage.iter_entries, a cursor fetching
+EXPORT_BATCH_SIZE documents per round trip, and encoded one at a time, so
+memory stays constant however long the history is and the first bytes
+(the CSV header) are ready before the query has returned anything.
+
+CSV has one row per day with its totals, water intake, logged food names and
+notes; NDJSON has one JSON object per day with everything, meals included.
+Either can be gzip-compressed on the fly.
+"""
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from app import storage
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+
+# Format name -> (mimetype, file extension)
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson')
+}
+
+CSV_COLUMNS = ['date', 'total_calories', 'total_protein', 'total_carbs', 'total_fat', 'total_fiber',
+               'water_intake', 'foods', 'notes']
+
+# Encoded rows are yielded in chunks of about this many bytes
+_CHUNK_SIZE = 64 * 1024
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _csv_rows(entries):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    yield buffer.getvalue()
+    for entry in entries:
+        buffer.seek(0)
+        buffer.truncate()
+        foods = [food.get('food_name') or food.get('name') or ''
+                 for foods in (entry.get('meals') or {}).values() for food in foods]
+        writer.writerow([entry['date'].strftime('%Y-%m-%d')]
+                        + [entry.get(column, 0) for column in CSV_COLUMNS[1:7]]
+                        + ['; '.join(foods), entry.get('notes') or ''])
+        yield buffer.getvalue()
+
+
+def _ndjson_rows(entries):
+    for entry in entries:
+        entry['date'] = entry['date'].strftime('%Y-%m-%d')
+        yield json.dumps(entry, default=_json_default) + '\n'
+
+
+def export_history(user_id, fmt='csv', compress=False, batch_size=None):
+    """A user's entries, oldest first, encoded as fmt (one of FORMATS) in bytes chunks.
+
+    A generator: nothing is read until the first chunk is requested. With
+    compress the chunks together form one gzip stream.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    entries = storage.iter_entries(user_id, {'user_id': False}, batch_size or EXPORT_BATCH_SIZE)
+    rows = _csv_rows(entries) if fmt == 'csv' else _ndjson_rows(entries)
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: gzip container
+
+    pending, size = [], 0
+    for count, row in enumerate(rows):
+        pending.append(row)
+        size += len(row)
+        # The first row goes out on its own: the CSV header before the first batch is read,
+        # the first NDJSON entry as soon as the first batch arrives
+        if count == 0 or size >= _CHUNK_SIZE:
+            chunk = ''.join(pending).encode('utf-8')
+            pending, size = [], 0
+            if compressor:
+                chunk = compressor.compress(chunk) + (compressor.flush(zlib.Z_SYNC_FLUSH) if count == 0 else b'')
+            if chunk:
+                yield chunk
+    chunk = ''.join(pending).encode('utf-8')
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def export_filename(fmt, compress=False, date=None):
+    """Download name of an export, e.g. nutrition-history-2024-05-01.csv.gz"""
+    name = f"nutrition-history-{(date or datetime.utcnow()).strftime('%Y-%m-%d')}.{FORMATS[fmt][1]}"
+    return name + '.gz' if compress else name
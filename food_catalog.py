@@ -0,0 +1,820 @@
+"""
+Built-in catalog of common foods used by the food nutrition lookup.
+
+The catalog is built once at import time. Lookups go through an exact hash
+index over food keys and their display-name aliases, and fall back to a token
+inverted index for partial matches, so lookup cost depends on the query rather
+than on the number of foods in the catalog.
+
+FOODS chains the built-in catalog with the optional memory-mapped food
+database from food_db.py and is what the lookup code should use.
+
+Besides the per-serving values, every catalog food is kept as a row of a
+per-100 g nutrient matrix with a table of portions (see nutrients.py), so
+quantities in grams, cups or pieces scale with one vectorized operation.
+"""
+import os
+
+import numpy as np
+
+from food_db import open_food_database
+from food_search import PrefixIndex, TrigramIndex, normalize_query
+from nutrients import NUTRIENTS, per_100g, serving_portions
+
+# Dictionary of common foods and their accurate nutrition values (per serving shown in food_name,
+# which weighs serving_g grams)
+COMMON_FOODS = {
+    # Fruits
+    'apple': {
+        'food_name': 'Apple (1 medium)',
+        'serving_g': 182,
+        'calories': 95,
+        'protein_g': 0.5,
+        'carbs_g': 25.1,
+        'fat_g': 0.3,
+        'fiber_g': 4.4
+    },
+    'banana': {
+        'food_name': 'Banana (1 medium)',
+        'serving_g': 118,
+        'calories': 105,
+        'protein_g': 1.3,
+        'carbs_g': 27.0,
+        'fat_g': 0.4,
+        'fiber_g': 3.1
+    },
+    'orange': {
+        'food_name': 'Orange (1 medium)',
+        'serving_g': 131,
+        'calories': 62,
+        'protein_g': 1.2,
+        'carbs_g': 15.4,
+        'fat_g': 0.2,
+        'fiber_g': 3.1
+    },
+    'strawberry': {
+        'food_name': 'Strawberries (1 cup)',
+        'serving_g': 152,
+        'calories': 49,
+        'protein_g': 1.0,
+        'carbs_g': 11.7,
+        'fat_g': 0.5,
+        'fiber_g': 3.0
+    },
+    'blueberry': {
+        'food_name': 'Blueberries (1 cup)',
+        'serving_g': 148,
+        'calories': 84,
+        'protein_g': 1.1,
+        'carbs_g': 21.5,
+        'fat_g': 0.5,
+        'fiber_g': 3.6
+    },
+    'grape': {
+        'food_name': 'Grapes (1 cup)',
+        'serving_g': 151,
+        'calories': 104,
+        'protein_g': 1.1,
+        'carbs_g': 27.3,
+        'fat_g': 0.2,
+        'fiber_g': 1.4
+    },
+    'watermelon': {
+        'food_name': 'Watermelon (1 cup, diced)',
+        'serving_g': 152,
+        'calories': 46,
+        'protein_g': 0.9,
+        'carbs_g': 11.5,
+        'fat_g': 0.2,
+        'fiber_g': 0.6
+    },
+    'pineapple': {
+        'food_name': 'Pineapple (1 cup, chunks)',
+        'serving_g': 165,
+        'calories': 82,
+        'protein_g': 0.9,
+        'carbs_g': 21.6,
+        'fat_g': 0.2,
+        'fiber_g': 2.3
+    },
+    'mango': {
+        'food_name': 'Mango (1 cup, sliced)',
+        'serving_g': 165,
+        'calories': 99,
+        'protein_g': 1.4,
+        'carbs_g': 24.7,
+        'fat_g': 0.6,
+        'fiber_g': 2.6
+    },
+    'avocado': {
+        'food_name': 'Avocado (1/2 fruit)',
+        'serving_g': 100,
+        'calories': 160,
+        'protein_g': 2.0,
+        'carbs_g': 8.5,
+        'fat_g': 14.7,
+        'fiber_g': 6.7
+    },
+    
+    # Vegetables
+    'broccoli': {
+        'food_name': 'Broccoli (1 cup, chopped)',
+        'serving_g': 156,
+        'calories': 55,
+        'protein_g': 3.7,
+        'carbs_g': 11.2,
+        'fat_g': 0.6,
+        'fiber_g': 5.1
+    },
+    'spinach': {
+        'food_name': 'Spinach (1 cup, raw)',
+        'serving_g': 30,
+        'calories': 7,
+        'protein_g': 0.9,
+        'carbs_g': 1.1,
+        'fat_g': 0.1,
+        'fiber_g': 0.7
+    },
+    'kale': {
+        'food_name': 'Kale (1 cup, chopped)',
+        'serving_g': 67,
+        'calories': 33,
+        'protein_g': 2.9,
+        'carbs_g': 6.7,
+        'fat_g': 0.5,
+        'fiber_g': 1.3
+    },
+    'carrot': {
+        'food_name': 'Carrot (1 medium)',
+        'serving_g': 61,
+        'calories': 25,
+        'protein_g': 0.6,
+        'carbs_g': 5.8,
+        'fat_g': 0.1,
+        'fiber_g': 1.7
+    },
+    'bell pepper': {
+        'food_name': 'Bell Pepper (1 medium)',
+        'serving_g': 119,
+        'calories': 30,
+        'protein_g': 1.0,
+        'carbs_g': 7.0,
+        'fat_g': 0.2,
+        'fiber_g': 2.5
+    },
+    'onion': {
+        'food_name': 'Onion (1 medium)',
+        'serving_g': 110,
+        'calories': 44,
+        'protein_g': 1.2,
+        'carbs_g': 10.3,
+        'fat_g': 0.1,
+        'fiber_g': 1.9
+    },
+    'tomato': {
+        'food_name': 'Tomato (1 medium)',
+        'serving_g': 123,
+        'calories': 22,
+        'protein_g': 1.1,
+        'carbs_g': 4.8,
+        'fat_g': 0.2,
+        'fiber_g': 1.5
+    },
+    'potato': {
+        'food_name': 'Potato (1 medium, baked)',
+        'serving_g': 173,
+        'calories': 161,
+        'protein_g': 4.3,
+        'carbs_g': 36.6,
+        'fat_g': 0.2,
+        'fiber_g': 3.8
+    },
+    'sweet potato': {
+        'food_name': 'Sweet Potato (1 medium, baked)',
+        'serving_g': 114,
+        'calories': 103,
+        'protein_g': 2.3,
+        'carbs_g': 23.6,
+        'fat_g': 0.2,
+        'fiber_g': 3.8
+    },
+    'cucumber': {
+        'food_name': 'Cucumber (1/2 cup, sliced)',
+        'serving_g': 52,
+        'calories': 8,
+        'protein_g': 0.3,
+        'carbs_g': 1.9,
+        'fat_g': 0.1,
+        'fiber_g': 0.3
+    },
+    
+    # Protein Sources
+    'chicken breast': {
+        'food_name': 'Chicken Breast (3 oz, cooked)',
+        'serving_g': 85,
+        'calories': 165,
+        'protein_g': 31.0,
+        'carbs_g': 0.0,
+        'fat_g': 3.6,
+        'fiber_g': 0.0
+    },
+    'chicken thigh': {
+        'food_name': 'Chicken Thigh (3 oz, cooked)',
+        'serving_g': 85,
+        'calories': 209,
+        'protein_g': 24.7,
+        'carbs_g': 0.0,
+        'fat_g': 11.2,
+        'fiber_g': 0.0
+    },
+    'beef': {
+        'food_name': 'Beef (3 oz, lean, cooked)',
+        'serving_g': 85,
+        'calories': 213,
+        'protein_g': 26.0,
+        'carbs_g': 0.0,
+        'fat_g': 11.8,
+        'fiber_g': 0.0
+    },
+    'ground beef': {
+        'food_name': 'Ground Beef (3 oz, 85% lean, cooked)',
+        'serving_g': 85,
+        'calories': 218,
+        'protein_g': 24.0,
+        'carbs_g': 0.0,
+        'fat_g': 13.0,
+        'fiber_g': 0.0
+    },
+    'pork': {
+        'food_name': 'Pork Chop (3 oz, cooked)',
+        'serving_g': 85,
+        'calories': 198,
+        'protein_g': 26.0,
+        'carbs_g': 0.0,
+        'fat_g': 9.9,
+        'fiber_g': 0.0
+    },
+    'salmon': {
+        'food_name': 'Salmon (3 oz, cooked)',
+        'serving_g': 85,
+        'calories': 175,
+        'protein_g': 18.8,
+        'carbs_g': 0.0,
+        'fat_g': 10.5,
+        'fiber_g': 0.0
+    },
+    'tuna': {
+        'food_name': 'Tuna (3 oz, canned in water)',
+        'serving_g': 85,
+        'calories': 73,
+        'protein_g': 16.5,
+        'carbs_g': 0.0,
+        'fat_g': 0.8,
+        'fiber_g': 0.0
+    },
+    'shrimp': {
+        'food_name': 'Shrimp (3 oz, cooked)',
+        'serving_g': 85,
+        'calories': 84,
+        'protein_g': 18.0,
+        'carbs_g': 0.0,
+        'fat_g': 0.9,
+        'fiber_g': 0.0
+    },
+    'tofu': {
+        'food_name': 'Tofu (1/2 cup)',
+        'serving_g': 126,
+        'calories': 94,
+        'protein_g': 10.0,
+        'carbs_g': 2.3,
+        'fat_g': 5.9,
+        'fiber_g': 0.5
+    },
+    'tempeh': {
+        'food_name': 'Tempeh (3 oz)',
+        'serving_g': 85,
+        'calories': 160,
+        'protein_g': 15.0,
+        'carbs_g': 7.0,
+        'fat_g': 9.0,
+        'fiber_g': 4.8
+    },
+    'lentils': {
+        'food_name': 'Lentils (1/2 cup, cooked)',
+        'serving_g': 99,
+        'calories': 115,
+        'protein_g': 9.0,
+        'carbs_g': 20.0,
+        'fat_g': 0.4,
+        'fiber_g': 7.8
+    },
+    'chickpeas': {
+        'food_name': 'Chickpeas (1/2 cup, cooked)',
+        'serving_g': 82,
+        'calories': 134,
+        'protein_g': 7.0,
+        'carbs_g': 22.5,
+        'fat_g': 2.1,
+        'fiber_g': 6.2
+    },
+    'black beans': {
+        'food_name': 'Black Beans (1/2 cup, cooked)',
+        'serving_g': 86,
+        'calories': 114,
+        'protein_g': 7.6,
+        'carbs_g': 20.4,
+        'fat_g': 0.5,
+        'fiber_g': 7.5
+    },
+    
+    # Dairy & Eggs
+    'egg': {
+        'food_name': 'Egg (1 large)',
+        'serving_g': 50,
+        'calories': 72,
+        'protein_g': 6.3,
+        'carbs_g': 0.4,
+        'fat_g': 5.0,
+        'fiber_g': 0.0
+    },
+    'milk': {
+        'food_name': 'Milk (1 cup, whole)',
+        'serving_g': 244,
+        'calories': 149,
+        'protein_g': 7.7,
+        'carbs_g': 11.7,
+        'fat_g': 8.0,
+        'fiber_g': 0.0
+    },
+    'skim milk': {
+        'food_name': 'Skim Milk (1 cup)',
+        'serving_g': 245,
+        'calories': 83,
+        'protein_g': 8.3,
+        'carbs_g': 12.2,
+        'fat_g': 0.2,
+        'fiber_g': 0.0
+    },
+    'yogurt': {
+        'food_name': 'Greek Yogurt (1 cup, plain)',
+        'serving_g': 227,
+        'calories': 130,
+        'protein_g': 22.0,
+        'carbs_g': 9.0,
+        'fat_g': 0.0,
+        'fiber_g': 0.0
+    },
+    'cheese': {
+        'food_name': 'Cheddar Cheese (1 oz)',
+        'serving_g': 28,
+        'calories': 113,
+        'protein_g': 7.0,
+        'carbs_g': 0.4,
+        'fat_g': 9.3,
+        'fiber_g': 0.0
+    },
+    'cottage cheese': {
+        'food_name': 'Cottage Cheese (1/2 cup)',
+        'serving_g': 113,
+        'calories': 110,
+        'protein_g': 12.5,
+        'carbs_g': 3.5,
+        'fat_g': 4.5,
+        'fiber_g': 0.0
+    },
+    
+    # Grains & Cereals
+    'rice': {
+        'food_name': 'White Rice (1/2 cup, cooked)',
+        'serving_g': 93,
+        'calories': 121,
+        'protein_g': 2.5,
+        'carbs_g': 26.5,
+        'fat_g': 0.3,
+        'fiber_g': 0.3
+    },
+    'brown rice': {
+        'food_name': 'Brown Rice (1/2 cup, cooked)',
+        'serving_g': 98,
+        'calories': 109,
+        'protein_g': 2.3,
+        'carbs_g': 22.9,
+        'fat_g': 0.9,
+        'fiber_g': 1.8
+    },
+    'quinoa': {
+        'food_name': 'Quinoa (1/2 cup, cooked)',
+        'serving_g': 93,
+        'calories': 111,
+        'protein_g': 4.1,
+        'carbs_g': 19.7,
+        'fat_g': 1.8,
+        'fiber_g': 2.6
+    },
+    'bread': {
+        'food_name': 'White Bread (1 slice)',
+        'serving_g': 28,
+        'calories': 75,
+        'protein_g': 2.6,
+        'carbs_g': 13.8,
+        'fat_g': 1.0,
+        'fiber_g': 0.8
+    },
+    'whole wheat bread': {
+        'food_name': 'Whole Wheat Bread (1 slice)',
+        'serving_g': 32,
+        'calories': 81,
+        'protein_g': 4.0,
+        'carbs_g': 15.0,
+        'fat_g': 1.1,
+        'fiber_g': 2.0
+    },
+    'pasta': {
+        'food_name': 'Pasta (1 cup, cooked)',
+        'serving_g': 140,
+        'calories': 221,
+        'protein_g': 8.1,
+        'carbs_g': 43.2,
+        'fat_g': 1.3,
+        'fiber_g': 2.5
+    },
+    'whole wheat pasta': {
+        'food_name': 'Whole Wheat Pasta (1 cup, cooked)',
+        'serving_g': 140,
+        'calories': 174,
+        'protein_g': 7.5,
+        'carbs_g': 37.2,
+        'fat_g': 0.8,
+        'fiber_g': 6.3
+    },
+    'oats': {
+        'food_name': 'Oatmeal (1/2 cup, dry)',
+        'serving_g': 40,
+        'calories': 150,
+        'protein_g': 5.0,
+        'carbs_g': 27.0,
+        'fat_g': 3.0,
+        'fiber_g': 4.0
+    },
+    
+    # Nuts & Seeds
+    'almonds': {
+        'food_name': 'Almonds (1 oz, 23 nuts)',
+        'serving_g': 28,
+        'calories': 164,
+        'protein_g': 6.0,
+        'carbs_g': 6.1,
+        'fat_g': 14.0,
+        'fiber_g': 3.5
+    },
+    'walnuts': {
+        'food_name': 'Walnuts (1 oz, 14 halves)',
+        'serving_g': 28,
+        'calories': 185,
+        'protein_g': 4.3,
+        'carbs_g': 3.9,
+        'fat_g': 18.5,
+        'fiber_g': 1.9
+    },
+    'peanut butter': {
+        'food_name': 'Peanut Butter (2 tbsp)',
+        'serving_g': 32,
+        'calories': 188,
+        'protein_g': 8.0,
+        'carbs_g': 6.9,
+        'fat_g': 16.0,
+        'fiber_g': 1.9
+    },
+    'chia seeds': {
+        'food_name': 'Chia Seeds (1 tbsp)',
+        'serving_g': 12,
+        'calories': 58,
+        'protein_g': 2.0,
+        'carbs_g': 5.0,
+        'fat_g': 3.0,
+        'fiber_g': 4.0
+    },
+    'flax seeds': {
+        'food_name': 'Flax Seeds (1 tbsp)',
+        'serving_g': 10,
+        'calories': 55,
+        'protein_g': 1.9,
+        'carbs_g': 3.0,
+        'fat_g': 4.3,
+        'fiber_g': 2.8
+    },
+    
+    # Oils & Fats
+    'olive oil': {
+        'food_name': 'Olive Oil (1 tbsp)',
+        'serving_g': 13.5,
+        'calories': 119,
+        'protein_g': 0.0,
+        'carbs_g': 0.0,
+        'fat_g': 13.5,
+        'fiber_g': 0.0
+    },
+    'coconut oil': {
+        'food_name': 'Coconut Oil (1 tbsp)',
+        'serving_g': 13.6,
+        'calories': 121,
+        'protein_g': 0.0,
+        'carbs_g': 0.0,
+        'fat_g': 13.6,
+        'fiber_g': 0.0
+    },
+    'butter': {
+        'food_name': 'Butter (1 tbsp)',
+        'serving_g': 14.2,
+        'calories': 102,
+        'protein_g': 0.1,
+        'carbs_g': 0.0,
+        'fat_g': 11.5,
+        'fiber_g': 0.0
+    }
+}
+
+# Relative global popularity of catalog foods (how often people log them), used to rank autocomplete
+# suggestions. Foods missing from this table rank after the listed ones, alphabetically.
+FOOD_POPULARITY = {
+    'egg': 100, 'banana': 96, 'chicken breast': 95, 'apple': 93, 'rice': 90, 'milk': 88, 'bread': 86,
+    'oats': 84, 'yogurt': 82, 'broccoli': 80, 'salmon': 78, 'potato': 77, 'pasta': 76, 'cheese': 75,
+    'avocado': 74, 'peanut butter': 73, 'almonds': 72, 'spinach': 71, 'tomato': 70, 'strawberry': 69,
+    'blueberry': 68, 'ground beef': 67, 'sweet potato': 66, 'carrot': 65, 'brown rice': 64, 'tuna': 63,
+    'orange': 62, 'olive oil': 61, 'butter': 60, 'quinoa': 58, 'onion': 57, 'whole wheat bread': 56,
+    'beef': 55, 'skim milk': 54, 'cottage cheese': 53, 'grape': 52, 'chicken thigh': 51, 'shrimp': 50,
+    'tofu': 49, 'cucumber': 48, 'bell pepper': 47, 'lentils': 46, 'black beans': 45, 'chickpeas': 44,
+    'pork': 43, 'kale': 42, 'walnuts': 41, 'watermelon': 40, 'pineapple': 39, 'mango': 38,
+    'chia seeds': 37, 'whole wheat pasta': 36, 'coconut oil': 35, 'flax seeds': 34, 'tempeh': 33
+}
+
+# Category (first) and dietary tags of catalog foods, used by the meal planner to respect diets
+# and allergies. Categories: fruit, vegetable, starch, protein, legume, egg, dairy, grain, bread,
+# cereal, nuts, fat.
+FOOD_TAGS = {
+    'apple': ('fruit', 'sweet_fruit'), 'banana': ('fruit', 'sweet_fruit'), 'orange': ('fruit', 'sweet_fruit'),
+    'strawberry': ('fruit',), 'blueberry': ('fruit',), 'grape': ('fruit', 'sweet_fruit'),
+    'watermelon': ('fruit', 'sweet_fruit'), 'pineapple': ('fruit', 'sweet_fruit'), 'mango': ('fruit', 'sweet_fruit'),
+    'avocado': ('fat',),
+    'broccoli': ('vegetable',), 'spinach': ('vegetable',), 'kale': ('vegetable',), 'carrot': ('vegetable',),
+    'bell pepper': ('vegetable',), 'onion': ('vegetable',), 'tomato': ('vegetable',), 'cucumber': ('vegetable',),
+    'potato': ('starch',), 'sweet potato': ('starch',),
+    'chicken breast': ('protein', 'poultry'), 'chicken thigh': ('protein', 'poultry'),
+    'beef': ('protein', 'meat'), 'ground beef': ('protein', 'meat'), 'pork': ('protein', 'meat'),
+    'salmon': ('protein', 'fish'), 'tuna': ('protein', 'fish'), 'shrimp': ('protein', 'shellfish'),
+    'tofu': ('protein', 'soy'), 'tempeh': ('protein', 'soy'),
+    'lentils': ('legume',), 'chickpeas': ('legume',), 'black beans': ('legume',),
+    'egg': ('egg',),
+    'milk': ('dairy',), 'skim milk': ('dairy',), 'yogurt': ('dairy',), 'cheese': ('dairy',),
+    'cottage cheese': ('dairy',),
+    'rice': ('grain',), 'brown rice': ('grain',), 'quinoa': ('grain',), 'oats': ('cereal',),
+    'bread': ('bread', 'gluten'), 'whole wheat bread': ('bread', 'gluten'), 'pasta': ('grain', 'gluten'),
+    'whole wheat pasta': ('grain', 'gluten'),
+    'almonds': ('nuts', 'tree_nut'), 'walnuts': ('nuts', 'tree_nut'), 'peanut butter': ('nuts', 'peanut'),
+    'chia seeds': ('nuts', 'seed'), 'flax seeds': ('nuts', 'seed'),
+    'olive oil': ('fat',), 'coconut oil': ('fat',), 'butter': ('fat', 'dairy')
+}
+
+# Shortest query token that may match the start of a longer catalog token ("chick" -> "chickpeas")
+MIN_PREFIX_LENGTH = 3
+
+# Lowest trigram similarity at which a fuzzy search hit is trusted as the food the user meant
+FUZZY_MATCH_THRESHOLD = 0.5
+
+
+def _token_variants(token):
+    """Return the token together with its naive singular forms"""
+    variants = {token}
+    if len(token) > 3 and token.endswith('es'):
+        variants.add(token[:-2])
+    if len(token) > 2 and token.endswith('s'):
+        variants.add(token[:-1])
+    return variants
+
+
+class FoodCatalog:
+    """Indexed, read-only view over a dictionary of foods keyed by name"""
+
+    def __init__(self, foods, popularity=None, tags=None):
+        popularity = popularity or {}
+        tags = tags or {}
+        self._tags = {key: tuple(tags.get(key, ())) for key in foods}
+        self._foods = {}
+        self._exact = {}
+        self._tokens = {}
+        self._prefixes = {}
+        self._key_tokens = {}
+
+        for key, nutrition in foods.items():
+            self._foods[key] = dict(nutrition)
+
+            # Index the key itself and the display name without its serving size,
+            # e.g. 'yogurt' and 'greek yogurt' both resolve to the same entry
+            alias = normalize_query(nutrition.get('food_name', '').split('(')[0])
+            for name in (normalize_query(key), alias):
+                if name:
+                    self._exact.setdefault(name, key)
+
+            tokens = normalize_query(key).split()
+            self._key_tokens[key] = tokens
+            for token in tokens:
+                for variant in _token_variants(token):
+                    self._tokens.setdefault(variant, set()).add(key)
+                for length in range(MIN_PREFIX_LENGTH, len(token)):
+                    self._prefixes.setdefault(token[:length], set()).add(key)
+
+        # Per-100 g nutrient vectors, one row per food in self._keys order
+        self._keys = list(self._foods)
+        self._rows = {key: row for row, key in enumerate(self._keys)}
+        self._vectors = np.zeros((len(self._keys), len(NUTRIENTS)), dtype=np.float32)
+        self._portions = []
+        for row, key in enumerate(self._keys):
+            nutrition = self._foods[key]
+            serving_g = nutrition.get('serving_g') or 100
+            self._vectors[row] = per_100g(nutrition, serving_g)
+            self._portions.append(serving_portions(nutrition.get('food_name', ''), serving_g))
+
+        # Every indexed name (keys and aliases) is a row of the fuzzy search index
+        self._row_keys = list(self._exact.values())
+        self._search_index = TrigramIndex.build(list(self._exact))
+
+        # Autocomplete matches the start of any word of a name ("breast" -> chicken breast)
+        completions = set()
+        for name, key in self._exact.items():
+            words = name.split(' ')
+            for i in range(len(words)):
+                completions.add((' '.join(words[i:]), self._rows[key]))
+        self._prefix_index = PrefixIndex.build(completions, [popularity.get(key, 0) for key in self._keys])
+
+    def __len__(self):
+        return len(self._foods)
+
+    def __contains__(self, key):
+        return key in self._foods
+
+    def get(self, key):
+        """Return a copy of the nutrition data stored under key, or None"""
+        nutrition = self._foods.get(key)
+        return dict(nutrition) if nutrition is not None else None
+
+    def keys(self):
+        return list(self._keys)
+
+    def tags(self, key):
+        """Return the tags of key, category first (empty for untagged foods)"""
+        return self._tags.get(key, ())
+
+    def nutrients(self, key):
+        """Return (per-100 g nutrient vector, portions in grams) for key, or None"""
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        return self._vectors[row], self._portions[row]
+
+    def vectors(self, keys):
+        """Return the per-100 g nutrient matrix of several foods, one row per key"""
+        return self._vectors[[self._rows[key] for key in keys]]
+
+    def match(self, query):
+        """Resolve a free-text query to a catalog key.
+
+        Returns a (key, exact) tuple, or None when nothing in the catalog matches.
+        Partial matches are ranked deterministically so the same query always
+        resolves to the same food.
+        """
+        normalized = normalize_query(query)
+        if not normalized:
+            return None
+
+        key = self._exact.get(normalized)
+        if key is not None:
+            return key, True
+
+        query_tokens = normalized.split()
+        exact_hits = {}
+        prefix_hits = {}
+        for position, token in enumerate(query_tokens):
+            for variant in _token_variants(token):
+                for key in self._tokens.get(variant, ()):
+                    exact_hits.setdefault(key, set()).add(position)
+            for key in self._prefixes.get(token, ()):
+                prefix_hits.setdefault(key, set()).add(position)
+
+        candidates = set(exact_hits) | set(prefix_hits)
+        if not candidates:
+            return None
+
+        last_position = len(query_tokens) - 1
+
+        def rank(key):
+            exact = exact_hits.get(key, set())
+            prefix = prefix_hits.get(key, set()) - exact
+            matched = exact | prefix
+            key_length = len(self._key_tokens[key])
+            return (
+                -len(exact),                        # more whole-word matches first
+                -len(prefix),                       # then more prefix matches
+                last_position not in matched,       # prefer matching the head noun
+                -(len(matched) / key_length),       # prefer keys mostly covered by the query
+                key_length,
+                key,                                # stable tie-break
+            )
+
+        return min(candidates, key=rank), False
+
+    def search(self, query, limit=10, min_score=0.0):
+        """Rank catalog foods by trigram similarity to query.
+
+        Returns up to limit (key, score) pairs, best first, with scores between 0
+        and 1. Misspelled queries still find their food, e.g. "brocoli".
+        """
+        normalized = normalize_query(query)
+        if not normalized:
+            return []
+
+        # A food can be indexed under several names; keep its best-scoring one
+        results = {}
+        for row, score in self._search_index.search(normalized, limit=limit * 2, min_score=min_score):
+            key = self._row_keys[row]
+            if key not in results:
+                results[key] = score
+            if len(results) == limit:
+                break
+        return list(results.items())
+
+    def autocomplete(self, prefix, limit=10):
+        """Return up to limit catalog keys with a name or word starting with prefix, most popular first"""
+        normalized = normalize_query(prefix)
+        if not normalized:
+            return []
+        return [self._keys[food_id] for food_id in self._prefix_index.complete(normalized, limit=limit)]
+
+
+class FoodCatalogChain:
+    """Looks foods up in several catalogs, earlier catalogs taking precedence.
+
+    The built-in catalog comes first, so its curated serving sizes win over a
+    large external database that happens to contain the same food.
+    """
+
+    def __init__(self, catalogs):
+        self.catalogs = catalogs
+
+    def __len__(self):
+        return sum(len(catalog) for catalog in self.catalogs)
+
+    def __contains__(self, key):
+        return any(key in catalog for catalog in self.catalogs)
+
+    def get(self, key):
+        for catalog in self.catalogs:
+            nutrition = catalog.get(key)
+            if nutrition is not None:
+                return nutrition
+        return None
+
+    def nutrients(self, key):
+        for catalog in self.catalogs:
+            nutrients = catalog.nutrients(key)
+            if nutrients is not None:
+                return nutrients
+        return None
+
+    def match(self, query):
+        partial = None
+        for catalog in self.catalogs:
+            match = catalog.match(query)
+            if match and match[1]:
+                return match
+            partial = partial or match
+        return partial
+
+    def search(self, query, limit=10, min_score=0.0):
+        results = {}
+        for catalog in self.catalogs:
+            for key, score in catalog.search(query, limit=limit, min_score=min_score):
+                if score > results.get(key, -1.0):
+                    results[key] = score
+        ranked = sorted(results.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+    def autocomplete(self, prefix, limit=10):
+        keys = []
+        for catalog in self.catalogs:
+            for key in catalog.autocomplete(prefix, limit=limit):
+                if key not in keys:
+                    keys.append(key)
+            if len(keys) >= limit:
+                break
+        return keys[:limit]
+
+
+FOOD_CATALOG = FoodCatalog(COMMON_FOODS, FOOD_POPULARITY, FOOD_TAGS)
+
+# Optional large food database (see food_db.py), memory-mapped and shared by all workers on the host
+FOOD_DATABASE = open_food_database(
+    os.environ.get('FOOD_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'foods.fdb'))
+)
+
+# Every food source, in lookup order
+FOODS = FoodCatalogChain([FOOD_CATALOG] + ([FOOD_DATABASE] if FOOD_DATABASE is not None else []))
@@ -0,0 +1,321 @@
+"""
+Compact, memory-mapped columnar food database.
+
+Large food datasets (USDA scale, hundreds of thousands of foods) are converted
+offline into a single binary file and memory-mapped at startup. Nothing is
+parsed when a worker starts: every column is a NumPy view over the mapping,
+so all gunicorn workers on a host share the same physical pages.
+
+File layout (little-endian):
+
+    magic (8 bytes) | version (uint32) | header length (uint32) | JSON header | sections
+
+The JSON header lists every section with its dtype, byte offset and element
+count. Sections are 8-byte aligned:
+
+    calories, protein_g, carbs_g, fat_g, fiber_g   float32[n]  nutrients per serving
+    serving_g, popularity                          float32[n]
+    name_offsets/name_blob                         display names, UTF-8 blob indexed by int64 offsets
+    key_offsets/key_blob                           normalized names, used as lookup keys
+    prefix_offsets/prefix_blob, prefix_rows,       sorted completion strings for exact lookup
+    prefix_exact                                   and autocomplete (see food_search.PrefixIndex)
+    trigram_offsets, trigram_postings,             fuzzy search index (see food_search.TrigramIndex)
+    trigram_sizes
+
+Build a file from CSV or JSON with:
+
+    python food_db.py build foods.csv -o instance/foods.fdb
+
+Source rows need a name column (name, description or food_name) and may carry
+calories, protein_g, carbs_g, fat_g, fiber_g, serving_g (grams the nutrient
+values refer to, default 100) and popularity.
+"""
+import argparse
+import bisect
+import csv
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+from food_search import PrefixIndex, TrigramIndex, normalize_query
+from nutrients import NUTRIENTS
+
+MAGIC = b'NNFOODDB'
+VERSION = 1
+
+NUTRIENT_COLUMNS = NUTRIENTS
+FLOAT_COLUMNS = NUTRIENT_COLUMNS + ('serving_g', 'popularity')
+
+# Accepted spellings of the source columns, first match wins
+SOURCE_ALIASES = {
+    'name': ('name', 'description', 'food_name'),
+    'calories': ('calories', 'energy_kcal', 'kcal'),
+    'protein_g': ('protein_g', 'protein'),
+    'carbs_g': ('carbs_g', 'carbohydrate_g', 'carbs'),
+    'fat_g': ('fat_g', 'total_fat_g', 'fat'),
+    'fiber_g': ('fiber_g', 'fiber'),
+    'serving_g': ('serving_g', 'grams'),
+    'popularity': ('popularity',)
+}
+
+
+class BlobStrings:
+    """Read-only sequence of strings stored as one UTF-8 blob plus offsets"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+
+class FoodDatabase:
+    """Read-only view over a memory-mapped food database file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_length = struct.unpack_from('<8sII', self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} food database')
+        header = json.loads(self._mmap[16:16 + header_length])
+        self.rows = header['rows']
+
+        sections = {}
+        for name, section in header['sections'].items():
+            sections[name] = np.frombuffer(self._mmap, dtype=section['dtype'],
+                                           count=section['count'], offset=section['offset'])
+        self._columns = {name: sections[name] for name in FLOAT_COLUMNS}
+        self._names = BlobStrings(sections['name_offsets'], sections['name_blob'])
+        self._keys = BlobStrings(sections['key_offsets'], sections['key_blob'])
+        self._prefix_exact = sections['prefix_exact']
+        self._prefix_index = PrefixIndex(
+            BlobStrings(sections['prefix_offsets'], sections['prefix_blob']),
+            sections['prefix_rows'],
+            sections['popularity']
+        )
+        self._search_index = TrigramIndex(
+            sections['trigram_offsets'], sections['trigram_postings'], sections['trigram_sizes']
+        )
+
+    def __len__(self):
+        return self.rows
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def _find(self, key):
+        """Return the row whose normalized name equals key, or None (binary search)"""
+        names = self._prefix_index.names
+        position = bisect.bisect_left(names, key)
+        while position < len(names) and names[position] == key:
+            if self._prefix_exact[position]:
+                return int(self._prefix_index.rows[position])
+            position += 1
+        return None
+
+    def column(self, name):
+        """Return a whole nutrient column as a read-only float32 array"""
+        return self._columns[name]
+
+    def row(self, row):
+        """Return the nutrition data for a row in the same shape as the built-in catalog"""
+        serving_g = float(self._columns['serving_g'][row])
+        nutrition = {'food_name': f"{self._names[row]} ({serving_g:g} g)", 'serving_g': serving_g}
+        for name in NUTRIENT_COLUMNS:
+            nutrition[name] = round(float(self._columns[name][row]), 1)
+        return nutrition
+
+    def vectors(self, rows):
+        """Return the per-100 g nutrient matrix of several rows, gathered from the columns in one pass"""
+        rows = np.asarray(rows, dtype=np.int64)
+        values = np.stack([self._columns[name][rows] for name in NUTRIENT_COLUMNS], axis=1)
+        serving_g = self._columns['serving_g'][rows]
+        return values * (100.0 / np.where(serving_g > 0, serving_g, 100.0))[:, None]
+
+    def get(self, key):
+        row = self._find(key)
+        return self.row(row) if row is not None else None
+
+    def nutrients(self, key):
+        """Return (per-100 g nutrient vector, portions in grams) for key, or None"""
+        row = self._find(key)
+        if row is None:
+            return None
+        return self.vectors([row])[0], {'serving': float(self._columns['serving_g'][row])}
+
+    def match(self, query):
+        """Exact lookup of a query; partial matches go through search()"""
+        key = normalize_query(query)
+        if key and self._find(key) is not None:
+            return key, True
+        return None
+
+    def search(self, query, limit=10, min_score=0.0):
+        normalized = normalize_query(query)
+        if not normalized:
+            return []
+        return [(self._keys[row], score)
+                for row, score in self._search_index.search(normalized, limit=limit, min_score=min_score)]
+
+    def autocomplete(self, prefix, limit=10):
+        normalized = normalize_query(prefix)
+        if not normalized:
+            return []
+        return [self._keys[row] for row in self._prefix_index.complete(normalized, limit=limit)]
+
+    def close(self):
+        """Unmap the file; the database and the columns taken from it must not be used afterwards"""
+        # The section arrays are views of the mapping, which cannot be closed while they exist
+        self._columns = self._names = self._keys = self._prefix_exact = None
+        self._prefix_index = self._search_index = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # A column() array is still referenced; the mapping is released once it is gone
+            pass
+
+
+def open_food_database(path):
+    """Open the food database at path, or return None if it is missing or unreadable"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        database = FoodDatabase(path)
+        logging.info(f"Loaded food database with {len(database)} foods from {path}")
+        return database
+    except (OSError, ValueError) as e:
+        logging.error(f"Could not open food database {path}: {str(e)}")
+        return None
+
+
+def _source_value(record, column):
+    for alias in SOURCE_ALIASES[column]:
+        value = record.get(alias)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def read_source(path):
+    """Yield food records from a CSV file or a JSON list of objects"""
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as handle:
+            yield from json.load(handle)
+    else:
+        with open(path, newline='', encoding='utf-8') as handle:
+            yield from csv.DictReader(handle)
+
+
+def _blob(strings):
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def build_food_database(records, path):
+    """Write records (dicts with a name and nutrient values) to a food database file.
+
+    Foods whose normalized names collide are stored once, keeping the most
+    popular. Returns the number of foods written.
+    """
+    foods = {}
+    for record in records:
+        name = (_source_value(record, 'name') or '').strip()
+        key = normalize_query(name)
+        if not key:
+            continue
+        values = []
+        for column in FLOAT_COLUMNS:
+            value = _source_value(record, column)
+            default = 100.0 if column == 'serving_g' else 0.0
+            values.append(float(value) if value is not None else default)
+        if key not in foods or values[-1] > foods[key][2][-1]:
+            foods[key] = (key, name, values)
+
+    rows = sorted(foods.values())
+    keys = [key for key, _, _ in rows]
+    columns = np.asarray([values for _, _, values in rows], dtype=np.float32).reshape(len(rows), len(FLOAT_COLUMNS))
+
+    # Completions: every word-start suffix of every key, flagged when it is the whole key
+    entries = []
+    for row, key in enumerate(keys):
+        words = key.split(' ')
+        for i in range(len(words)):
+            entries.append((' '.join(words[i:]), row, i == 0))
+    entries.sort()
+    prefix_offsets, prefix_blob = _blob([text for text, _, _ in entries])
+
+    trigrams = TrigramIndex.build(keys)
+    name_offsets, name_blob = _blob([name for _, name, _ in rows])
+    key_offsets, key_blob = _blob(keys)
+
+    sections = [(column, np.ascontiguousarray(columns[:, i])) for i, column in enumerate(FLOAT_COLUMNS)]
+    sections += [
+        ('name_offsets', name_offsets), ('name_blob', name_blob),
+        ('key_offsets', key_offsets), ('key_blob', key_blob),
+        ('prefix_offsets', prefix_offsets), ('prefix_blob', prefix_blob),
+        ('prefix_rows', np.asarray([row for _, row, _ in entries], dtype=np.int32)),
+        ('prefix_exact', np.asarray([exact for _, _, exact in entries], dtype=np.uint8)),
+        ('trigram_offsets', trigrams.offsets), ('trigram_postings', trigrams.postings),
+        ('trigram_sizes', trigrams.sizes)
+    ]
+
+    # The header holds the section offsets, so size it with oversized placeholder
+    # offsets first and start the data after that, then fill in the real offsets
+    def layout(data_start):
+        header = {'rows': len(rows), 'sections': {}}
+        offset = data_start
+        for name, array in sections:
+            header['sections'][name] = {'dtype': array.dtype.str, 'offset': offset, 'count': int(array.size)}
+            offset += -(-array.nbytes // 8) * 8
+        return header
+
+    header_bytes = json.dumps(layout(10 ** 15)).encode('utf-8')
+    data_start = -(-(16 + len(header_bytes)) // 8) * 8
+    header_bytes = json.dumps(layout(data_start)).encode('utf-8')
+
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as handle:
+        handle.write(struct.pack('<8sII', MAGIC, VERSION, len(header_bytes)))
+        handle.write(header_bytes)
+        handle.write(b'\0' * (data_start - handle.tell()))
+        for _, array in sections:
+            handle.write(array.tobytes())
+            handle.write(b'\0' * (-array.nbytes % 8))
+    # Replace atomically so running workers keep their mapping of the old file
+    os.replace(temporary_path, path)
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build a memory-mapped food database from CSV or JSON.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='convert a CSV/JSON food list into a food database file')
+    build.add_argument('source', help='CSV file with a header row, or JSON list of objects')
+    build.add_argument('-o', '--output', default=os.path.join('instance', 'foods.fdb'),
+                       help='output path (default: instance/foods.fdb)')
+    args = parser.parse_args(argv)
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    count = build_food_database(read_source(args.source), args.output)
+    print(f'Wrote {count} foods to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+Search indexes over food names.
+
+PrefixIndex answers autocomplete queries: names are kept in sorted order, a
+prefix maps to one contiguous range found by binary search, and the most
+popular rows in that range are picked with a vectorized partial sort.
+
+TrigramIndex ranks names by character-trigram similarity (Dice coefficient),
+which tolerates typos such as "brocoli" or "chiken breast". Its postings are
+stored as flat NumPy arrays in compressed sparse row layout: trigram ids are
+dense integers, so the postings for a trigram are a single slice and a query
+costs a handful of array operations regardless of how many names are indexed.
+
+Names passed to the indexes must already be normalized with normalize_query.
+"""
+import bisect
+import math
+import re
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+_ALPHABET = 'abcdefghijklmnopqrstuvwxyz0123456789 '
+_CHAR_CODES = {char: code for code, char in enumerate(_ALPHABET)}
+_OTHER_CODE = len(_ALPHABET)
+_RADIX = len(_ALPHABET) + 1
+
+# Number of distinct trigram ids; every id is below this value
+TRIGRAM_SPACE = _RADIX ** 3
+
+
+def normalize_query(query):
+    """Lower-case a food query and collapse punctuation and whitespace"""
+    return ' '.join(_TOKEN_RE.findall(query.lower()))
+
+
+def trigram_ids(name):
+    """Return the sorted, de-duplicated trigram ids of a normalized name"""
+    codes = [_CHAR_CODES.get(char, _OTHER_CODE) for char in f'  {name} ']
+    return sorted({
+        (codes[i] * _RADIX + codes[i + 1]) * _RADIX + codes[i + 2]
+        for i in range(len(codes) - 2)
+    })
+
+
+class TrigramIndex:
+    """Inverted index from trigram id to the rows (names) containing it"""
+
+    def __init__(self, offsets, postings, sizes):
+        # offsets[t]:offsets[t + 1] delimits the postings of trigram t,
+        # sizes[row] is the number of distinct trigrams in that row's name
+        self.offsets = offsets
+        self.postings = postings
+        self.sizes = sizes
+
+    @classmethod
+    def build(cls, names):
+        sizes = np.zeros(len(names), dtype=np.uint16)
+        trigrams = []
+        rows = []
+        for row, name in enumerate(names):
+            ids = trigram_ids(name)
+            sizes[row] = len(ids)
+            trigrams.extend(ids)
+            rows.extend([row] * len(ids))
+
+        trigrams = np.asarray(trigrams, dtype=np.int64)
+        order = np.argsort(trigrams, kind='stable')
+        postings = np.asarray(rows, dtype=np.int32)[order]
+        offsets = np.zeros(TRIGRAM_SPACE + 1, dtype=np.int64)
+        np.cumsum(np.bincount(trigrams, minlength=TRIGRAM_SPACE), out=offsets[1:])
+        return cls(offsets, postings, sizes)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def search(self, name, limit=10, min_score=0.0):
+        """Return up to limit (row, score) pairs, best first, for a normalized name"""
+        query = trigram_ids(name)
+        if not query or not len(self.sizes):
+            return []
+
+        hits = np.concatenate([self.postings[self.offsets[t]:self.offsets[t + 1]] for t in query])
+        if not len(hits):
+            return []
+
+        # A row scoring at least min_score shares at least `required` trigrams with
+        # the query (Dice >= s implies shared >= s * |q| / (2 - s)), so rows below
+        # that count are dropped before any floating point work is done
+        required = max(1, math.ceil(min_score * len(query) / (2.0 - min_score))) if min_score > 0 else 1
+        shared = np.bincount(hits)
+        candidates = np.flatnonzero(shared >= required)
+        shared = shared[candidates]
+        scores = 2.0 * shared / (len(query) + self.sizes[candidates].astype(np.int64))
+
+        keep = scores >= min_score
+        candidates, scores = candidates[keep], scores[keep]
+        if len(candidates) > limit:
+            # Keep everything above the limit-th best score, then fill up with the
+            # lowest-numbered rows tied at that score so the cut is deterministic
+            cutoff = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+            above = scores > cutoff
+            tied = np.flatnonzero(scores == cutoff)[:limit - int(above.sum())]
+            top = np.concatenate([np.flatnonzero(above), tied])
+            candidates, scores = candidates[top], scores[top]
+
+        # Highest score first, lower row number breaks ties deterministically
+        order = np.lexsort((candidates, -scores))
+        return [(int(candidates[i]), round(float(scores[i]), 4)) for i in order]
+
+
+class PrefixIndex:
+    """Sorted array of names supporting popularity-ranked prefix lookups"""
+
+    def __init__(self, names, rows, weights):
+        # names[i] is the i-th name in sorted order and rows[i] the row it belongs to;
+        # weights[row] is the global popularity used to rank completions
+        self.names = names
+        self.rows = rows
+        self.weights = weights
+
+    @classmethod
+    def build(cls, entries, weights):
+        """Build from (name, row) pairs; a row may appear under several names"""
+        entries = sorted(entries)
+        names = [name for name, _ in entries]
+        rows = np.asarray([row for _, row in entries], dtype=np.int32)
+        return cls(names, rows, np.asarray(weights, dtype=np.float32))
+
+    def complete(self, prefix, limit=10):
+        """Return up to limit distinct rows whose names start with prefix, most popular first"""
+        if not prefix:
+            return []
+
+        start = bisect.bisect_left(self.names, prefix)
+        end = bisect.bisect_left(self.names, prefix + '\uffff', lo=start)
+        if start == end:
+            return []
+
+        rows = self.rows[start:end]
+        weights = self.weights[rows]
+        # Over-fetch because a row can match through several of its names
+        wanted = limit * 4
+        positions = np.arange(len(rows))
+        if len(rows) > wanted:
+            positions = np.argpartition(-weights, wanted - 1)[:wanted]
+        # Most popular first, alphabetical order breaks ties
+        positions = positions[np.lexsort((positions, -weights[positions]))]
+
+        results = []
+        for row in rows[positions]:
+            row = int(row)
+            if row not in results:
+                results.append(row)
+                if len(results) == limit:
+                    break
+        return results
@@ -0,0 +1,183 @@
+"""
+MongoDB index declarations and their management.
+
+Models declare the indexes their queries rely on as IndexSpecs (see the
+`indexes` attribute of the classes in models.py). ensure_indexes() creates
+them idempotently; index_report() compares what the collections actually
+have with what the models declare and, through $indexStats, which indexes
+are never used. Indexes marked critical back queries that run on every
+request (login, daily entries); the health check fails while one is missing.
+
+An index whose existing data has to be fixed up first names a migration
+(see migrations.py); ensure_indexes runs it right before building the index,
+and the index only counts as critical once the migration has completed.
+
+The in-memory storage maintains its own indexes, so there is nothing to
+manage when MongoDB is not in use.
+"""
+import logging
+import os
+import threading
+import time
+
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+import migrations
+from storage import MongoStorage
+
+# Seconds the health check reuses an index report before reading the indexes again
+INDEX_HEALTH_TTL = float(os.environ.get('INDEX_HEALTH_TTL', 60))
+
+_health = {'result': None, 'checked_at': 0.0}
+_health_lock = threading.Lock()
+
+
+class IndexSpec:
+    """An index a model needs: key fields with directions, and whether it is unique or critical.
+
+    partial is a partialFilterExpression restricting the index to matching
+    documents, e.g. to make a field unique only where it is set. migration is
+    a function from migrations.py that prepares the data for the index.
+    """
+
+    def __init__(self, keys, unique=False, critical=False, name=None, partial=None, migration=None):
+        self.keys = [(field, direction) for field, direction in keys]
+        self.unique = unique
+        self.critical = critical
+        self.partial = partial
+        self.migration = migration
+        # Same default name MongoDB would give the index
+        self.name = name or '_'.join(f'{field}_{direction}' for field, direction in self.keys)
+
+    def model(self):
+        options = {'partialFilterExpression': self.partial} if self.partial else {}
+        return IndexModel(self.keys, name=self.name, unique=self.unique, **options)
+
+    def matches(self, info):
+        """Whether an entry of index_information() provides this index"""
+        return ([tuple(key) for key in info['key']] == self.keys and bool(info.get('unique')) == self.unique
+                and info.get('partialFilterExpression') == self.partial)
+
+    def __repr__(self):
+        return f"<IndexSpec {self.name}{' unique' if self.unique else ''}{' critical' if self.critical else ''}>"
+
+
+def ensure_indexes(db, models):
+    """Create every declared index that does not exist yet.
+
+    An index's migration runs first, every time the index is still missing,
+    since the data can change again until the index guards it. Returns
+    {'created': [...], 'failed': {name: error}, 'migrated': {migration: result}};
+    an index that cannot be built (e.g. duplicates under a unique index) does
+    not stop the others.
+    """
+    result = {'created': [], 'failed': {}, 'migrated': {}}
+    for model in models:
+        collection = db[model.collection]
+        existing = collection.index_information()
+        for spec in model.indexes:
+            qualified = f'{model.collection}.{spec.name}'
+            if any(spec.matches(info) for info in existing.values()):
+                continue
+            try:
+                if spec.migration:
+                    outcome = migrations.run(db, spec.migration)
+                    result['migrated'][spec.migration.__name__] = outcome
+                    logging.info(f"Ran migration {spec.migration.__name__} for {qualified}: {outcome}")
+                collection.create_indexes([spec.model()])
+                result['created'].append(qualified)
+                logging.info(f"Created index {qualified}")
+            except OperationFailure as e:
+                result['failed'][qualified] = str(e)
+                logging.error(f"Could not create index {qualified}: {str(e)}")
+    return result
+
+
+def _index_usage(collection):
+    """Map index name to the number of operations that used it since the server started, or None"""
+    try:
+        return {stats['name']: stats['accesses']['ops'] for stats in collection.aggregate([{'$indexStats': {}}])}
+    except OperationFailure as e:
+        logging.warning(f"$indexStats unavailable for {collection.name}: {str(e)}")
+        return None
+
+
+def index_report(db, models, usage=True):
+    """Compare the indexes of each model's collection with its declarations.
+
+    Lists declared indexes that are missing (critical ones separately, once
+    their migration has completed), indexes nobody declared, and, when usage is requested, existing indexes
+    that no query has used since the server last started.
+    """
+    report = {'missing': [], 'critical_missing': [], 'undeclared': [], 'unused': []}
+    for model in models:
+        collection = db[model.collection]
+        existing = collection.index_information()
+        for spec in model.indexes:
+            if not any(spec.matches(info) for info in existing.values()):
+                qualified = f'{model.collection}.{spec.name}'
+                report['missing'].append(qualified)
+                if spec.critical and (not spec.migration or migrations.completed(db, spec.migration)):
+                    report['critical_missing'].append(qualified)
+
+        for name, info in existing.items():
+            if name != '_id_' and not any(spec.matches(info) for spec in model.indexes):
+                report['undeclared'].append(f'{model.collection}.{name}')
+
+        if usage:
+            operations = _index_usage(collection)
+            for name, count in (operations or {}).items():
+                if name != '_id_' and count == 0:
+                    report['unused'].append(f'{model.collection}.{name}')
+    return report
+
+
+def _remember_health(report):
+    result = not report['critical_missing'], {'storage': 'mongodb', **report}
+    with _health_lock:
+        _health['result'], _health['checked_at'] = result, time.monotonic()
+    return result
+
+
+def index_health(storage, models):
+    """Return (healthy, details) for the health check: unhealthy while a critical index is missing.
+
+    The report of the last check (or of bootstrap_indexes) is reused for
+    INDEX_HEALTH_TTL seconds, so frequent probes do not read every collection's indexes.
+    """
+    if not isinstance(storage, MongoStorage):
+        return True, {'storage': 'memory'}
+    with _health_lock:
+        if _health['result'] is not None and time.monotonic() - _health['checked_at'] < INDEX_HEALTH_TTL:
+            return _health['result']
+    try:
+        report = index_report(storage.db, models, usage=False)
+    except PyMongoError as e:
+        return False, {'storage': 'mongodb', 'error': str(e)}
+    return _remember_health(report)
+
+
+def bootstrap_indexes(storage, models, create=False):
+    """Verify the declared indexes at startup, creating them first only when asked to; never raises.
+
+    Creating runs migrations and index builds, which belong in a single deploy
+    step (`flask indexes ensure`) rather than in every worker that starts.
+    """
+    if not isinstance(storage, MongoStorage):
+        return
+    try:
+        if create:
+            ensure_indexes(storage.db, models)
+        report = index_report(storage.db, models)
+    except PyMongoError as e:
+        logging.error(f"Index bootstrap failed: {str(e)}")
+        return
+    _remember_health(report)
+
+    if report['critical_missing']:
+        logging.error(f"Critical MongoDB indexes missing: {', '.join(report['critical_missing'])}")
+    elif report['missing']:
+        logging.warning(f"MongoDB indexes missing: {', '.join(report['missing'])}")
+    if report['unused']:
+        logging.info(f"MongoDB indexes unused since server start: {', '.join(report['unused'])}")
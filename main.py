@@ -1,6 +1,16 @@
+import os
+
 from app import app
 import models  # Import models so they're registered
 import routes  # Import routes to register URL handlers
+import commands  # Import CLI commands (flask indexes ...)
+from app import storage
+from indexes import bootstrap_indexes
+
+# Report missing or unused MongoDB indexes; /health fails while a critical one is missing.
+# Indexes (and the migrations before them) are built by the deploy step `flask indexes ensure`,
+# not by every worker that boots; set MONGO_ENSURE_INDEXES=1 to build them at startup instead
+bootstrap_indexes(storage, models.MODELS, create=os.environ.get('MONGO_ENSURE_INDEXES', '0') == '1')
 
 # Register Firebase authentication blueprint
 try:
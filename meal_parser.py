@@ -0,0 +1,137 @@
+"""
+Local parser for free-text meal descriptions.
+
+"2 eggs, a banana and 1 cup skim milk" is split into items, and each item into
+a quantity, an optional unit and a food phrase:
+
+    [ParsedItem('2 eggs', 2.0, None, 'eggs'),
+     ParsedItem('a banana', 1.0, None, 'banana'),
+     ParsedItem('1 cup skim milk', 1.0, 'cup', 'skim milk')]
+
+Parsing is pure string work and never touches the catalog or the network;
+resolving the phrases to foods is done by utils.get_meal_nutrition.
+"""
+import re
+from collections import namedtuple
+
+from nutrients import normalize_unit, parse_amount
+
+ParsedItem = namedtuple('ParsedItem', ['text', 'quantity', 'unit', 'food'])
+
+# Separators that always start a new item
+_ITEM_SPLIT_RE = re.compile(r'\s*(?:[,;\n+&]|\band then\b|\bplus\b)\s*', re.IGNORECASE)
+
+# Conjunctions that usually start a new item ("eggs and toast"), unless the
+# whole phrase is a known food ("mac and cheese")
+_CONJUNCTION_RE = re.compile(r'\s+(?:and|with)\s+', re.IGNORECASE)
+
+_UNICODE_FRACTIONS = {'½': '1/2', '⅓': '1/3', '⅔': '2/3', '¼': '1/4', '¾': '3/4', '⅛': '1/8'}
+
+_NUMBER_WORDS = {
+    'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+    'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12,
+    'half': 0.5, 'quarter': 0.25, 'dozen': 12, 'couple': 2, 'few': 3
+}
+
+# Words that multiply the quantity before them ("two dozen", "a half")
+_MULTIPLIER_WORDS = {'half', 'quarter', 'dozen'}
+
+# "2", "1.5" or "1/2", optionally glued to a unit ("200g")
+_QUANTITY_RE = re.compile(r'^(\d+/\d+|\d+(?:\.\d+)?)(?=[a-zA-Z]|$)')
+
+_FILLER_WORDS = {'of', 'some', 'about', 'around', 'approximately', 'roughly'}
+
+# Unit aliases that are also adjectives of the food ("whole wheat bread", "large eggs")
+_SIZE_WORDS = {'whole', 'large', 'small', 'medium'}
+
+
+def _parse_quantity(words):
+    """Consume a leading quantity from words; returns (quantity, remaining words)"""
+    if not words:
+        return None, words
+
+    match = _QUANTITY_RE.match(words[0])
+    if match:
+        quantity = parse_amount(match.group(1))
+        rest = words[0][match.end():]
+        words = ([rest] if rest else []) + words[1:]
+        # "1 1/2 cups"
+        if not rest and words and re.fullmatch(r'\d+/\d+', words[0]):
+            quantity += parse_amount(words[0])
+            words = words[1:]
+        return quantity, words
+
+    quantity = None
+    while words and words[0].lower() in _NUMBER_WORDS:
+        word = words[0].lower()
+        value = _NUMBER_WORDS[word]
+        if quantity is None:
+            quantity = value
+        elif word in _MULTIPLIER_WORDS:
+            quantity *= value
+        elif quantity == 1:
+            # "a couple", "a few": the article does not count
+            quantity = value
+        words = words[1:]
+    return quantity, words
+
+
+def parse_item(text, resolves=None):
+    """Split one item such as '2 slices of whole wheat bread' into a ParsedItem.
+
+    A size word ('whole', 'large', ...) is only taken as the piece unit when
+    resolves(phrase) says the phrase without it is a food and the phrase with
+    it is not; otherwise (and without resolves) it stays part of the food.
+    """
+    for symbol, fraction in _UNICODE_FRACTIONS.items():
+        text = text.replace(symbol, f' {fraction} ')
+    words = text.split()
+
+    quantity, words = _parse_quantity(words)
+    while words and words[0].lower() in _FILLER_WORDS:
+        words = words[1:]
+    unit = None
+    # A unit needs a food after it: "2 cups rice", but not "2 l" on its own
+    if len(words) > 1 and normalize_unit(words[0]) is not None and _is_unit(words, resolves):
+        unit = normalize_unit(words[0])
+        words = words[1:]
+
+    while words and words[0].lower() in _FILLER_WORDS:
+        words = words[1:]
+
+    return ParsedItem(' '.join(text.split()), float(quantity) if quantity is not None else 1.0, unit, ' '.join(words))
+
+
+def _is_unit(words, resolves):
+    if words[0].lower() not in _SIZE_WORDS:
+        return True
+    if resolves is None or resolves(' '.join(words)):
+        return False
+    return bool(resolves(' '.join(words[1:])))
+
+
+def split_items(text, is_food=None):
+    """Split a meal description into item strings.
+
+    is_food(phrase) is consulted before splitting on 'and' / 'with', so dishes
+    whose names contain those words stay whole.
+    """
+    items = []
+    for chunk in _ITEM_SPLIT_RE.split(text or ''):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        if is_food is not None and is_food(parse_item(chunk).food):
+            items.append(chunk)
+            continue
+        items.extend(part for part in _CONJUNCTION_RE.split(chunk) if part.strip())
+    return items
+
+
+def parse_meal(text, is_food=None, resolves=None):
+    """Parse a free-text meal description into ParsedItems, skipping items without a food.
+
+    is_food decides splits on 'and' / 'with' (see split_items), resolves size
+    words (see parse_item).
+    """
+    return [item for item in (parse_item(part, resolves) for part in split_items(text, is_food)) if item.food]
@@ -0,0 +1,446 @@
+"""
+Day meal plans built from catalog foods that meet a recommendation's macro targets.
+
+A day is a fixed set of meal slots ("a protein, a grain and a vegetable for
+lunch"). The planner fills the slots with catalog foods that the diet type and
+the user's allergies allow, several combinations at a time, and chooses the
+portion of every food by bounded least squares: the day's calories, protein,
+carbs and fat should be as close as possible to the targets (relative error),
+each portion stays within a sensible range for its kind of food, and a small
+penalty keeps portions near their usual size. All combinations of a round are
+solved together as one batched NumPy problem, so a plan takes milliseconds.
+
+Plans are deterministic for their inputs and cached by (targets, diet,
+exclusions), so repeating a request is a cache lookup. Cached plans are shared
+and must not be modified.
+
+A week is seven independent day solves, each preferring a different share of
+the catalog, spread over a process pool with a global cap on solves in flight
+and a per-request deadline. Days not solved in time get a greedy plan from
+their own share of the catalog instead.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+import numpy as np
+
+from cache import LRUCache, TwoTierCache
+from food_catalog import FOOD_CATALOG
+from food_search import normalize_query
+from nutrients import nutrient_dict, scale_nutrients
+
+# Relative deviation from each target a plan may have and still be on target
+PLAN_TOLERANCE = float(os.environ.get('MEAL_PLAN_TOLERANCE', 0.1))
+
+# Food combinations solved per round, and rounds tried before settling for the best plan found
+PLAN_CANDIDATES = int(os.environ.get('MEAL_PLAN_CANDIDATES', 32))
+PLAN_ROUNDS = 3
+
+# Projected gradient iterations per round, and the weight of the usual-portion penalty
+_ITERATIONS = 300
+_PORTION_PENALTY = 0.01
+
+# Worker processes solving the days of weekly plans (0 solves them in the calling thread), the
+# most day solves in flight at once across all requests, and seconds a weekly plan may take
+PLAN_WORKERS = int(os.environ.get('MEAL_PLAN_WORKERS', min(4, os.cpu_count() or 1)))
+PLAN_MAX_IN_FLIGHT = int(os.environ.get('MEAL_PLAN_MAX_IN_FLIGHT', 2 * max(PLAN_WORKERS, 1)))
+PLAN_DEADLINE = float(os.environ.get('MEAL_PLAN_DEADLINE', 2.0))
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_IN_FLIGHT = threading.BoundedSemaphore(PLAN_MAX_IN_FLIGHT)
+
+PLAN_STATS = {'weeks': 0, 'solves': 0, 'deadline_fallbacks': 0}
+_PLAN_STATS_LOCK = threading.Lock()
+
+MEAL_PLAN_CACHE = TwoTierCache(LRUCache(
+    max_entries=int(os.environ.get('MEAL_PLAN_CACHE_SIZE', 2048)),
+    ttl=int(os.environ.get('MEAL_PLAN_CACHE_TTL', 24 * 3600))
+))
+
+# Slots of each meal, as the food categories (see food_catalog.FOOD_TAGS) that may fill them;
+# a slot no allowed food can fill is left out
+MEAL_SLOTS = {
+    'breakfast': [('cereal', 'bread'), ('dairy', 'egg', 'nuts'), ('fruit',)],
+    'lunch': [('protein', 'legume'), ('grain', 'bread', 'starch', 'legume'), ('vegetable',), ('fat',)],
+    'dinner': [('protein', 'legume'), ('grain', 'starch'), ('vegetable',), ('vegetable',), ('fat',)],
+    'snacks': [('fruit', 'dairy'), ('nuts',)]
+}
+
+# (smallest, largest, usual) portion in grams for each category
+PORTIONS = {
+    'fruit': (50, 300, 150),
+    'vegetable': (50, 300, 120),
+    'starch': (80, 400, 180),
+    'protein': (60, 300, 150),
+    'legume': (60, 350, 150),
+    'egg': (50, 200, 100),
+    'dairy': (30, 400, 200),
+    'grain': (50, 350, 150),
+    'bread': (25, 120, 60),
+    'cereal': (30, 100, 45),
+    'nuts': (10, 60, 28),
+    'fat': (0, 40, 10)
+}
+
+# Portions are rounded to this many grams
+PORTION_STEP = 5
+
+# No portion is larger than this many of the food's catalog servings (cheese is not eaten like yogurt)
+MAX_SERVINGS = 3
+
+# Tags each diet type rules out
+DIET_EXCLUDED_TAGS = {
+    'vegan': {'meat', 'poultry', 'fish', 'shellfish', 'egg', 'dairy'},
+    'vegetarian': {'meat', 'poultry', 'fish', 'shellfish'},
+    'pescatarian': {'meat', 'poultry'},
+    'keto': {'grain', 'bread', 'cereal', 'starch', 'legume', 'sweet_fruit'},
+    'paleo': {'grain', 'bread', 'cereal', 'legume', 'dairy', 'peanut'},
+    'gluten_free': {'gluten'}
+}
+
+# Allergy words and the tags they rule out; any other word rules out the catalog food it names
+ALLERGY_TAGS = {
+    'nut': {'tree_nut', 'peanut'}, 'nuts': {'tree_nut', 'peanut'}, 'tree nut': {'tree_nut'},
+    'tree nuts': {'tree_nut'}, 'peanut': {'peanut'}, 'peanuts': {'peanut'},
+    'dairy': {'dairy'}, 'milk': {'dairy'}, 'lactose': {'dairy'},
+    'egg': {'egg'}, 'eggs': {'egg'},
+    'fish': {'fish'}, 'shellfish': {'shellfish'}, 'seafood': {'fish', 'shellfish'},
+    'soy': {'soy'}, 'gluten': {'gluten'}, 'wheat': {'gluten'},
+    'meat': {'meat', 'poultry'}, 'red meat': {'meat'}
+}
+
+# Target order in the solver: calories, protein, carbs and fat, the first four NUTRIENTS
+_TARGETS = ('calories', 'protein_g', 'carbs_g', 'fat_g')
+
+
+def excluded_foods(diet_type=None, allergies=None):
+    """Catalog foods ruled out by a diet type and a free-text allergy list, as a sorted tuple"""
+    tags = set(DIET_EXCLUDED_TAGS.get(diet_type, ()))
+    foods = set()
+    # Split before normalizing, which drops the commas
+    for term in (allergies or '').lower().replace(' and ', ',').replace(' or ', ',').split(','):
+        term = normalize_query(term)
+        if not term:
+            continue
+        if term in ALLERGY_TAGS:
+            tags |= ALLERGY_TAGS[term]
+        else:
+            match = FOOD_CATALOG.match(term)
+            if match:
+                foods.add(match[0])
+    foods.update(key for key in FOOD_CATALOG.keys() if tags.intersection(FOOD_CATALOG.tags(key)))
+    return tuple(sorted(foods))
+
+
+def _category(key):
+    tags = FOOD_CATALOG.tags(key)
+    return tags[0] if tags and tags[0] in PORTIONS else None
+
+
+def _bounds(key):
+    """(smallest, largest, usual) portion of a food in grams"""
+    low, high, usual = PORTIONS[_category(key)]
+    high = max(low, min(high, MAX_SERVINGS * (FOOD_CATALOG.get(key).get('serving_g') or high)))
+    return low, high, min(usual, high)
+
+
+def _slots(excluded, avoid):
+    """(meal, preferred foods, candidate foods) for every slot that allowed foods can fill.
+
+    Foods in avoid are not preferred; they are only used for a slot the
+    preferred foods cannot fill.
+    """
+    slots = []
+    for meal, meal_slots in MEAL_SLOTS.items():
+        for categories in meal_slots:
+            candidates = [key for key in _allowed(excluded) if _category(key) in categories]
+            if candidates:
+                slots.append((meal, [key for key in candidates if key not in avoid], candidates))
+    return slots
+
+
+def _allowed(excluded):
+    return [key for key in FOOD_CATALOG.keys() if key not in excluded and _category(key)]
+
+
+def _combinations(slots, count, rng, prefer=True):
+    """count day combinations of distinct foods, one per slot, as lists of keys"""
+    combinations = []
+    for _ in range(count):
+        chosen = []
+        for _, preferred, candidates in slots:
+            options = ((prefer and [key for key in preferred if key not in chosen])
+                       or [key for key in candidates if key not in chosen] or candidates)
+            chosen.append(options[rng.integers(len(options))])
+        combinations.append(chosen)
+    return combinations
+
+
+def _solve(combinations, targets):
+    """Bounded least-squares portions for many combinations at once.
+
+    Minimizes |A g / t - 1|^2 + penalty * |(g - usual) / usual|^2 subject to
+    the portion bounds, with accelerated projected gradient (FISTA) over the
+    whole batch. Returns (grams, relative deviations), rounded to PORTION_STEP.
+    """
+    keys = [key for combination in combinations for key in combination]
+    count, size = len(combinations), len(combinations[0])
+    # Nutrients per gram divided by the targets: (combination, target, food)
+    vectors = FOOD_CATALOG.vectors(keys).astype(np.float64).reshape(count, size, -1)[:, :, :len(_TARGETS)]
+    scaled = np.transpose(vectors / 100.0, (0, 2, 1)) / targets[None, :, None]
+
+    bounds = np.array([_bounds(key) for key in keys], dtype=np.float64).reshape(count, size, 3)
+    low, high, usual = bounds[:, :, 0], bounds[:, :, 1], bounds[:, :, 2]
+    weight = _PORTION_PENALTY / usual ** 2
+
+    lipschitz = 2 * (np.linalg.norm(scaled, ord=2, axis=(1, 2)) ** 2 + weight.max(axis=1))
+    step = (1.0 / lipschitz)[:, None]
+
+    grams = np.clip(usual, low, high)
+    momentum, t = grams.copy(), 1.0
+    for _ in range(_ITERATIONS):
+        residual = np.einsum('ctn,cn->ct', scaled, momentum) - 1.0
+        gradient = 2 * (np.einsum('ctn,ct->cn', scaled, residual) + weight * (momentum - usual))
+        updated = np.clip(momentum - step * gradient, low, high)
+        t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+        momentum = updated + ((t - 1) / t_next) * (updated - grams)
+        grams, t = updated, t_next
+
+    grams = np.clip(np.round(grams / PORTION_STEP) * PORTION_STEP, low, high)
+    deviation = np.einsum('ctn,cn->ct', scaled, grams) - 1.0
+    return grams, deviation
+
+
+def _build_plan(slots, combination, grams, deviation, targets, diet_type, excluded):
+    items, totals = scale_nutrients(FOOD_CATALOG.vectors(combination), grams)
+    slot_meals = np.array([slot[0] for slot in slots])
+    meals = {}
+    for meal in MEAL_SLOTS:
+        rows = np.flatnonzero((slot_meals == meal) & (grams > 0))
+        meals[meal] = {
+            'items': [{
+                'food': combination[row],
+                'food_name': FOOD_CATALOG.get(combination[row])['food_name'].split('(')[0].strip(),
+                'grams': float(grams[row]),
+                **nutrient_dict(items[row])
+            } for row in rows],
+            'totals': nutrient_dict(items[rows].sum(axis=0))
+        }
+
+    return {
+        'targets': dict(zip(_TARGETS, (float(value) for value in targets))),
+        'diet_type': diet_type,
+        'excluded': list(excluded),
+        'meals': meals,
+        'totals': nutrient_dict(totals),
+        'deviation': {name: round(float(value), 3) for name, value in zip(_TARGETS, deviation)},
+        'within_tolerance': bool(np.all(np.abs(deviation) <= PLAN_TOLERANCE))
+    }
+
+
+def _request(calories, protein, carbs, fats, diet_type, allergies, avoid, seed):
+    """Normalized (targets, excluded foods, avoided foods, cache key) of a plan request"""
+    targets = np.maximum(np.array([calories, protein, carbs, fats], dtype=np.float64), 1.0)
+    excluded = excluded_foods(diet_type, allergies)
+    avoid = tuple(sorted(set(avoid)))
+    cache_key = '|'.join([','.join(f'{value:g}' for value in targets), str(diet_type), ','.join(excluded),
+                          ','.join(avoid), str(seed)])
+    return targets, excluded, avoid, cache_key
+
+
+def plan_day(calories, protein, carbs, fats, diet_type=None, allergies=None, avoid=(), seed=0):
+    """Plan a day of meals whose totals land near the given calorie and macro (grams) targets.
+
+    Respects the foods diet_type and allergies rule out; foods in avoid are
+    used only where nothing else fits, and seed picks among equally valid
+    plans. Returns the plan dictionary; 'within_tolerance' tells whether every
+    target is met within PLAN_TOLERANCE.
+    """
+    targets, excluded, avoid, cache_key = _request(calories, protein, carbs, fats, diet_type, allergies, avoid, seed)
+    plan = MEAL_PLAN_CACHE.get(cache_key)
+    if plan is not None:
+        return plan
+
+    slots = _slots(set(excluded), set(avoid))
+    if not slots:
+        raise ValueError('No catalog foods are allowed by this diet and these allergies')
+
+    rng = np.random.default_rng(int(hashlib.sha256(cache_key.encode('utf-8')).hexdigest()[:16], 16))
+    best = None
+    for round_number in range(PLAN_ROUNDS):
+        # Later rounds may use avoided foods, in case the targets cannot be met without them
+        combinations = _combinations(slots, PLAN_CANDIDATES, rng, prefer=round_number == 0)
+        grams, deviation = _solve(combinations, targets)
+        # The plan with the smallest worst-case deviation, so tolerance is met on every target
+        score = np.abs(deviation).max(axis=1)
+        i = int(np.argmin(score))
+        if best is None or score[i] < best[0]:
+            best = (score[i], combinations[i], grams[i], deviation[i])
+        if best[0] <= PLAN_TOLERANCE:
+            break
+
+    plan = _build_plan(slots, best[1], best[2], best[3], targets, diet_type, excluded)
+    MEAL_PLAN_CACHE.set(cache_key, plan)
+    return plan
+
+
+def _greedy_day(calories, protein, carbs, fats, diet_type, allergies, avoid):
+    """A quick plan without solving: one preferred food per slot at its usual portion,
+    all portions scaled together to the calorie target.
+
+    Used for the days of a week whose solve misses the deadline; it keeps to
+    the day's share of the catalog, so the days still differ. Not cached.
+    """
+    targets, excluded, avoid, _ = _request(calories, protein, carbs, fats, diet_type, allergies, avoid, 0)
+    slots = _slots(set(excluded), set(avoid))
+    combination = _combinations(slots, 1, np.random.default_rng(0))[0]
+    bounds = np.array([_bounds(key) for key in combination], dtype=np.float64)
+    low, high, usual = bounds[:, 0], bounds[:, 1], bounds[:, 2]
+    # Nutrients per gram: (target, food)
+    per_gram = FOOD_CATALOG.vectors(combination).astype(np.float64)[:, :len(_TARGETS)].T / 100.0
+    calories_usual = per_gram[0] @ usual
+    grams = usual * (targets[0] / calories_usual if calories_usual > 0 else 1.0)
+    grams = np.clip(np.round(grams / PORTION_STEP) * PORTION_STEP, low, high)
+    deviation = per_gram @ grams / targets - 1.0
+    return _build_plan(slots, combination, grams, deviation, targets, diet_type, excluded)
+
+
+def _week_avoid(excluded, days):
+    """Foods each day of a week should avoid, so days use different foods where the catalog allows.
+
+    The allowed foods of every category are dealt out to the days in turn
+    (at least two per day, so a day still has a choice); a day avoids the
+    foods dealt to other days.
+    """
+    allowed = _allowed(excluded)
+    shares = [set() for _ in range(days)]
+    for category in PORTIONS:
+        pool = [key for key in allowed if _category(key) == category]
+        if not pool:
+            continue
+        per_day = max(2, -(-len(pool) // days))
+        for day in range(days):
+            shares[day].update(pool[(day * per_day + i) % len(pool)] for i in range(per_day))
+    return [tuple(sorted(set(allowed) - share)) for share in shares]
+
+
+def _pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            # Spawned, not forked: the pool starts from a threaded server process holding a MongoClient.
+            # Spawned workers import the entry module again, which must keep its server start behind __main__.
+            _POOL = ProcessPoolExecutor(max_workers=PLAN_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _POOL
+
+
+def _discard_pool(pool):
+    """Drop a pool whose worker died, so the next week starts a new one"""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is pool:
+            _POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _count(name, amount=1):
+    with _PLAN_STATS_LOCK:
+        PLAN_STATS[name] += amount
+
+
+def _finished(future, cache_key):
+    """Done callback of a day solve: frees its in-flight slot and caches the plan, even past the deadline"""
+    _IN_FLIGHT.release()
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logging.error(f"Meal plan solve failed: {str(error)}")
+        return
+    MEAL_PLAN_CACHE.set(cache_key, future.result())
+
+
+def plan_week(calories, protein, carbs, fats, diet_type=None, allergies=None, days=7, deadline=None):
+    """Plan several days with different foods, solving the days in parallel in the process pool.
+
+    At most PLAN_MAX_IN_FLIGHT solves run at once across all requests. Days
+    that are not solved within deadline seconds (PLAN_DEADLINE by default)
+    get a greedy plan from their own foods, marked as a fallback; their solves
+    keep running and are cached, so asking again soon returns the complete week.
+    Returns {'days': [{'day', 'plan', 'fallback'}], 'complete': bool}.
+    """
+    deadline_at = time.monotonic() + (PLAN_DEADLINE if deadline is None else deadline)
+    excluded = excluded_foods(diet_type, allergies)
+    if not _slots(set(excluded), set()):
+        raise ValueError('No catalog foods are allowed by this diet and these allergies')
+
+    requests = [(calories, protein, carbs, fats, diet_type, allergies, avoid, day)
+                for day, avoid in enumerate(_week_avoid(excluded, days))]
+    plans = [MEAL_PLAN_CACHE.get(_request(*request)[3]) for request in requests]
+    missing = [day for day, plan in enumerate(plans) if plan is None]
+
+    if PLAN_WORKERS <= 0:
+        for day in missing:
+            if time.monotonic() >= deadline_at:
+                break
+            plans[day] = plan_day(*requests[day])
+    elif missing:
+        futures = {}
+        for day in missing:
+            if not _IN_FLIGHT.acquire(timeout=max(0.0, deadline_at - time.monotonic())):
+                break
+            pool = _pool()
+            try:
+                future = pool.submit(plan_day, *requests[day])
+            except BrokenProcessPool as e:
+                _IN_FLIGHT.release()
+                logging.error(f"Meal plan pool broken, starting a new one: {str(e)}")
+                _discard_pool(pool)
+                break
+            future.add_done_callback(partial(_finished, cache_key=_request(*requests[day])[3]))
+            futures[future] = day
+        done, not_done = wait(futures, timeout=max(0.0, deadline_at - time.monotonic()))
+        for future in not_done:
+            future.cancel()
+        for future in done:
+            if future.exception() is None:
+                plans[futures[future]] = future.result()
+        _count('solves', len(futures))
+
+    fallbacks = [day for day, plan in enumerate(plans) if plan is None]
+    for day in fallbacks:
+        plans[day] = _greedy_day(*requests[day][:7])
+    _count('weeks')
+    if fallbacks:
+        _count('deadline_fallbacks', len(fallbacks))
+    return {
+        'days': [{'day': day, 'plan': plan, 'fallback': day in fallbacks} for day, plan in enumerate(plans)],
+        'complete': not fallbacks
+    }
+
+
+def plan_foods(plan):
+    """A day plan's items as tracker foods per meal: catalog per-serving values with the planned grams"""
+    foods = {}
+    for meal, content in plan['meals'].items():
+        foods[meal] = []
+        for item in content['items']:
+            food = FOOD_CATALOG.get(item['food'])
+            food.update({'quantity': item['grams'], 'unit': 'g', 'source': 'meal_plan'})
+            foods[meal].append(food)
+    return foods
+
+
+def meal_plan_stats():
+    with _PLAN_STATS_LOCK:
+        stats = dict(PLAN_STATS)
+    stats.update({'workers': PLAN_WORKERS, 'max_in_flight': PLAN_MAX_IN_FLIGHT, 'cache': MEAL_PLAN_CACHE.stats()})
+    return stats
@@ -0,0 +1,76 @@
+"""
+Data migrations that have to run before an index can be built.
+
+An IndexSpec names its migration (see indexes.py); ensure_indexes runs it
+before creating the index and records the completion in the `migrations`
+collection. Until that record exists, a missing index is not treated as
+critical: the data it needs is not ready for it yet.
+
+Migrations take a pymongo database and must be safe to run again, both
+after they completed and after they were interrupted.
+"""
+from datetime import datetime
+
+
+def completed(db, migration):
+    """Whether the migration has run to completion on this database"""
+    return db.migrations.find_one({'_id': migration.__name__}) is not None
+
+
+def run(db, migration):
+    """Run a migration and record its completion; returns its result"""
+    result = migration(db)
+    db.migrations.update_one({'_id': migration.__name__},
+                             {'$set': {'completed_at': datetime.utcnow(), 'result': result}}, upsert=True)
+    return result
+
+
+def _merge_entries(keep, duplicates):
+    """keep with the foods, totals, water and notes of the duplicate entries of its day folded in"""
+    merged = dict(keep)
+    merged['meals'] = {meal: list(foods) for meal, foods in (keep.get('meals') or {}).items()}
+    notes = [keep.get('notes')] if keep.get('notes') else []
+    for duplicate in duplicates:
+        for meal, foods in (duplicate.get('meals') or {}).items():
+            known = {food.get('id') for food in merged['meals'].get(meal, [])}
+            merged['meals'].setdefault(meal, []).extend(food for food in foods if food.get('id') not in known)
+        for field, value in duplicate.items():
+            if field.startswith('total_'):
+                merged[field] = (merged.get(field) or 0) + (value or 0)
+        # Water intake is set, not accumulated: keep the largest value logged
+        merged['water_intake'] = max(merged.get('water_intake') or 0, duplicate.get('water_intake') or 0)
+        if duplicate.get('notes') and duplicate['notes'] not in notes:
+            notes.append(duplicate['notes'])
+    merged['notes'] = '\n'.join(notes)
+    return merged
+
+
+def merge_duplicate_entries(db):
+    """Merge nutrition entries of the same user and day into the oldest one.
+
+    Needed before the unique (user_id, date) index can be built. Foods are
+    combined and totals added up. Every entry of a day is first copied to
+    merged_nutrition_entries (with merged_into), and the merged entry is built
+    from those copies, so a rerun after an interruption writes the same entry
+    again instead of counting a duplicate twice. Returns the number of entries removed.
+    """
+    pipeline = [
+        {'$group': {'_id': {'user_id': '$user_id', 'date': '$date'}, 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ]
+    removed = 0
+    for group in db.nutrition_entries.aggregate(pipeline, allowDiskUse=True):
+        documents = list(db.nutrition_entries.find({'_id': {'$in': group['ids']}}).sort([('created_at', 1), ('_id', 1)]))
+        keep = documents[0]
+        archived = {}
+        for document in db.merged_nutrition_entries.find({'_id': {'$in': group['ids']}}):
+            document.pop('merged_into', None)
+            archived[document['_id']] = document
+        new = [document for document in documents if document['_id'] not in archived]
+        if new:
+            db.merged_nutrition_entries.insert_many([{**document, 'merged_into': keep['_id']} for document in new])
+        originals = [archived.get(document['_id'], document) for document in documents]
+        db.nutrition_entries.replace_one({'_id': keep['_id']}, _merge_entries(originals[0], originals[1:]))
+        db.nutrition_entries.delete_many({'_id': {'$in': [document['_id'] for document in documents[1:]]}})
+        removed += len(documents) - 1
+    return removed
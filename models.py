@@ -2,8 +2,18 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 from bson.objectid import ObjectId
-from app import mongo, login_manager
+from flask import g, has_request_context
+from app import storage, login_manager
+from cache import LRUCache, TwoTierCache
+from indexes import IndexSpec
+from migrations import merge_duplicate_entries
+from storage import decode_cursor, encode_cursor, meal_path, period_start
+from nutrients import food_totals
+from trends import METRICS as TREND_METRICS, WINDOW as TREND_WINDOW, rolling_stats
 import logging
+import os
+
+import numpy as np
 
 # Import Firebase configuration
 try:
@@ -13,7 +23,23 @@ except Exception as e:
     logging.error(f"Firebase import error: {str(e)}")
     FIREBASE_ENABLED = False
 
+# Users loaded for authenticated requests, shared by the requests a worker serves. Other workers
+# see a profile change after at most USER_CACHE_TTL seconds; the worker that saved it sees it at once.
+USER_CACHE = TwoTierCache(LRUCache(
+    max_entries=int(os.environ.get("USER_CACHE_SIZE", 10000)),
+    ttl=int(os.environ.get("USER_CACHE_TTL", 60))
+))
+
+# Fields left out when loading the user behind a session
+SESSION_PROJECTION = {'password_hash': False}
+
 class User(UserMixin):
+    collection = 'users'
+    indexes = [
+        IndexSpec([('email', 1)], unique=True, critical=True),     # login, Firebase sign-in
+        IndexSpec([('username', 1)], unique=True, critical=True)   # registration checks
+    ]
+    
     def __init__(self, username=None, email=None, password_hash=None, _id=None, **kwargs):
         self._id = _id if _id else None
         self.username = username
@@ -43,7 +69,8 @@ class User(UserMixin):
         self.password_hash = generate_password_hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        # Users loaded for a session have no password hash (see SESSION_PROJECTION)
+        return bool(self.password_hash) and check_password_hash(self.password_hash, password)
     
     @classmethod
     def create_firebase_user(cls, firebase_user_data):
@@ -78,35 +105,17 @@ class User(UserMixin):
             return user
     
     def save(self):
-        # Check if mongo is using in-memory storage
-        if not hasattr(mongo.db.users, 'update_one'):
-            if self._id:
-                # Update in-memory user
-                for i, user in enumerate(mongo.db.users):
-                    if user.get('_id') == self._id:
-                        mongo.db.users[i] = self.to_dict()
-                        mongo.db.users[i]['_id'] = self._id
-                        break
-            else:
-                # Create new user with ObjectId
-                self._id = ObjectId()
-                user_dict = self.to_dict()
-                user_dict['_id'] = self._id
-                mongo.db.users.append(user_dict)
+        if self._id:
+            storage.update_user(self._id, self.to_dict())
+            self.invalidate_cache(self._id)
         else:
-            # Standard MongoDB operations
-            if self._id:
-                mongo.db.users.update_one({'_id': self._id}, {'$set': self.to_dict()})
-            else:
-                result = mongo.db.users.insert_one(self.to_dict())
-                self._id = result.inserted_id
+            self._id = storage.insert_user(self.to_dict())
         return self
     
     def to_dict(self):
-        return {
+        data = {
             'username': self.username,
             'email': self.email,
-            'password_hash': self.password_hash,
             'created_at': self.created_at,
             'name': self.name,
             'age': self.age,
@@ -118,79 +127,110 @@ class User(UserMixin):
             'health_goals': self.health_goals,
             'allergies': self.allergies
         }
+        # A user loaded without its password hash must not overwrite the stored one
+        if self.password_hash is not None:
+            data['password_hash'] = self.password_hash
+        return data
     
     @property
-    def recommendations(self):
-        # Check if mongo is using in-memory storage
-        if not hasattr(mongo.db.nutrition_recommendations, 'find'):
-            # Filter recommendations for this user and sort by created_at descending
-            return sorted(
-                [rec for rec in mongo.db.nutrition_recommendations if rec.get('user_id') == self._id],
-                key=lambda x: x.get('created_at', datetime.utcnow()),
-                reverse=True
-            )
-        else:
-            return list(mongo.db.nutrition_recommendations.find({'user_id': self._id}).sort('created_at', -1))
+    def latest_recommendation(self):
+        """The recommendation selected last (a single indexed query), memoized for the lifetime of this object.
+        
+        That is the newest one, unless an older one was reused since (see
+        NutritionRecommendation.select). The object behind current_user lives
+        for one request, so this is a per-request memo.
+        """
+        if not hasattr(self, '_latest_recommendation'):
+            self._latest_recommendation = NutritionRecommendation.get_latest(self._id)
+        return self._latest_recommendation
+    
+    @property
+    def recommendation_count(self):
+        if not hasattr(self, '_recommendation_count'):
+            self._recommendation_count = storage.count_recommendations(self._id)
+        return self._recommendation_count
     
     @classmethod
     def get_by_id(cls, user_id):
         try:
-            # Check if mongo is using in-memory storage
-            if not hasattr(mongo.db.users, 'find_one'):
-                for user in mongo.db.users:
-                    if str(user.get('_id')) == str(user_id):
-                        return cls(**user)
-                return None
-            else:
-                user_data = mongo.db.users.find_one({'_id': ObjectId(user_id)})
-                if user_data:
-                    user_data['_id'] = user_data['_id']
-                    return cls(**user_data)
+            user_data = storage.find_user_by_id(user_id)
+            if user_data:
+                return cls(**user_data)
         except Exception as e:
-            print(f"Error in get_by_id: {str(e)}")
-            return None
+            logging.error(f"Error fetching user by ID: {str(e)}")
+        return None
+    
+    @classmethod
+    def get_cached(cls, user_id):
+        """Load the user behind a session, without its password hash.
+        
+        Memoized for the current request and cached in USER_CACHE across
+        requests, so active sessions rarely reach the database.
+        """
+        key = str(user_id)
+        memo = g.setdefault('_users', {}) if has_request_context() else {}
+        user_data = memo.get(key)
+        if user_data is None:
+            user_data = USER_CACHE.get(key)
+        if user_data is None:
+            try:
+                user_data = storage.find_user_by_id(user_id, projection=SESSION_PROJECTION)
+            except Exception as e:
+                logging.error(f"Error fetching user by ID: {str(e)}")
+                return None
+            if user_data is None:
+                return None
+            USER_CACHE.set(key, user_data)
+        memo[key] = user_data
+        return cls(**user_data)
+    
+    @staticmethod
+    def invalidate_cache(user_id):
+        key = str(user_id)
+        USER_CACHE.delete(key)
+        if has_request_context():
+            g.setdefault('_users', {}).pop(key, None)
     
     @classmethod
     def get_by_username(cls, username):
-        # Check if mongo is using in-memory storage
-        if not hasattr(mongo.db.users, 'find_one'):
-            for user in mongo.db.users:
-                if user.get('username') == username:
-                    return cls(**user)
-            return None
-        else:
-            user_data = mongo.db.users.find_one({'username': username})
-            if user_data:
-                user_data['_id'] = user_data['_id']
-                return cls(**user_data)
-            return None
+        user_data = storage.find_user_by_username(username)
+        return cls(**user_data) if user_data else None
     
     @classmethod
     def get_by_email(cls, email):
-        # Check if mongo is using in-memory storage
-        if not hasattr(mongo.db.users, 'find_one'):
-            for user in mongo.db.users:
-                if user.get('email') == email:
-                    return cls(**user)
-            return None
-        else:
-            user_data = mongo.db.users.find_one({'email': email})
-            if user_data:
-                user_data['_id'] = user_data['_id']
-                return cls(**user_data)
-            return None
+        user_data = storage.find_user_by_email(email)
+        return cls(**user_data) if user_data else None
 
     def __repr__(self):
         return f'<User {self.username}>'
 
 
 class NutritionRecommendation:
+    collection = 'nutrition_recommendations'
+    indexes = [
+        # Keyset-paginated history, newest first with _id breaking ties
+        IndexSpec([('user_id', 1), ('created_at', -1), ('_id', -1)], critical=True),
+        # Latest recommendation: the one selected last, which may be an older one reused
+        IndexSpec([('user_id', 1), ('selected_at', -1), ('created_at', -1), ('_id', -1)], critical=True),
+        # Reuse of a recommendation generated from the same inputs; older
+        # recommendations have no inputs_hash and are left out of the index
+        IndexSpec([('user_id', 1), ('inputs_hash', 1)], unique=True,
+                  partial={'inputs_hash': {'$exists': True}})
+    ]
+    
     def __init__(self, user_id, diet_type, daily_calories, protein, carbs, fats,
                  breakfast_suggestion, lunch_suggestion, dinner_suggestion, 
-                 snacks_suggestion, additional_notes, _id=None, created_at=None):
+                 snacks_suggestion, additional_notes, _id=None, created_at=None,
+                 health_focus=None, inputs_hash=None, selected_at=None):
         self._id = _id if _id else None
         self.user_id = user_id
         self.created_at = created_at if created_at else datetime.utcnow()
+        # When the user last got this recommendation, newly generated or reused
+        self.selected_at = selected_at if selected_at else self.created_at
+        
+        # Inputs the recommendation was generated from (see utils.recommendation_inputs_hash)
+        self.health_focus = health_focus
+        self.inputs_hash = inputs_hash
         
         # Recommendation details
         self.diet_type = diet_type
@@ -214,6 +254,7 @@ class NutritionRecommendation:
         data = {
             'user_id': self.user_id,
             'created_at': self.created_at,
+            'selected_at': self.selected_at,
             'diet_type': self.diet_type,
             'daily_calories': self.daily_calories,
             'protein': self.protein,
@@ -225,66 +266,94 @@ class NutritionRecommendation:
             'snacks_suggestion': self.snacks_suggestion,
             'additional_notes': self.additional_notes
         }
+        if self.health_focus is not None:
+            data['health_focus'] = self.health_focus
+        if self.inputs_hash is not None:
+            data['inputs_hash'] = self.inputs_hash
         
-        # Check if mongo is using in-memory storage
-        if not hasattr(mongo.db.nutrition_recommendations, 'update_one'):
-            if self._id:
-                # Update in-memory recommendation
-                for i, rec in enumerate(mongo.db.nutrition_recommendations):
-                    if rec.get('_id') == self._id:
-                        mongo.db.nutrition_recommendations[i] = data
-                        mongo.db.nutrition_recommendations[i]['_id'] = self._id
-                        break
-            else:
-                # Create new recommendation with ObjectId
-                self._id = ObjectId()
-                data['_id'] = self._id
-                mongo.db.nutrition_recommendations.append(data)
+        if self._id:
+            storage.update_recommendation(self._id, data)
+        elif self.inputs_hash is not None:
+            # Content-addressed: if the same inputs were stored meanwhile, adopt (and select) that document
+            stored = storage.insert_recommendation_once(data)
+            self._id = stored['_id']
+            self.created_at = stored['created_at']
+            self.selected_at = stored['selected_at']
         else:
-            # Standard MongoDB operations
-            if self._id:
-                mongo.db.nutrition_recommendations.update_one({'_id': self._id}, {'$set': data})
-            else:
-                result = mongo.db.nutrition_recommendations.insert_one(data)
-                self._id = result.inserted_id
+            self._id = storage.insert_recommendation(data)
+        return self
+    
+    def select(self):
+        """Make this stored recommendation the user's latest again, e.g. when its inputs are reused"""
+        self.selected_at = datetime.utcnow()
+        storage.select_recommendation(self._id, self.selected_at)
         return self
     
     @classmethod
     def get_by_id(cls, rec_id):
-        # Check if mongo is using in-memory storage
-        if not hasattr(mongo.db.nutrition_recommendations, 'find_one'):
-            for rec in mongo.db.nutrition_recommendations:
-                if str(rec.get('_id')) == str(rec_id):
-                    return cls(**rec)
-            return None
-        else:
-            rec_data = mongo.db.nutrition_recommendations.find_one({'_id': ObjectId(rec_id)})
-            if rec_data:
-                rec_data['_id'] = rec_data['_id']
-                return cls(**rec_data)
-            return None
+        rec_data = storage.find_recommendation(rec_id)
+        return cls(**rec_data) if rec_data else None
+    
+    @classmethod
+    def get_by_inputs_hash(cls, user_id, inputs_hash):
+        """The user's recommendation generated from these inputs, if there is one"""
+        rec_data = storage.find_recommendation_by_inputs(user_id, inputs_hash)
+        return cls(**rec_data) if rec_data else None
+    
+    @classmethod
+    def get_latest(cls, user_id):
+        """The user's recommendation selected last, or None"""
+        rec_data = storage.find_latest_recommendation(user_id)
+        return cls(**rec_data) if rec_data else None
     
     @classmethod
     def get_by_user_id(cls, user_id, limit=1):
-        # Check if mongo is using in-memory storage
-        if not hasattr(mongo.db.nutrition_recommendations, 'find'):
-            # Filter recommendations for this user
-            user_recs = [rec for rec in mongo.db.nutrition_recommendations 
-                         if str(rec.get('user_id')) == str(user_id)]
-            # Sort by created_at (descending)
-            user_recs.sort(key=lambda x: x.get('created_at', datetime.utcnow()), reverse=True)
-            # Apply limit
-            user_recs = user_recs[:limit]
-            return [cls(**rec) for rec in user_recs]
-        else:
-            recs = mongo.db.nutrition_recommendations.find({'user_id': user_id}).sort('created_at', -1).limit(limit)
-            return [cls(**rec) for rec in recs]
+        return [cls(**rec) for rec in storage.find_recommendations(user_id, limit=limit)]
+    
+    # Fields returned by history pages; the long suggestion texts are left out
+    HISTORY_PROJECTION = {'_id': True, 'created_at': True, 'diet_type': True, 'daily_calories': True,
+                          'protein': True, 'carbs': True, 'fats': True}
+    
+    @classmethod
+    def get_history(cls, user_id, limit=20, cursor=None):
+        """One page of a user's recommendation history, newest first.
+        
+        Returns (documents, next_cursor); pass next_cursor back to get the
+        following page, it is None on the last page. Raises ValueError for a
+        malformed cursor.
+        """
+        before = decode_cursor(cursor) if cursor else None
+        # Fetch one extra document to know whether another page follows
+        documents = storage.find_recommendations(user_id, limit=limit + 1, before=before,
+                                                 projection=cls.HISTORY_PROJECTION)
+        next_cursor = None
+        if len(documents) > limit:
+            documents = documents[:limit]
+            next_cursor = encode_cursor(documents[-1]['created_at'], documents[-1]['_id'])
+        return documents, next_cursor
     
     def __repr__(self):
         return f'<NutritionRecommendation #{self._id} for User {self.user_id}>'
 
 
 class NutritionEntry:
+    collection = 'nutrition_entries'
+    indexes = [
+        # One entry per user and day (get_or_create_day upserts against it); also serves date-range queries.
+        # Days logged twice before the index existed are merged first.
+        IndexSpec([('user_id', 1), ('date', 1)], unique=True, critical=True, name='user_id_1_date_1_unique',
+                  migration=merge_duplicate_entries)
+    ]
+    
+    # Daily total field for each nutrient
+    TOTALS = {
+        'calories': 'total_calories',
+        'protein_g': 'total_protein',
+        'carbs_g': 'total_carbs',
+        'fat_g': 'total_fat',
+        'fiber_g': 'total_fiber'
+    }
+    
     def __init__(self, user_id, date=None, meals=None, total_calories=0, total_protein=0, 
                  total_carbs=0, total_fat=0, total_fiber=0, water_intake=0, notes="", 
                  _id=None, created_at=None):
@@ -305,6 +374,8 @@ class NutritionEntry:
         self.water_intake = water_intake
         self.notes = notes
         self.created_at = created_at if created_at else datetime.utcnow()
+        # Values already counted in the rollups, so save() adds only the difference
+        self._rolled_up = {field: getattr(self, field) if self._id else 0 for field in NutritionRollup.FIELDS}
     
     @property
     def id(self):
@@ -315,24 +386,32 @@ class NutritionEntry:
         return self.date.strftime('%Y-%m-%d')
     
     def add_food_to_meal(self, meal_type, food_data):
-        """Adds a food item to a specific meal and updates totals"""
+        """Adds a food item to a specific meal and updates totals.
+        
+        food_data holds per-serving values; its optional quantity (servings, or
+        an amount of unit when a unit is given) scales what it adds to the totals.
+        Raises ValueError when the unit cannot be converted for the food.
+        """
+        meal_path(meal_type)  # rejects meal names that are not plain field names
         if meal_type not in self.meals:
             self.meals[meal_type] = []
         
-        # Add timestamp to track when food was added
-        food_data['timestamp'] = datetime.utcnow()
-        
-        # Add unique ID for the food entry
-        food_data['id'] = str(ObjectId())
-        
+        # Raises ValueError before anything changes if the quantity's unit cannot be converted
+        increments = self._increments(food_data, 1)
+        self._prepare_food(food_data)
         self.meals[meal_type].append(food_data)
         
         # Update totals
-        self.total_calories += float(food_data.get('calories', 0))
-        self.total_protein += float(food_data.get('protein_g', 0))
-        self.total_carbs += float(food_data.get('carbs_g', 0))
-        self.total_fat += float(food_data.get('fat_g', 0))
-        self.total_fiber += float(food_data.get('fiber_g', 0))
+        self._apply_increments(increments)
+        
+        # Persist as one atomic $push + $inc; a new entry is written in full by save()
+        if self._id:
+            totals = storage.push_entry_food(self._id, meal_type, food_data, increments)
+            if totals:
+                # The stored totals also include concurrent edits from other sessions
+                self._apply_totals(totals)
+                self._rolled_up.update(totals)
+                self._changed(self.user_id, self.date, increments, self._summed())
     
     def remove_food_from_meal(self, meal_type, food_id):
         """Removes a food item from a meal and updates totals"""
@@ -344,22 +423,106 @@ class NutritionEntry:
                 removed_food = self.meals[meal_type].pop(i)
                 
                 # Update totals by subtracting the removed food
-                self.total_calories -= float(removed_food.get('calories', 0))
-                self.total_protein -= float(removed_food.get('protein_g', 0))
-                self.total_carbs -= float(removed_food.get('carbs_g', 0))
-                self.total_fat -= float(removed_food.get('fat_g', 0))
-                self.total_fiber -= float(removed_food.get('fiber_g', 0))
+                increments = self._increments(removed_food, -1)
+                self._apply_increments(increments)
+                
+                # One atomic $pull + $inc, applied only if the food is still stored,
+                # so removing it twice (e.g. from two tabs) subtracts it once
+                if self._id:
+                    totals = storage.pull_entry_food(self._id, meal_type, food_id, increments)
+                    if totals is None:
+                        return False
+                    self._apply_totals(totals)
+                    self._rolled_up.update(totals)
+                    self._changed(self.user_id, self.date, increments, self._summed())
                 
                 return True
         
         return False
     
+    @staticmethod
+    def _changed(user_id, date, changes, values):
+        """Bring the rollups and trends derived from entries up to date with stored changes of a day.
+        
+        values are the day's summed fields after the changes.
+        """
+        NutritionRollup.apply(user_id, date, changes, NutritionRollup.is_tracked(values))
+        if any(changes.get(field) for field in TREND_METRICS.values()):
+            NutritionTrend.mark_stale(user_id, date)
+    
+    @staticmethod
+    def _prepare_food(food_data):
+        # Add timestamp to track when food was added
+        food_data['timestamp'] = datetime.utcnow()
+        
+        # Add unique ID for the food entry
+        food_data['id'] = str(ObjectId())
+    
+    @classmethod
+    def _increments(cls, food, sign):
+        """Changes to the daily totals caused by adding (sign=1) or removing (sign=-1) a food"""
+        totals = food_totals([food])
+        return {field: sign * totals[nutrient] for nutrient, field in cls.TOTALS.items()}
+    
+    def _summed(self):
+        return {field: getattr(self, field) for field in NutritionRollup.FIELDS}
+    
+    def _apply_increments(self, increments):
+        for field, amount in increments.items():
+            setattr(self, field, getattr(self, field) + amount)
+    
+    def _apply_totals(self, totals):
+        for field in self.TOTALS.values():
+            if field in totals:
+                setattr(self, field, totals[field])
+    
+    def all_foods(self):
+        """All logged foods of the day, in meal order"""
+        return [food for foods in self.meals.values() for food in foods]
+    
+    def meal_totals(self, meal_type):
+        """Nutrient totals of one meal, honouring each food's quantity"""
+        return food_totals(self.meals.get(meal_type, []))
+    
+    def recalculate_totals(self):
+        """Recompute the day's totals from every logged food in one vectorized pass"""
+        self.total_calories, self.total_protein, self.total_carbs, self.total_fat, self.total_fiber = (
+            food_totals(self.all_foods()).values()
+        )
+        return self
+    
     def update_water_intake(self, amount):
         """Updates water intake amount in milliliters"""
         self.water_intake = float(amount)
     
-    def save(self):
-        data = {
+    def save(self, full=False):
+        """Insert a new entry, or update an existing one.
+        
+        Meals and totals of an existing entry change through the atomic
+        add/remove operations above, so by default only the remaining fields are
+        written; full=True rewrites the whole document (e.g. after
+        recalculate_totals()).
+        """
+        if full or not self._id:
+            data = self.to_dict()
+        else:
+            data = {
+                'water_intake': self.water_intake,
+                'notes': self.notes
+            }
+        
+        if self._id:
+            storage.update_entry(self._id, data)
+        else:
+            self._id = storage.insert_entry(data)
+        
+        changes = {field: data[field] - self._rolled_up[field] for field in NutritionRollup.FIELDS if field in data}
+        self._changed(self.user_id, self.date, changes, self._summed())
+        self._rolled_up.update({field: data[field] for field in changes})
+        return self
+    
+    def to_dict(self):
+        return {
             'user_id': self.user_id,
             'date': self.date,
             'meals': self.meals,
@@ -372,129 +535,83 @@ class NutritionEntry:
             'notes': self.notes,
             'created_at': self.created_at
         }
+    
+    @staticmethod
+    def day_start(date=None):
+        """Midnight of a date given as datetime or 'YYYY-MM-DD' (today if omitted), the key of daily entries"""
+        date_obj = date if isinstance(date, datetime) else datetime.strptime(date, '%Y-%m-%d') if isinstance(date, str) else datetime.utcnow()
+        return datetime(date_obj.year, date_obj.month, date_obj.day, 0, 0, 0)
+    
+    @classmethod
+    def get_or_create_day(cls, user_id, date=None, meal_type=None, food_data=None, foods=None):
+        """Return the user's entry for a day, creating it if it does not exist yet.
         
-        # Check if mongo is using in-memory storage
-        if not hasattr(mongo.db.nutrition_entries, 'update_one'):
-            if self._id:
-                # Update in-memory entry
-                for i, entry in enumerate(mongo.db.nutrition_entries):
-                    if entry.get('_id') == self._id:
-                        mongo.db.nutrition_entries[i] = data
-                        mongo.db.nutrition_entries[i]['_id'] = self._id
-                        break
-            else:
-                # Create new entry with ObjectId
-                self._id = ObjectId()
-                data['_id'] = self._id
-                
-                # Initialize the collection if it doesn't exist
-                if not hasattr(mongo.db, 'nutrition_entries'):
-                    mongo.db.nutrition_entries = []
-                
-                mongo.db.nutrition_entries.append(data)
-        else:
-            # Standard MongoDB operations
-            if self._id:
-                mongo.db.nutrition_entries.update_one({'_id': self._id}, {'$set': data})
-            else:
-                result = mongo.db.nutrition_entries.insert_one(data)
-                self._id = result.inserted_id
+        A single upsert against the unique (user_id, date) index, so concurrent
+        first requests of the day share one document. With meal_type and
+        food_data the food is added in the same round trip; foods ({meal_type:
+        [food_data, ...]}) adds several at once, still with one write to the
+        entry and one to the rollups. Raises ValueError, and writes nothing,
+        when a food's unit cannot be converted.
+        """
+        day = cls.day_start(date)
+        defaults = cls(user_id=user_id, date=day).to_dict()
+        del defaults['user_id'], defaults['date']
         
-        return self
+        foods = {meal: list(items) for meal, items in (foods or {}).items() if items}
+        if food_data is not None:
+            foods.setdefault(meal_type, []).append(food_data)
+        increments = None
+        if foods:
+            # Raises ValueError before anything is written if a quantity's unit cannot be converted
+            changes = [cls._increments(food, 1) for items in foods.values() for food in items]
+            increments = {field: sum(change[field] for change in changes) for field in cls.TOTALS.values()}
+            for items in foods.values():
+                for food in items:
+                    cls._prepare_food(food)
+        document = storage.upsert_day(user_id, day, defaults, foods, increments)
+        if increments:
+            cls._changed(user_id, day, increments, {field: document.get(field) or 0 for field in NutritionRollup.FIELDS})
+        return cls(**document)
     
     @classmethod
     def get_by_id(cls, entry_id):
-        # Check if mongo is using in-memory storage
-        if not hasattr(mongo.db.nutrition_entries, 'find_one'):
-            # Initialize the collection if it doesn't exist
-            if not hasattr(mongo.db, 'nutrition_entries'):
-                mongo.db.nutrition_entries = []
-                
-            for entry in mongo.db.nutrition_entries:
-                if str(entry.get('_id')) == str(entry_id):
-                    return cls(**entry)
-            return None
-        else:
-            try:
-                entry_data = mongo.db.nutrition_entries.find_one({'_id': ObjectId(entry_id)})
-                if entry_data:
-                    entry_data['_id'] = entry_data['_id'] 
-                    return cls(**entry_data)
-            except Exception as e:
-                logging.error(f"Error fetching nutrition entry by ID: {str(e)}")
-            
-            return None
+        try:
+            entry_data = storage.find_entry(entry_id)
+            if entry_data:
+                return cls(**entry_data)
+        except Exception as e:
+            logging.error(f"Error fetching nutrition entry by ID: {str(e)}")
+        
+        return None
     
     @classmethod
     def get_by_user_and_date(cls, user_id, date):
-        date_obj = date if isinstance(date, datetime) else datetime.strptime(date, '%Y-%m-%d') if isinstance(date, str) else datetime.utcnow()
         # Set time to beginning of day
-        start_date = datetime(date_obj.year, date_obj.month, date_obj.day, 0, 0, 0)
+        start_date = cls.day_start(date)
         # Set time to end of day
-        end_date = datetime(date_obj.year, date_obj.month, date_obj.day, 23, 59, 59)
+        end_date = start_date.replace(hour=23, minute=59, second=59)
         
-        # Check if mongo is using in-memory storage
-        if not hasattr(mongo.db.nutrition_entries, 'find_one'):
-            # Initialize the collection if it doesn't exist
-            if not hasattr(mongo.db, 'nutrition_entries'):
-                mongo.db.nutrition_entries = []
-                
-            for entry in mongo.db.nutrition_entries:
-                entry_date = entry.get('date')
-                if (entry.get('user_id') == user_id and 
-                    entry_date >= start_date and entry_date <= end_date):
-                    return cls(**entry)
-            
-            # If no entry exists, create a new one
-            return cls(user_id=user_id, date=start_date)
-        else:
-            try:
-                entry_data = mongo.db.nutrition_entries.find_one({
-                    'user_id': user_id,
-                    'date': {'$gte': start_date, '$lte': end_date}
-                })
-                
-                if entry_data:
-                    entry_data['_id'] = entry_data['_id']
-                    return cls(**entry_data)
-            except Exception as e:
-                logging.error(f"Error fetching nutrition entry by user and date: {str(e)}")
+        try:
+            entries = storage.find_entries(user_id, start_date, end_date, limit=1)
+            if entries:
+                return cls(**entries[0])
+        except Exception as e:
+            logging.error(f"Error fetching nutrition entry by user and date: {str(e)}")
         
         # If no entry exists, create a new one
         return cls(user_id=user_id, date=start_date)
     
     @classmethod
     def get_user_entries(cls, user_id, days=7):
-        """Get user's nutrition entries for the last X days"""
-        entries = []
+        """Get user's nutrition entries for the last X days, newest first"""
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=days)
         
-        # Check if mongo is using in-memory storage
-        if not hasattr(mongo.db.nutrition_entries, 'find'):
-            # Initialize the collection if it doesn't exist
-            if not hasattr(mongo.db, 'nutrition_entries'):
-                mongo.db.nutrition_entries = []
-                
-            for entry in mongo.db.nutrition_entries:
-                entry_date = entry.get('date')
-                if (entry.get('user_id') == user_id and 
-                    entry_date >= start_date and entry_date <= end_date):
-                    entries.append(cls(**entry))
-        else:
-            try:
-                results = mongo.db.nutrition_entries.find({
-                    'user_id': user_id,
-                    'date': {'$gte': start_date, '$lte': end_date}
-                }).sort('date', -1)
-                
-                for entry in results:
-                    entry['_id'] = entry['_id']
-                    entries.append(cls(**entry))
-            except Exception as e:
-                logging.error(f"Error fetching nutrition entries: {str(e)}")
-        
-        return sorted(entries, key=lambda x: x.date, reverse=True)
+        try:
+            return [cls(**entry) for entry in storage.find_entries(user_id, start_date, end_date)]
+        except Exception as e:
+            logging.error(f"Error fetching nutrition entries: {str(e)}")
+            return []
     
     def get_macro_percentages(self):
         """Calculate macronutrient percentages"""
@@ -525,7 +642,351 @@ class NutritionEntry:
         return f'<NutritionEntry {self.id} {self.formatted_date}>'
 
 
+class NutritionRollup:
+    """Sums of a user's daily entries over one week or month, kept current by every tracker change.
+    
+    NutritionEntry applies each change to the totals or water intake to the
+    rollups of its week and month as it stores it, so analytics over long
+    periods read one small document per week or month instead of every day.
+    The two writes are not one transaction; `flask rollups rebuild` recomputes
+    the rollups (and the trends) from the entries.
+    """
+    collection = 'nutrition_rollups'
+    indexes = [
+        IndexSpec([('user_id', 1), ('period', 1), ('start', 1)], unique=True)
+    ]
+    
+    PERIODS = ('week', 'month')
+    # Summed entry fields
+    FIELDS = tuple(NutritionEntry.TOTALS.values()) + ('water_intake',)
+    
+    def __init__(self, user_id, period, start, dates=None, _id=None, **sums):
+        self._id = _id if _id else None
+        self.user_id = user_id
+        self.period = period
+        self.start = start
+        self.dates = sorted(dates or [])  # tracked days of the period (see is_tracked)
+        self.sums = {field: sums.get(field, 0) for field in self.FIELDS}
+    
+    @property
+    def days_tracked(self):
+        return len(self.dates)
+    
+    def averages(self):
+        """Per tracked day averages of the summed fields"""
+        days = self.days_tracked or 1
+        return {field: round(total / days, 1) for field, total in self.sums.items()}
+    
+    def to_dict(self):
+        return {
+            'period': self.period,
+            'start': self.start.strftime('%Y-%m-%d'),
+            'days_tracked': self.days_tracked,
+            'totals': {field: round(total, 1) for field, total in self.sums.items()},
+            'averages': self.averages()
+        }
+    
+    @classmethod
+    def period_start(cls, period, date):
+        """Midnight of the first day (Monday, or the 1st) of the week or month containing date"""
+        if period not in cls.PERIODS:
+            raise ValueError(f'Unknown rollup period: {period!r}')
+        return period_start(period, NutritionEntry.day_start(date))
+    
+    @classmethod
+    def is_tracked(cls, values):
+        """Whether a day counts as tracked: its entry has a non-zero summed field.
+        
+        The same rule for incremental updates and rebuilds, so both count the same days.
+        """
+        return any(values.get(field) for field in cls.FIELDS)
+    
+    @classmethod
+    def apply(cls, user_id, date, changes, tracked):
+        """Add changes (field -> amount) of the entry of user_id on date to its week and month rollups.
+        
+        tracked tells whether the day counts as tracked after the changes.
+        """
+        changes = {field: amount for field, amount in changes.items() if amount}
+        if not changes:
+            return
+        day = NutritionEntry.day_start(date)
+        try:
+            storage.increment_rollups(user_id, [(period, cls.period_start(period, day)) for period in cls.PERIODS],
+                                      day, changes, tracked)
+        except Exception as e:
+            logging.error(f"Error updating nutrition rollups: {str(e)}")
+    
+    @classmethod
+    def get_range(cls, user_id, period, start, end):
+        """The user's rollups of the periods overlapping [start, end], oldest first"""
+        return [cls(**document) for document in
+                storage.find_rollups(user_id, period, cls.period_start(period, start), NutritionEntry.day_start(end))]
+    
+    @classmethod
+    def rebuild(cls, user_id=None, batch_size=1000):
+        """Recompute rollups and trends from the entries of one user, or of every user.
+        
+        Entries are streamed in (user_id, date) order, so only one user's
+        rollups are held at a time. Returns the number of users rebuilt.
+        """
+        projection = {'_id': False, 'user_id': True, 'date': True, **{field: True for field in cls.FIELDS}}
+        users = 0
+        current, rollups, dates = None, {}, []
+        for entry in storage.iter_entries(user_id, projection, batch_size):
+            if current is not None and str(entry['user_id']) != str(current):
+                cls._store_rebuilt(current, rollups, dates)
+                users += 1
+                rollups, dates = {}, []
+            current = entry['user_id']
+            dates.append(entry['date'])
+            values = {field: entry.get(field) or 0 for field in cls.FIELDS}
+            for period in cls.PERIODS:
+                start = cls.period_start(period, entry['date'])
+                rollup = rollups.setdefault((period, start), dict(
+                    {field: 0 for field in cls.FIELDS}, user_id=current, period=period, start=start, dates=[]
+                ))
+                for field, amount in values.items():
+                    rollup[field] += amount
+                if cls.is_tracked(values):
+                    rollup['dates'].append(entry['date'])
+        if current is not None:
+            cls._store_rebuilt(current, rollups, dates)
+            users += 1
+        elif user_id is not None:
+            storage.replace_rollups(user_id, [])
+            storage.delete_trends(user_id)
+        return users
+    
+    @staticmethod
+    def _store_rebuilt(user_id, rollups, dates):
+        storage.replace_rollups(user_id, list(rollups.values()))
+        NutritionTrend.rebuild(user_id, dates[0], dates[-1])
+    
+    def __repr__(self):
+        return f'<NutritionRollup {self.user_id} {self.period} {self.start:%Y-%m-%d}>'
+
+
+class NutritionTrend:
+    """Rolling statistics of a user's intake as of one day (see trends.py), one document per user and day.
+    
+    A change to a day's calories or macros only marks the user's trends stale
+    from that day (one write). Reads recompute lazily: the first read after a
+    change rewrites the days from the first to TREND_WINDOW after the last
+    changed day (and later days only while their streak changes), however many
+    changes accumulated, before looking the trend up. A day's totals only enter
+    the windows of the TREND_WINDOW days from it, which keeps that range bounded.
+    If the recompute fails the trends stay marked stale and are returned with
+    stale set, to be recomputed on the next read.
+    """
+    collection = 'nutrition_trends'
+    indexes = [
+        IndexSpec([('user_id', 1), ('date', 1)], unique=True)
+    ]
+    
+    # Recommendation attribute with the daily target of each trend metric
+    TARGETS = {'calories': 'daily_calories', 'protein': 'protein', 'carbs': 'carbs', 'fat': 'fats'}
+    
+    def __init__(self, user_id, date, tracked=False, streak=0, days_7=0, days_30=0, avg_7=None, avg_30=None,
+                 ewma=None, stale=False, _id=None):
+        self._id = _id if _id else None
+        self.user_id = user_id
+        self.date = date
+        self.tracked = tracked
+        self.streak = streak  # consecutive tracked days ending on date
+        self.days_7 = days_7  # tracked days in the 7 and 30 days ending on date
+        self.days_30 = days_30
+        empty = {metric: 0 for metric in TREND_METRICS}
+        self.avg_7 = avg_7 or dict(empty)
+        self.avg_30 = avg_30 or dict(empty)
+        self.ewma = ewma or dict(empty)
+        self.stale = stale  # the recompute before this read failed, so later changes are missing
+    
+    def adherence(self, recommendation):
+        """7- and 30-day averages as percentages of the recommendation's daily targets"""
+        adherence = {}
+        for window, averages in (('avg_7', self.avg_7), ('avg_30', self.avg_30)):
+            adherence[window] = {}
+            for metric, attribute in self.TARGETS.items():
+                target = getattr(recommendation, attribute, None)
+                adherence[window][metric] = round(100 * averages[metric] / target) if target else None
+        return adherence
+    
+    def to_dict(self, recommendation=None):
+        data = {
+            'date': self.date.strftime('%Y-%m-%d'),
+            'tracked': self.tracked,
+            'streak': self.streak,
+            'days_7': self.days_7,
+            'days_30': self.days_30,
+            'avg_7': self.avg_7,
+            'avg_30': self.avg_30,
+            'ewma': self.ewma,
+            'stale': self.stale
+        }
+        if recommendation is not None:
+            data['adherence'] = self.adherence(recommendation)
+        return data
+    
+    @classmethod
+    def get(cls, user_id, date=None):
+        """The user's trend as of date (today if omitted); days without tracking in the last 30 have empty trends"""
+        day = NutritionEntry.day_start(date)
+        stale = not cls.catch_up(user_id)
+        trend_data = storage.find_trend(user_id, day)
+        return cls(**trend_data, stale=stale) if trend_data else cls(user_id, day, stale=stale)
+    
+    @classmethod
+    def mark_stale(cls, user_id, date):
+        """Record that the totals of date changed; the trends are recomputed on the next read"""
+        try:
+            storage.mark_trends_stale(user_id, NutritionEntry.day_start(date))
+        except Exception as e:
+            logging.error(f"Error marking nutrition trends stale: {str(e)}")
+    
+    @classmethod
+    def catch_up(cls, user_id):
+        """Recompute the trends affected by the days changed since they were last brought up to date.
+        
+        Returns False if that failed, leaving the trends marked stale for the next read.
+        """
+        try:
+            stale = storage.find_stale_trends(user_id)
+            if stale is None:
+                return True
+            # Each call rewrites TREND_WINDOW days: consecutive calls up to the last changed day,
+            # then the days its totals reach, carrying streaks further if they changed
+            day = stale['since']
+            while day < stale['until']:
+                cls._refresh(user_id, day, propagate=False)
+                day += timedelta(days=TREND_WINDOW)
+            cls._refresh(user_id, stale['until'], propagate=True)
+            storage.clear_stale_trends(user_id, stale['version'])
+            return True
+        except Exception as e:
+            logging.error(f"Error updating nutrition trends of user {user_id}: {str(e)}")
+            return False
+    
+    @classmethod
+    def refresh(cls, user_id, date, propagate=True):
+        """Recompute the trends of the TREND_WINDOW days from date after its totals changed"""
+        try:
+            cls._refresh(user_id, NutritionEntry.day_start(date), propagate)
+        except Exception as e:
+            logging.error(f"Error updating nutrition trends: {str(e)}")
+    
+    @classmethod
+    def _refresh(cls, user_id, day, propagate):
+        fields = list(TREND_METRICS.values())
+        span = timedelta(days=TREND_WINDOW - 1)
+        while True:
+            # Every window ending in [day, day + span] lies within [day - span, day + span]
+            start, end = day - span, day + span
+            values = np.zeros((2 * TREND_WINDOW - 1, len(fields)))
+            for row in storage.aggregate_entries(user_id, start, end, 'day', fields):
+                values[(row['start'] - start).days] = [row[field] for field in fields]
+            tracked = values[:, 0] > 0
+            
+            stored = {trend['date']: trend for trend in storage.find_trends(user_id, day - timedelta(days=1), end)}
+            before = stored.get(day - timedelta(days=1))
+            stats = rolling_stats(values, tracked, before['streak'] if before else 0)
+            storage.save_trends([dict(stat, user_id=user_id, date=day + timedelta(days=i))
+                                 for i, stat in enumerate(stats)])
+            
+            # Later days only depend on these through the streak, which a tracked last day carries on
+            last = stored.get(end)
+            if not propagate or not tracked[-1] or (last is not None and last['streak'] == stats[-1]['streak']):
+                return
+            day = end + timedelta(days=1)
+    
+    @classmethod
+    def rebuild(cls, user_id, first, last):
+        """Recompute all trends of a user whose entries are dated within [first, last]"""
+        storage.delete_trends(user_id)
+        day = NutritionEntry.day_start(first)
+        while day <= last:
+            cls.refresh(user_id, day, propagate=False)
+            day += timedelta(days=TREND_WINDOW)
+    
+    def __repr__(self):
+        return f'<NutritionTrend {self.user_id} {self.date:%Y-%m-%d}>'
+
+
+class MealPlan:
+    """A user's planned week of meals (see meal_planner.plan_week), one document per user and week"""
+    collection = 'meal_plans'
+    indexes = [
+        IndexSpec([('user_id', 1), ('week_start', 1)], unique=True)
+    ]
+    
+    def __init__(self, user_id, week_start, days, recommendation_id=None, complete=True, prefilled=None,
+                 _id=None, created_at=None):
+        self._id = _id if _id else None
+        self.user_id = user_id
+        self.week_start = week_start
+        self.days = days  # [{'date', 'plan', 'fallback'}], in date order
+        self.recommendation_id = recommendation_id  # recommendation whose targets were planned for
+        self.complete = complete  # False when some days fell back to a quick greedy plan
+        self.prefilled = prefilled or []  # dates whose planned foods were logged; kept when the week is replanned
+        self.created_at = created_at if created_at else datetime.utcnow()
+    
+    @property
+    def id(self):
+        return self._id
+    
+    @staticmethod
+    def week_of(date=None):
+        """Monday midnight of the week containing date (datetime or 'YYYY-MM-DD', today if omitted)"""
+        day = NutritionEntry.day_start(date)
+        return day - timedelta(days=day.weekday())
+    
+    def save(self):
+        self._id = storage.save_meal_plan({
+            'user_id': self.user_id,
+            'week_start': self.week_start,
+            'days': self.days,
+            'recommendation_id': self.recommendation_id,
+            'complete': self.complete,
+            'created_at': self.created_at
+        })
+        return self
+    
+    def claim_prefill(self, date):
+        """Mark date as prefilled; False if it already was, so a day's foods are only logged once"""
+        return storage.claim_meal_plan_day(self.user_id, self.week_start, NutritionEntry.day_start(date))
+    
+    def release_prefill(self, date):
+        """Undo claim_prefill, when logging the day's foods failed before any was added"""
+        storage.release_meal_plan_day(self.user_id, self.week_start, NutritionEntry.day_start(date))
+    
+    def day(self, date):
+        """The plan for date, or None if it is not in this week"""
+        day = NutritionEntry.day_start(date)
+        for planned in self.days:
+            if planned['date'] == day:
+                return planned['plan']
+        return None
+    
+    def to_dict(self):
+        return {
+            'id': str(self._id),
+            'week_start': self.week_start.strftime('%Y-%m-%d'),
+            'complete': self.complete,
+            'prefilled': [date.strftime('%Y-%m-%d') for date in self.prefilled],
+            'days': [dict(planned, date=planned['date'].strftime('%Y-%m-%d')) for planned in self.days]
+        }
+    
+    @classmethod
+    def get_for_week(cls, user_id, date=None):
+        plan_data = storage.find_meal_plan(user_id, cls.week_of(date))
+        return cls(**plan_data) if plan_data else None
+
+
+# Models whose indexes indexes.py manages
+MODELS = [User, NutritionRecommendation, NutritionEntry, NutritionRollup, NutritionTrend, MealPlan]
+
+
 # Setup the user loader for Flask-Login
 @login_manager.user_loader
 def load_user(user_id):
-    return User.get_by_id(user_id)
+    return User.get_cached(user_id)
@@ -0,0 +1,230 @@
+"""
+Nutrient vectors, portion conversions and vectorized scaling.
+
+Every food is described by a vector of nutrients per 100 g (in NUTRIENTS
+order) plus a table of portions mapping units such as "cup" or "medium" to
+grams. Scaling any number of foods to any number of grams is then a single
+NumPy expression, so the totals of a meal or a whole day are computed in one
+call instead of a Python loop over foods.
+"""
+import re
+
+import numpy as np
+
+# Order of the values in every nutrient vector
+NUTRIENTS = ('calories', 'protein_g', 'carbs_g', 'fat_g', 'fiber_g')
+
+# Mass units, which convert for every food
+UNIT_GRAMS = {
+    'g': 1.0,
+    'kg': 1000.0,
+    'mg': 0.001,
+    'oz': 28.35,
+    'lb': 453.6
+}
+
+# Volume units in millilitres; a food measured in one of them gets all of them. Other
+# foods only convert them when they are liquids, at the density of water: a cup of
+# granola or of diced apple is nowhere near 240 g, so solids without a volume portion
+# cannot be measured by volume.
+VOLUME_ML = {'ml': 1.0, 'l': 1000.0, 'cup': 240.0, 'tbsp': 15.0, 'tsp': 5.0}
+
+# Last word of a food's name that marks it as a liquid, unless its data says otherwise (see is_liquid)
+LIQUID_WORDS = frozenset({
+    'water', 'milk', 'juice', 'coffee', 'tea', 'soda', 'cola', 'lemonade', 'broth', 'stock', 'soup',
+    'smoothie', 'shake', 'kefir', 'latte', 'beer', 'wine', 'oil', 'vinegar', 'syrup', 'drink'
+})
+
+# Spellings accepted for each unit
+UNIT_ALIASES = {
+    'g': ('g', 'gram', 'grams', 'gr', 'gm'),
+    'kg': ('kg', 'kgs', 'kilogram', 'kilograms'),
+    'mg': ('mg', 'milligram', 'milligrams'),
+    'oz': ('oz', 'ounce', 'ounces'),
+    'lb': ('lb', 'lbs', 'pound', 'pounds'),
+    'ml': ('ml', 'milliliter', 'milliliters', 'millilitre', 'millilitres'),
+    'l': ('l', 'liter', 'liters', 'litre', 'litres'),
+    'cup': ('cup', 'cups'),
+    'tbsp': ('tbsp', 'tbs', 'tablespoon', 'tablespoons'),
+    'tsp': ('tsp', 'teaspoon', 'teaspoons'),
+    'slice': ('slice', 'slices'),
+    'piece': ('piece', 'pieces', 'each', 'whole', 'medium', 'large', 'small', 'fruit', 'item', 'items'),
+    'serving': ('serving', 'servings', 'portion', 'portions')
+}
+_UNITS = {alias: unit for unit, aliases in UNIT_ALIASES.items() for alias in aliases}
+
+# "(1 medium)", "(1/2 cup, cooked)", "(3 oz, lean, cooked)", "(2 tbsp)"
+_SERVING_RE = re.compile(r'\((\d+(?:\.\d+)?|\d+/\d+)\s+([a-zA-Z]+)')
+
+
+def normalize_unit(unit):
+    """Map a unit spelling to its canonical name, or None if it is not a known unit"""
+    return _UNITS.get((unit or '').strip().lower().rstrip('.'))
+
+
+def parse_amount(text):
+    """Parse '2', '0.5' or '1/2' into a float"""
+    if '/' in text:
+        numerator, denominator = text.split('/', 1)
+        return float(numerator) / float(denominator)
+    return float(text)
+
+
+def serving_portions(food_name, serving_g):
+    """Derive the portion table of a food from its serving description and weight.
+
+    'Spinach (1 cup, raw)' weighing 30 g gives {'serving': 30, 'cup': 30}, and
+    'Lentils (1/2 cup, cooked)' weighing 99 g gives {'serving': 99, 'cup': 198}.
+    A volume serving also fixes the food's density, so the other volume units
+    follow from it (a tbsp of olive oil weighs 13.5 g, a tsp 4.5 g).
+    """
+    portions = {'serving': float(serving_g)}
+    match = _SERVING_RE.search(food_name or '')
+    if match:
+        unit = normalize_unit(match.group(2))
+        amount = parse_amount(match.group(1))
+        if unit in VOLUME_ML and amount > 0:
+            grams_per_ml = float(serving_g) / amount / VOLUME_ML[unit]
+            for volume_unit, ml in VOLUME_ML.items():
+                portions[volume_unit] = grams_per_ml * ml
+        elif unit and unit != 'serving' and amount > 0:
+            portions[unit] = float(serving_g) / amount
+    return portions
+
+
+def is_liquid(food):
+    """Whether a food dictionary describes a liquid: its liquid flag, or else the last word of its name.
+
+    'Skim Milk (1 cup)' and 'Milk, whole' are liquids, 'Milk Chocolate' is not.
+    """
+    if food.get('liquid') is not None:
+        return bool(food['liquid'])
+    name = (food.get('food_name') or '').split('(')[0].split(',')[0]
+    words = re.findall(r'[a-z]+', name.lower())
+    return bool(words) and words[-1] in LIQUID_WORDS
+
+
+def portion_grams(portions, quantity=1.0, unit=None, liquid=False):
+    """Convert a quantity in some unit into grams of a food.
+
+    Food-specific portions win over generic conversions; a missing or unknown
+    unit counts servings. Volume units without a portion only convert for
+    liquids. Returns None when the unit cannot apply to the food (e.g. 'slice'
+    of a food that has no slice portion, or 'cup' of a solid without one).
+    """
+    unit = (normalize_unit(unit) if unit else None) or 'serving'
+    if unit in portions:
+        return quantity * portions[unit]
+    if unit in UNIT_GRAMS:
+        return quantity * UNIT_GRAMS[unit]
+    if unit in VOLUME_ML:
+        return quantity * VOLUME_ML[unit] if liquid else None
+    if unit == 'piece':
+        return quantity * portions['serving']
+    return None
+
+
+def per_100g(values, serving_g):
+    """Turn per-serving nutrient values into a per-100 g vector"""
+    vector = np.asarray([float(values.get(name, 0) or 0) for name in NUTRIENTS], dtype=np.float32)
+    return vector * np.float32(100.0 / serving_g) if serving_g else vector
+
+
+def scale_nutrients(vectors, grams):
+    """Scale per-100 g vectors (n x len(NUTRIENTS)) to the given grams (n).
+
+    Returns (items, totals): the per-item nutrient matrix and its column sums,
+    both computed in one vectorized pass.
+    """
+    vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, len(NUTRIENTS))
+    factors = np.asarray(grams, dtype=np.float64).reshape(-1) / 100.0
+    items = vectors * factors[:, None]
+    return items, factors @ vectors
+
+
+def scale_servings(values, multipliers):
+    """Multiply per-serving nutrient rows (n x len(NUTRIENTS)) by serving counts (n) and sum them"""
+    values = np.asarray(values, dtype=np.float64).reshape(-1, len(NUTRIENTS))
+    return np.asarray(multipliers, dtype=np.float64).reshape(-1) @ values
+
+
+def nutrient_dict(vector, digits=1):
+    """Turn a nutrient vector back into the calories / *_g dictionary used across the app"""
+    return {name: round(float(value), digits) for name, value in zip(NUTRIENTS, vector)}
+
+
+def scale_nutrition(nutrition, quantity=1.0, unit=None):
+    """Scale a per-serving nutrition dictionary to a quantity of some unit.
+
+    Needs the serving weight (serving_g) for anything but serving counts.
+    Returns a copy with scaled values plus quantity, unit and grams, or None
+    when the unit cannot be converted for this food.
+    """
+    serving_g = nutrition.get('serving_g')
+    canonical = normalize_unit(unit) if unit else 'serving'
+    if canonical is None:
+        return None
+    if serving_g:
+        grams = portion_grams(serving_portions(nutrition.get('food_name', ''), serving_g), quantity, canonical,
+                              is_liquid(nutrition))
+        if grams is None:
+            return None
+        _, totals = scale_nutrients(per_100g(nutrition, serving_g), [grams])
+    elif canonical in ('serving', 'piece'):
+        grams = None
+        totals = scale_servings(per_100g(nutrition, None), [quantity])
+    else:
+        return None
+
+    scaled = dict(nutrition)
+    scaled.update(nutrient_dict(totals))
+    scaled['quantity'] = quantity
+    scaled['unit'] = canonical
+    if grams is not None:
+        scaled['grams'] = round(grams, 1)
+    return scaled
+
+
+def food_servings(food):
+    """How many servings a logged food stands for, or None when its unit cannot be converted.
+
+    Follows scale_nutrition: a unit is converted through the food's portions and
+    serving_g; without serving_g only serving (and piece) counts are possible,
+    so 200 g of a food with unknown serving weight is refused, never 200 servings.
+    """
+    quantity = float(food.get('quantity') or 1)
+    unit = food.get('unit')
+    if not unit:
+        return quantity
+    canonical = normalize_unit(unit)
+    if canonical is None:
+        return None
+    serving_g = food.get('serving_g')
+    if serving_g:
+        grams = portion_grams(serving_portions(food.get('food_name', ''), serving_g), quantity, canonical,
+                              is_liquid(food))
+        return grams / serving_g if grams is not None else None
+    return quantity if canonical in ('serving', 'piece') else None
+
+
+def serving_multipliers(foods):
+    """Return how many servings each logged food stands for (see food_servings).
+
+    Raises ValueError for a food whose quantity cannot be converted into servings.
+    """
+    multipliers = np.ones(len(foods), dtype=np.float64)
+    for i, food in enumerate(foods):
+        servings = food_servings(food)
+        if servings is None:
+            raise ValueError(f"Cannot convert {food.get('unit')!r} of {food.get('food_name') or 'this food'} "
+                             f"into servings")
+        multipliers[i] = servings
+    return multipliers
+
+
+def food_totals(foods):
+    """Sum the nutrients of logged foods, honouring their quantities, in one vectorized call"""
+    if not foods:
+        return nutrient_dict(np.zeros(len(NUTRIENTS)), digits=2)
+    values = [[float(food.get(name, 0) or 0) for name in NUTRIENTS] for food in foods]
+    return nutrient_dict(scale_servings(values, serving_multipliers(foods)), digits=2)
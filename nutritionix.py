@@ -0,0 +1,263 @@
+"""
+HTTP client for the Nutritionix natural-language nutrients API.
+
+All calls share one requests.Session, so connections to the upstream are kept
+alive and pooled. Every request has connect and read timeouts, transient
+failures are retried a bounded number of times with jittered backoff, all
+within one overall deadline per call (body reads included), and a circuit
+breaker stops calling the upstream altogether while it is failing so
+that workers fall back to approximate data without waiting on the network.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Upstream statuses worth retrying; anything else is returned to the caller straight away
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Response bodies are read in chunks of this many bytes, checking the call's deadline in between
+_BODY_CHUNK_SIZE = 1024
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is refusing calls to the upstream"""
+
+
+class CircuitBreaker:
+    """Classic closed / open / half-open circuit breaker.
+
+    After failure_threshold consecutive failures the breaker opens and rejects
+    calls for reset_timeout seconds. It then lets a single trial call through;
+    success closes the breaker, failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._times_opened = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow(self):
+        """Return True if a call may go to the upstream right now"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._times_opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'consecutive_failures': self._failures,
+                'times_opened': self._times_opened,
+                'rejected_calls': self._rejected
+            }
+
+
+class LatencyTracker:
+    """Keeps the most recent request latencies and summarizes them"""
+
+    def __init__(self, window=500):
+        self._samples = deque(maxlen=window)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self._count += 1
+
+    def stats(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self._count
+        if not samples:
+            return {'requests': count, 'avg_ms': None, 'p50_ms': None, 'p95_ms': None, 'max_ms': None}
+
+        def percentile(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 1)
+
+        return {
+            'requests': count,
+            'avg_ms': round(sum(samples) / len(samples) * 1000, 1),
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'max_ms': round(samples[-1] * 1000, 1)
+        }
+
+
+class NutritionixClient:
+    """Pooled, time-bounded client for the natural/nutrients endpoint"""
+
+    def __init__(self, app_id, api_key, endpoint, connect_timeout=2.0, read_timeout=5.0,
+                 max_retries=2, backoff=0.2, total_timeout=8.0, pool_size=10, breaker=None):
+        self.app_id = app_id
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.total_timeout = total_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'x-app-id': app_id,
+            'x-app-key': api_key,
+            'x-remote-user-id': '0'
+        })
+
+        self._lock = threading.Lock()
+        self._counters = {'calls': 0, 'retries': 0, 'failures': 0, 'short_circuited': 0}
+
+    @property
+    def configured(self):
+        return bool(self.app_id and self.api_key)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def natural_nutrients(self, query):
+        """Return the first food Nutritionix reports for query, or None if it has no match.
+
+        Raises CircuitOpenError without touching the network while the breaker is
+        open, requests.exceptions.RequestException once retries are exhausted, the
+        total_timeout deadline has passed (or at once for errors retrying cannot
+        fix) and ValueError for a body that is not JSON.
+        """
+        if not self.breaker.allow():
+            self._count('short_circuited')
+            raise CircuitOpenError('Nutritionix circuit breaker is open')
+
+        self._count('calls')
+        deadline = time.monotonic() + self.total_timeout
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                # Each attempt only gets what is left of the call's deadline
+                remaining = deadline - started
+                if remaining <= 0:
+                    raise requests.exceptions.Timeout(f'Nutritionix call exceeded {self.total_timeout}s')
+                timeout = (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+                response = self.session.post(self.endpoint, json={'query': query}, timeout=timeout, stream=True)
+                if response.status_code in RETRYABLE_STATUSES:
+                    response.close()
+                    self.latency.record(time.monotonic() - started)
+                    response.raise_for_status()
+                body = self._read_body(response, deadline)
+                self.latency.record(time.monotonic() - started)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError) as e:
+                if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                    self.latency.record(time.monotonic() - started)
+                delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    self._failed()
+                    raise
+                attempt += 1
+                self._count('retries')
+                logging.warning(f"Retrying Nutritionix request ({attempt}/{self.max_retries}) after: {str(e)}")
+                time.sleep(delay)
+                continue
+            except Exception:
+                # Not worth retrying (redirect loops, invalid URLs, broken bodies), but still a failed call;
+                # recording it also ends a half-open trial, which would otherwise block every later call
+                self._failed()
+                raise
+
+            if response.status_code == 404:
+                # Nutritionix answers 404 when it cannot match any food in the query
+                self.breaker.record_success()
+                return None
+            if response.status_code >= 400:
+                # The upstream answered; client errors are not a sign of an unhealthy service
+                self.breaker.record_success()
+                response.raise_for_status()
+            try:
+                result = json.loads(body)
+            except ValueError:
+                self._failed()
+                raise
+            self.breaker.record_success()
+            foods = result.get('foods') or []
+            return foods[0] if foods else None
+
+    def _read_body(self, response, deadline):
+        """Read the whole body, giving up with a Timeout once the deadline passes.
+
+        The read timeout only bounds each wait on the socket, so a slowly
+        trickling body could otherwise hold the call open indefinitely.
+        """
+        chunks = []
+        try:
+            for chunk in response.iter_content(chunk_size=_BODY_CHUNK_SIZE):
+                chunks.append(chunk)
+                if time.monotonic() >= deadline:
+                    raise requests.exceptions.Timeout(f'Nutritionix call exceeded {self.total_timeout}s')
+        finally:
+            response.close()
+        return b''.join(chunks)
+
+    def _failed(self):
+        self._count('failures')
+        self.breaker.record_failure()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['breaker'] = self.breaker.stats()
+        stats['latency'] = self.latency.stats()
+        return stats
@@ -0,0 +1,137 @@
+"""
+Batch recomputation of nutrition recommendations for every user.
+
+After DIET_MACROS, HEALTH_FOCUS_MODIFIERS or FOOD_SUGGESTIONS change, every
+user's recommendation is regenerated from their profile with the diet type and
+health focus of their latest recommendation. Users are streamed from storage in
+_id order, BMR, TDEE and macro grams are computed with NumPy for a whole batch
+at once, and each batch is written with one bulk upsert.
+
+The documents are exactly what generate_nutrition_recommendation produces for
+the same inputs, keyed by inputs hash: re-running a batch, or a whole run, adds
+nothing, which is what makes resuming from a checkpoint safe.
+"""
+from datetime import datetime
+
+import numpy as np
+
+from utils import (ACTIVITY_MULTIPLIERS, DIET_MACROS, HEALTH_FOCUS_MODIFIERS, RECOMMENDATION_PROFILE_FIELDS,
+                   profile_inputs_hash, recommendation_notes, suggest_meals)
+
+# Health focus assumed for recommendations stored before health_focus was recorded
+DEFAULT_HEALTH_FOCUS = 'general'
+
+_PROFILE_PROJECTION = {field: True for field in RECOMMENDATION_PROFILE_FIELDS}
+
+_DIETS = list(DIET_MACROS)
+_FOCUSES = list(HEALTH_FOCUS_MODIFIERS)
+# Rows of (protein, carbs, fats) ratios and (calories, protein, carbs, fats) modifiers
+_DIET_TABLE = np.array([[DIET_MACROS[d]['protein'], DIET_MACROS[d]['carbs'], DIET_MACROS[d]['fats']] for d in _DIETS])
+_FOCUS_TABLE = np.array([[HEALTH_FOCUS_MODIFIERS[f][k] for k in ('calories', 'protein', 'carbs', 'fats')]
+                         for f in _FOCUSES])
+
+
+def _number(value):
+    """Profile numbers as floats, with missing or zero values as NaN (incomplete profile)"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return np.nan
+    return value if value else np.nan
+
+
+def compute_targets(profiles, diet_types, health_focuses):
+    """Daily calories and macro grams for many users at once.
+
+    profiles are user documents; diet_types and health_focuses are parallel
+    lists. Mirrors calculate_bmr, calculate_tdee and generate_nutrition_recommendation
+    operation for operation, so the results match them exactly. Returns a dict of
+    arrays: calories (float, before truncation), protein, carbs and fats (grams).
+    """
+    weight = np.array([_number(p.get('weight')) for p in profiles])
+    height = np.array([_number(p.get('height')) for p in profiles])
+    age = np.array([_number(p.get('age')) for p in profiles])
+    gender = [p.get('gender') for p in profiles]
+    male = np.array([bool(g) and g.lower() == 'male' for g in gender])
+    complete = ~(np.isnan(weight) | np.isnan(height) | np.isnan(age)) & np.array([bool(g) for g in gender])
+
+    with np.errstate(invalid='ignore'):
+        bmr = (10 * weight) + (6.25 * height) - (5 * age) + np.where(male, 5, -161)
+    bmr = np.where(complete, bmr, 1800)
+    multiplier = np.array([ACTIVITY_MULTIPLIERS.get(p.get('activity_level'), 1.375) for p in profiles])
+    tdee = bmr * multiplier
+
+    diet_rows = _DIET_TABLE[[_DIETS.index(d) if d in DIET_MACROS else _DIETS.index('omnivore') for d in diet_types]]
+    modifiers = _FOCUS_TABLE[[_FOCUSES.index(f) for f in health_focuses]]
+
+    calories = tdee + modifiers[:, 0]
+    protein = np.minimum(0.4, np.maximum(0.1, diet_rows[:, 0] + modifiers[:, 1]))
+    carbs = np.minimum(0.6, np.maximum(0.05, diet_rows[:, 1] + modifiers[:, 2]))
+    fats = np.minimum(0.7, np.maximum(0.15, diet_rows[:, 2] + modifiers[:, 3]))
+    total = protein + carbs + fats
+
+    return {
+        'calories': calories,
+        'protein': ((protein / total) * calories) / 4,
+        'carbs': ((carbs / total) * calories) / 4,
+        'fats': ((fats / total) * calories) / 9
+    }
+
+
+def build_recommendations(profiles, inputs, now=None):
+    """Recommendation documents for a batch of user documents.
+
+    inputs maps str(user _id) to the diet_type and health_focus to use; users
+    missing from it are skipped.
+    """
+    now = now or datetime.utcnow()
+    selected = [p for p in profiles if str(p['_id']) in inputs]
+    diet_types = [inputs[str(p['_id'])].get('diet_type') or 'omnivore' for p in selected]
+    health_focuses = [inputs[str(p['_id'])].get('health_focus') or DEFAULT_HEALTH_FOCUS for p in selected]
+    health_focuses = [f if f in HEALTH_FOCUS_MODIFIERS else DEFAULT_HEALTH_FOCUS for f in health_focuses]
+    if not selected:
+        return []
+
+    targets = compute_targets(selected, diet_types, health_focuses)
+    calories = targets['calories'].tolist()
+    protein, carbs, fats = targets['protein'].tolist(), targets['carbs'].tolist(), targets['fats'].tolist()
+
+    documents = []
+    for i, profile in enumerate(selected):
+        inputs_hash = profile_inputs_hash(profile, diet_types[i], health_focuses[i])
+        breakfast, lunch, dinner, snacks = suggest_meals(diet_types[i], inputs_hash)
+        documents.append({
+            'user_id': profile['_id'],
+            'created_at': now,
+            'selected_at': now,
+            'diet_type': diet_types[i],
+            'daily_calories': int(calories[i]),
+            'protein': round(protein[i], 1),
+            'carbs': round(carbs[i], 1),
+            'fats': round(fats[i], 1),
+            'breakfast_suggestion': breakfast,
+            'lunch_suggestion': lunch,
+            'dinner_suggestion': dinner,
+            'snacks_suggestion': snacks,
+            'additional_notes': recommendation_notes(health_focuses[i], profile.get('allergies')),
+            'health_focus': health_focuses[i],
+            'inputs_hash': inputs_hash
+        })
+    return documents
+
+
+def recompute_recommendations(storage, batch_size=5000, after=None):
+    """Regenerate recommendations for all users after the given _id, one batch at a time.
+
+    A generator: yields (last_id, users_seen, written) after each batch has been
+    stored, so callers can report progress and checkpoint last_id.
+    """
+    now = datetime.utcnow()
+    while True:
+        profiles = storage.find_users(after=after, limit=batch_size, projection=_PROFILE_PROJECTION)
+        if not profiles:
+            return
+        inputs = storage.latest_recommendation_inputs([p['_id'] for p in profiles])
+        written = storage.insert_recommendations_once(build_recommendations(profiles, inputs, now))
+        after = profiles[-1]['_id']
+        yield after, len(profiles), written
@@ -1,12 +1,21 @@
-from flask import render_template, redirect, url_for, flash, request, session
+from flask import render_template, redirect, url_for, flash, request, session, jsonify, Response, stream_with_context
 from flask_login import login_user, logout_user, current_user, login_required
-from app import app, mongo
-from models import User, NutritionRecommendation
+from app import app, storage
+from models import User, NutritionRecommendation, NutritionEntry, NutritionRollup, NutritionTrend, MealPlan, MODELS, USER_CACHE
+from indexes import index_health
 from forms import LoginForm, RegistrationForm, ProfileForm, NutritionQueryForm
-from utils import generate_nutrition_recommendation, get_food_nutrition
+from utils import (generate_nutrition_recommendation, recommendation_inputs_hash, get_food_nutrition,
+                   get_food_nutrition_batch, search_foods, autocomplete_foods, get_meal_nutrition, meal_parser_stats,
+                   MAX_BATCH_QUERIES, MAX_MEAL_TEXT_LENGTH, NUTRITIONIX_CACHE, NUTRITIONIX_CLIENT, NUTRITIONIX_FLIGHTS)
+from nutrients import scale_nutrition
+from analytics import chart_data, metric_series, user_analytics
+from export import FORMATS as EXPORT_FORMATS, export_filename, export_history
+from meal_planner import plan_day, plan_foods, plan_week, meal_plan_stats
 from firebase_config import check_firebase_config
+import hmac
 import logging
-from datetime import datetime
+import math
+from datetime import datetime, timedelta
 
 @app.route('/')
 def index():
@@ -110,37 +119,65 @@ def nutrition_recommendation():
         form.diet_type.data = current_user.diet_type
     
     if form.validate_on_submit():
-        # Generate nutrition recommendation based on user profile and form input
-        recommendation_data = generate_nutrition_recommendation(
-            current_user, 
-            form.diet_type.data,
-            form.health_focus.data
-        )
-        
-        # Create new recommendation record
-        recommendation = NutritionRecommendation(
-            user_id=current_user.id,
-            diet_type=form.diet_type.data,
-            daily_calories=recommendation_data['daily_calories'],
-            protein=recommendation_data['protein'],
-            carbs=recommendation_data['carbs'],
-            fats=recommendation_data['fats'],
-            breakfast_suggestion=recommendation_data['breakfast_suggestion'],
-            lunch_suggestion=recommendation_data['lunch_suggestion'],
-            dinner_suggestion=recommendation_data['dinner_suggestion'],
-            snacks_suggestion=recommendation_data['snacks_suggestion'],
-            additional_notes=recommendation_data['additional_notes']
-        )
+        # The same profile and preferences always produce the same recommendation,
+        # so a repeat submit returns the stored one instead of generating another
+        inputs_hash = recommendation_inputs_hash(current_user, form.diet_type.data, form.health_focus.data)
+        recommendation = NutritionRecommendation.get_by_inputs_hash(current_user.id, inputs_hash)
         
-        recommendation.save()
-        flash('Your nutrition recommendation has been generated!', 'success')
+        if recommendation is not None:
+            # Switching back to earlier inputs makes their recommendation the current one again
+            recommendation.select()
+            flash('Your profile and preferences have not changed since this recommendation.', 'info')
+        else:
+            # Generate nutrition recommendation based on user profile and form input
+            recommendation_data = generate_nutrition_recommendation(
+                current_user, 
+                form.diet_type.data,
+                form.health_focus.data
+            )
+            
+            # Create new recommendation record
+            recommendation = NutritionRecommendation(
+                user_id=current_user.id,
+                diet_type=form.diet_type.data,
+                daily_calories=recommendation_data['daily_calories'],
+                protein=recommendation_data['protein'],
+                carbs=recommendation_data['carbs'],
+                fats=recommendation_data['fats'],
+                breakfast_suggestion=recommendation_data['breakfast_suggestion'],
+                lunch_suggestion=recommendation_data['lunch_suggestion'],
+                dinner_suggestion=recommendation_data['dinner_suggestion'],
+                snacks_suggestion=recommendation_data['snacks_suggestion'],
+                additional_notes=recommendation_data['additional_notes'],
+                health_focus=form.health_focus.data,
+                inputs_hash=recommendation_data['inputs_hash']
+            )
+            
+            recommendation.save()
+            flash('Your nutrition recommendation has been generated!', 'success')
     
     # Get the most recent recommendation for this user if available
-    if recommendation is None and current_user.recommendations:
-        recommendation = NutritionRecommendation(**current_user.recommendations[0])
+    if recommendation is None:
+        recommendation = current_user.latest_recommendation
     
     return render_template('nutrition_recommendation.html', form=form, recommendation=recommendation)
 
+@app.route('/api/recommendations')
+@login_required
+def api_recommendation_history():
+    """API endpoint paging through the user's recommendation history, newest first"""
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    try:
+        documents, next_cursor = NutritionRecommendation.get_history(
+            current_user.id, limit=limit, cursor=request.args.get('cursor')
+        )
+    except ValueError:
+        return {'error': 'Invalid cursor'}, 400
+    
+    items = [{**document, '_id': str(document['_id']), 'created_at': document['created_at'].isoformat()}
+             for document in documents]
+    return {'items': items, 'next_cursor': next_cursor}
+
 @app.route('/api/food_nutrition')
 @login_required
 def api_food_nutrition():
@@ -149,8 +186,21 @@ def api_food_nutrition():
     if not food_query:
         return {'error': 'No food query provided'}, 400
     
+    unit = request.args.get('unit')
+    try:
+        quantity = float(request.args.get('quantity', 1))
+    except ValueError:
+        return {'error': 'quantity must be a number'}, 400
+    if not math.isfinite(quantity) or quantity <= 0:
+        return {'error': 'quantity must be positive'}, 400
+    
     try:
         result = get_food_nutrition(food_query)
+        if quantity != 1 or unit:
+            scaled = scale_nutrition(result, quantity, unit)
+            if scaled is None:
+                return {'error': f'Cannot measure {result["food_name"]} in {unit}'}, 400
+            result = scaled
         
         # Add a note if the response includes it
         if 'note' in result:
@@ -175,6 +225,257 @@ def api_food_nutrition():
         }
 
 
+@app.route('/api/food_nutrition/batch', methods=['POST'])
+@login_required
+def api_food_nutrition_batch():
+    """API endpoint to get nutrition data for several food items in one request"""
+    payload = request.get_json(silent=True) or {}
+    queries = payload.get('queries')
+    if not isinstance(queries, list) or not queries:
+        return {'error': 'Provide a non-empty list of food queries'}, 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return {'error': f'At most {MAX_BATCH_QUERIES} food queries are allowed per request'}, 400
+    if not all(isinstance(query, str) for query in queries):
+        return {'error': 'Food queries must be strings'}, 400
+    
+    return {'results': get_food_nutrition_batch(queries)}
+
+
+@app.route('/api/parse_meal', methods=['POST'])
+@login_required
+def api_parse_meal():
+    """API endpoint splitting a free-text meal ("2 eggs, a banana and 1 cup skim milk") into foods with nutrition"""
+    payload = request.get_json(silent=True) or {}
+    text = payload.get('text')
+    if not isinstance(text, str) or not text.strip():
+        return {'error': 'Provide the meal description as text'}, 400
+    if len(text) > MAX_MEAL_TEXT_LENGTH:
+        return {'error': f'Meal descriptions are limited to {MAX_MEAL_TEXT_LENGTH} characters'}, 400
+    
+    return get_meal_nutrition(text)
+
+
+@app.route('/api/meal_plan')
+@login_required
+def api_meal_plan():
+    """API endpoint planning a day of catalog foods that meets the latest recommendation's macro targets"""
+    recommendation = current_user.latest_recommendation
+    if recommendation is None:
+        return {'error': 'Generate a nutrition recommendation first'}, 404
+    
+    try:
+        return plan_day(recommendation.daily_calories, recommendation.protein, recommendation.carbs,
+                        recommendation.fats, diet_type=recommendation.diet_type,
+                        allergies=current_user.allergies, seed=request.args.get('seed', 0, type=int))
+    except ValueError as e:
+        return {'error': str(e)}, 422
+
+
+@app.route('/api/meal_plan/week')
+@login_required
+def api_meal_plan_week():
+    """API endpoint returning the user's stored meal plan for a week (?date= any day of it, default this week)"""
+    try:
+        week_start = MealPlan.week_of(request.args.get('date'))
+    except ValueError:
+        return {'error': 'Dates must be given as YYYY-MM-DD'}, 400
+    
+    meal_plan = MealPlan.get_for_week(current_user.id, week_start)
+    if meal_plan is None:
+        return {'error': 'No meal plan for this week'}, 404
+    recommendation = current_user.latest_recommendation
+    return dict(meal_plan.to_dict(),
+                outdated=recommendation is None or meal_plan.recommendation_id != recommendation.id)
+
+
+@app.route('/api/meal_plan/week', methods=['POST'])
+@login_required
+def api_meal_plan_week_create():
+    """API endpoint planning the user's week ({"date": any day of it}, default this week) and storing the plan"""
+    recommendation = current_user.latest_recommendation
+    if recommendation is None:
+        return {'error': 'Generate a nutrition recommendation first'}, 404
+    payload = request.get_json(silent=True) or {}
+    try:
+        week_start = MealPlan.week_of(payload.get('date'))
+    except ValueError:
+        return {'error': 'Dates must be given as YYYY-MM-DD'}, 400
+    
+    # A stored week is reused until the recommendation changes; an incomplete one is planned again
+    meal_plan = MealPlan.get_for_week(current_user.id, week_start)
+    if meal_plan is None or not meal_plan.complete or meal_plan.recommendation_id != recommendation.id:
+        try:
+            week = plan_week(recommendation.daily_calories, recommendation.protein, recommendation.carbs,
+                             recommendation.fats, diet_type=recommendation.diet_type,
+                             allergies=current_user.allergies)
+        except ValueError as e:
+            return {'error': str(e)}, 422
+        
+        days = [{'date': week_start + timedelta(days=day['day']), 'plan': day['plan'], 'fallback': day['fallback']}
+                for day in week['days']]
+        meal_plan = MealPlan(current_user.id, week_start, days, recommendation_id=recommendation.id,
+                             complete=week['complete'], prefilled=meal_plan.prefilled if meal_plan else None).save()
+    
+    return meal_plan.to_dict()
+
+
+@app.route('/api/meal_plan/week/prefill', methods=['POST'])
+@login_required
+def api_meal_plan_prefill():
+    """API endpoint logging a planned day's foods in the nutrition tracker"""
+    payload = request.get_json(silent=True) or {}
+    try:
+        date = NutritionEntry.day_start(payload.get('date'))
+    except ValueError:
+        return {'error': 'Dates must be given as YYYY-MM-DD'}, 400
+    
+    meal_plan = MealPlan.get_for_week(current_user.id, date)
+    plan = meal_plan.day(date) if meal_plan else None
+    if plan is None:
+        return {'error': 'No meal plan for this day'}, 404
+    
+    # Claimed with one conditional update, so concurrent requests cannot both log the day's foods
+    if not meal_plan.claim_prefill(date):
+        return {'error': 'The planned meals of this day are already logged'}, 409
+    
+    # All of the day's foods in one upsert of the entry, with one rollup update and trend stale mark
+    foods = plan_foods(plan)
+    try:
+        entry = NutritionEntry.get_or_create_day(current_user.id, date, foods=foods)
+    except Exception:
+        meal_plan.release_prefill(date)
+        raise
+    return {'date': entry.formatted_date, 'foods_added': sum(len(items) for items in foods.values()),
+            'totals': {field: getattr(entry, field) for field in NutritionEntry.TOTALS.values()}}
+
+
+@app.route('/api/nutrition/rollups')
+@login_required
+def api_nutrition_rollups():
+    """API endpoint returning the user's weekly or monthly totals (?period=week|month&start=&end=, default the last year)"""
+    period = request.args.get('period', 'week')
+    if period not in NutritionRollup.PERIODS:
+        return {'error': f"period must be one of {', '.join(NutritionRollup.PERIODS)}"}, 400
+    try:
+        end = NutritionEntry.day_start(request.args.get('end'))
+        start = NutritionEntry.day_start(request.args.get('start') or end - timedelta(days=365))
+    except ValueError:
+        return {'error': 'Dates must be given as YYYY-MM-DD'}, 400
+    
+    rollups = NutritionRollup.get_range(current_user.id, period, start, end)
+    return {'period': period, 'rollups': [rollup.to_dict() for rollup in rollups]}
+
+
+@app.route('/api/nutrition/analytics')
+@login_required
+def api_nutrition_analytics():
+    """API endpoint returning average daily intake and totals per day, week or month (?period=&group=&end=)"""
+    try:
+        result = user_analytics(current_user.id, request.args.get('period', 'week'),
+                                request.args.get('group', 'day'), request.args.get('end'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    
+    rows = [dict(row, start=row['start'].strftime('%Y-%m-%d')) for row in result['rows']]
+    trend = result['trend'].to_dict(current_user.latest_recommendation)
+    return dict(result, start=result['start'].strftime('%Y-%m-%d'), end=result['end'].strftime('%Y-%m-%d'), rows=rows,
+                trend=trend)
+
+
+@app.route('/api/nutrition/trends')
+@login_required
+def api_nutrition_trends():
+    """API endpoint returning moving averages, streak and adherence to the latest recommendation as of ?date="""
+    try:
+        trend = NutritionTrend.get(current_user.id, request.args.get('date'))
+    except ValueError:
+        return {'error': 'Dates must be given as YYYY-MM-DD'}, 400
+    
+    return trend.to_dict(current_user.latest_recommendation)
+
+
+@app.route('/api/nutrition/analytics/<metric>')
+@login_required
+def api_nutrition_metric(metric):
+    """API endpoint returning one metric's chart data, downsampled to ?points= (?period=&end=)"""
+    try:
+        series = metric_series(current_user.id, metric, request.args.get('period', 'month'),
+                               request.args.get('points', type=int), request.args.get('end'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    
+    return dict(series, chart_data=chart_data(series))
+
+
+@app.route('/api/nutrition/export')
+@login_required
+def api_nutrition_export():
+    """API endpoint streaming the user's whole nutrition history (?format=csv|ndjson&gzip=1)"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return {'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}, 400
+    compress = request.args.get('gzip') in ('1', 'true')
+    
+    mimetype = 'application/gzip' if compress else EXPORT_FORMATS[fmt][0]
+    filename = export_filename(fmt, compress)
+    return Response(stream_with_context(export_history(current_user.id, fmt, compress)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@app.route('/api/food_search')
+@login_required
+def api_food_search():
+    """API endpoint returning the catalog foods that best match a (possibly misspelled) query"""
+    food_query = request.args.get('query', '')
+    if not food_query:
+        return {'error': 'No food query provided'}, 400
+    
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    return {'query': food_query, 'results': search_foods(food_query, limit=limit)}
+
+
+@app.route('/api/food_autocomplete')
+@login_required
+def api_food_autocomplete():
+    """API endpoint suggesting catalog foods for the prefix typed so far"""
+    prefix = request.args.get('prefix', '')
+    limit = min(max(request.args.get('limit', 8, type=int), 1), 20)
+    
+    response = jsonify({'prefix': prefix, 'suggestions': autocomplete_foods(prefix, limit=limit)})
+    # Suggestions only change when the catalog does, so let the browser reuse them
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+
+@app.route('/api/metrics')
+def api_metrics():
+    """Operational metrics for the external nutrition data path and the in-process caches.
+    
+    Internal details: only for signed-in users, or monitoring that sends the
+    METRICS_TOKEN as a bearer token.
+    """
+    token = app.config.get('METRICS_TOKEN')
+    authorization = request.headers.get('Authorization', '')
+    if not current_user.is_authenticated and not (token and hmac.compare_digest(authorization, f'Bearer {token}')):
+        return {'error': 'Authentication required'}, 401
+    
+    return {
+        'nutritionix': NUTRITIONIX_CLIENT.stats(),
+        'nutritionix_cache': NUTRITIONIX_CACHE.stats(),
+        'nutritionix_coalescing': NUTRITIONIX_FLIGHTS.stats(),
+        'meal_parser': meal_parser_stats(),
+        'meal_planner': meal_plan_stats(),
+        'user_cache': USER_CACHE.stats()
+    }
+
+
+@app.route('/health')
+def health():
+    """Health check for load balancers: fails while an index critical to request latency is missing"""
+    healthy, details = index_health(storage, MODELS)
+    return {'status': 'ok' if healthy else 'degraded', 'indexes': details}, 200 if healthy else 503
+
+
 @app.route('/firebase_test')
 def firebase_test():
     """Test page for Firebase configuration and authentication"""
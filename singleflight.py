@@ -0,0 +1,100 @@
+"""
+Request coalescing for expensive lookups.
+
+SingleFlight makes sure that, within one process, only one call per key is in
+flight at a time: the first caller runs the function and every concurrent
+caller for the same key waits for and shares its result. StripedFileLock
+extends the idea across worker processes on one host with flock()ed lock
+files, so a caller can re-check a shared store before doing the work itself.
+"""
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into a single execution"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = {'executed': 0, 'coalesced': 0}
+
+    def do(self, key, fn):
+        """Run fn() unless a call for key is already running, in which case wait for its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._counters['executed'] += 1
+            else:
+                self._counters['coalesced'] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+
+class StripedFileLock:
+    """Cross-process exclusive locks keyed by string, backed by a fixed set of lock files.
+
+    Keys are hashed onto `stripes` files so the number of files stays bounded;
+    unrelated keys occasionally share a stripe, which only costs a short wait.
+    Locking is a no-op on platforms without fcntl.
+    """
+
+    def __init__(self, directory, stripes=256):
+        self.directory = directory
+        self.stripes = stripes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).digest()
+        stripe = int.from_bytes(digest[:4], 'big') % self.stripes
+        return os.path.join(self.directory, f'{stripe:03d}.lock')
+
+    @contextmanager
+    def lock(self, key):
+        if fcntl is None:
+            yield
+            return
+
+        with open(self._path(key), 'a') as handle:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
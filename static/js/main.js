@@ -302,6 +302,26 @@ function setupResponsiveBehavior() {
     }
 }
 
+/**
+ * Fetch nutrition data for several foods (e.g. a whole meal) in a single request.
+ * Resolves to one result per query, in the same order, each with a status of
+ * 'ok', 'approximate' or 'error'. An optional AbortSignal cancels the request.
+ */
+async function fetchFoodNutritionBatch(queries, signal) {
+    const response = await fetch('/api/food_nutrition/batch', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ queries: queries }),
+        signal: signal
+    });
+    const data = await response.json();
+    
+    if (!response.ok) {
+        throw new Error(data.error || 'Failed to retrieve nutrition information');
+    }
+    return data.results;
+}
+
 /**
  * Format a number with commas for thousands
  */
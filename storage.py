@@ -0,0 +1,925 @@
+"""
+Storage backends behind the models.
+
+The models talk to a repository object instead of to pymongo directly.
+MongoStorage wraps a pymongo database; MemoryStorage is the fallback used
+when MongoDB is unreachable (development, tests, staging nodes). It keeps
+hash indexes on user _id, email and username, on (user_id, inputs_hash)
+for recommendations, on (user_id, week_start) for meal plans and on user_id
+for rollups and trends, and sorted indexes on (user_id, created_at) and
+(user_id, selected_at) for recommendations and (user_id, date) for nutrition entries, so every lookup is O(1) or
+O(log n) instead of a scan of all documents.
+
+Both backends take and return plain documents (dicts) and never hand out
+references to stored state: callers may modify what they get back.
+"""
+import base64
+import binascii
+import bisect
+import copy
+import threading
+from datetime import datetime, timedelta
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+def to_object_id(value):
+    """Convert value to an ObjectId, or return None if it is not a valid id"""
+    if isinstance(value, ObjectId):
+        return value
+    try:
+        return ObjectId(str(value))
+    except (InvalidId, TypeError):
+        return None
+
+
+def period_start(period, date):
+    """Midnight of the first day of the day, week (Monday) or month containing a datetime"""
+    day = datetime(date.year, date.month, date.day)
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    raise ValueError(f'Unknown period: {period!r}')
+
+
+def meal_path(meal_type):
+    """Dotted path of a meal's food list, refusing names that would address other fields"""
+    if not meal_type or '.' in meal_type or meal_type.startswith('$'):
+        raise ValueError(f'Invalid meal type: {meal_type!r}')
+    return f'meals.{meal_type}'
+
+
+class MongoStorage:
+    """Repository backed by a MongoDB database"""
+
+    def __init__(self, db):
+        self.db = db
+
+    # Users
+
+    def find_user_by_id(self, user_id, projection=None):
+        object_id = to_object_id(user_id)
+        return self.db.users.find_one({'_id': object_id}, projection) if object_id else None
+
+    def find_user_by_email(self, email):
+        return self.db.users.find_one({'email': email})
+
+    def find_user_by_username(self, username):
+        return self.db.users.find_one({'username': username})
+
+    def insert_user(self, document):
+        return self.db.users.insert_one(dict(document)).inserted_id
+
+    def update_user(self, user_id, fields):
+        self.db.users.update_one({'_id': user_id}, {'$set': fields})
+
+    def count_users(self, after=None):
+        query = {'_id': {'$gt': to_object_id(after) or after}} if after is not None else {}
+        return self.db.users.count_documents(query)
+
+    def find_users(self, after=None, limit=None, projection=None):
+        """Users in _id order, starting after the given _id; keyset-paged for batch jobs"""
+        query = {'_id': {'$gt': to_object_id(after) or after}} if after is not None else {}
+        cursor = self.db.users.find(query, projection).sort('_id', 1)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    # Nutrition recommendations
+
+    def find_recommendation(self, rec_id):
+        object_id = to_object_id(rec_id)
+        return self.db.nutrition_recommendations.find_one({'_id': object_id}) if object_id else None
+
+    def find_recommendations(self, user_id, limit=None, before=None, projection=None):
+        """Recommendations of a user, newest first.
+
+        before is a (created_at, _id) keyset cursor: only recommendations
+        strictly older than it are returned, so every page costs the same
+        regardless of how deep into the history it is.
+        """
+        query = {'user_id': user_id}
+        if before is not None:
+            created_at, rec_id = before
+            query['$or'] = [
+                {'created_at': {'$lt': created_at}},
+                {'created_at': created_at, '_id': {'$lt': rec_id}}
+            ]
+        cursor = self.db.nutrition_recommendations.find(query, projection).sort([('created_at', -1), ('_id', -1)])
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    def find_latest_recommendation(self, user_id):
+        """The recommendation the user selected last: the newest one, or an older one reused since"""
+        return self.db.nutrition_recommendations.find_one(
+            {'user_id': user_id}, sort=[('selected_at', -1), ('created_at', -1), ('_id', -1)]
+        )
+
+    def select_recommendation(self, rec_id, selected_at):
+        self.db.nutrition_recommendations.update_one({'_id': rec_id}, {'$set': {'selected_at': selected_at}})
+
+    def count_recommendations(self, user_id):
+        return self.db.nutrition_recommendations.count_documents({'user_id': user_id})
+
+    def insert_recommendation(self, document):
+        return self.db.nutrition_recommendations.insert_one(dict(document)).inserted_id
+
+    def update_recommendation(self, rec_id, fields):
+        self.db.nutrition_recommendations.update_one({'_id': rec_id}, {'$set': fields})
+
+    def find_recommendation_by_inputs(self, user_id, inputs_hash):
+        return self.db.nutrition_recommendations.find_one({'user_id': user_id, 'inputs_hash': inputs_hash})
+
+    def insert_recommendation_once(self, document):
+        """Store a recommendation unless the user already has one with the same inputs_hash.
+
+        Returns the stored document: the new one, or the existing one when the
+        same inputs were already generated (concurrent submits included, which
+        the unique (user_id, inputs_hash) index resolves). Either way its
+        selected_at is set to the document's, making it the user's latest.
+        """
+        query = {'user_id': document['user_id'], 'inputs_hash': document['inputs_hash']}
+        update = {'$setOnInsert': {k: v for k, v in document.items() if k not in query and k != 'selected_at'},
+                  '$set': {'selected_at': document['selected_at']}}
+        try:
+            return self.db.nutrition_recommendations.find_one_and_update(
+                query, update, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return self.db.nutrition_recommendations.find_one(query)
+
+    def insert_recommendations_once(self, documents):
+        """insert_recommendation_once for many documents in one unordered bulk_write; returns how many were new"""
+        operations = [
+            UpdateOne({'user_id': document['user_id'], 'inputs_hash': document['inputs_hash']},
+                      {'$setOnInsert': {k: v for k, v in document.items()
+                                        if k not in ('user_id', 'inputs_hash', 'selected_at')},
+                       '$set': {'selected_at': document['selected_at']}},
+                      upsert=True)
+            for document in documents
+        ]
+        if not operations:
+            return 0
+        try:
+            return self.db.nutrition_recommendations.bulk_write(operations, ordered=False).upserted_count
+        except BulkWriteError as e:
+            # Upserts that raced with a concurrent insert of the same inputs are already stored
+            if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+            return e.details.get('nUpserted', 0)
+
+    def latest_recommendation_inputs(self, user_ids):
+        """Map each user id to the diet_type and health_focus of their latest recommendation.
+
+        One aggregation for the whole batch, walking the (user_id, selected_at,
+        created_at, _id) index; users without recommendations are left out.
+        """
+        pipeline = [
+            {'$match': {'user_id': {'$in': list(user_ids)}}},
+            {'$sort': {'user_id': 1, 'selected_at': -1, 'created_at': -1, '_id': -1}},
+            {'$group': {'_id': '$user_id', 'diet_type': {'$first': '$diet_type'},
+                        'health_focus': {'$first': '$health_focus'}}}
+        ]
+        return {str(row['_id']): row for row in self.db.nutrition_recommendations.aggregate(pipeline)}
+
+    # Nutrition entries
+
+    def find_entry(self, entry_id):
+        object_id = to_object_id(entry_id)
+        return self.db.nutrition_entries.find_one({'_id': object_id}) if object_id else None
+
+    def find_entries(self, user_id, start, end, limit=None):
+        """Entries of a user dated within [start, end], newest first"""
+        cursor = self.db.nutrition_entries.find({
+            'user_id': user_id,
+            'date': {'$gte': start, '$lte': end}
+        }).sort('date', -1)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    def insert_entry(self, document):
+        return self.db.nutrition_entries.insert_one(dict(document)).inserted_id
+
+    def update_entry(self, entry_id, fields):
+        self.db.nutrition_entries.update_one({'_id': entry_id}, {'$set': fields})
+
+    def aggregate_entries(self, user_id, start, end, period, fields):
+        """Sums of fields over a user's entries dated within [start, end], per day, week or month.
+
+        The grouping runs in MongoDB: the pipeline matches on the (user_id, date)
+        index and projects the summed fields before grouping, so meals never
+        leave the server. Returns [{'start', 'days', field: sum, ...}] oldest first.
+        """
+        # $dateFromParts (MongoDB 3.6+) rather than $dateTrunc, which needs 5.0;
+        # ISO weeks start on Monday like period_start's
+        if period == 'day':
+            key = '$date'
+        elif period == 'week':
+            key = {'$dateFromParts': {'isoWeekYear': {'$isoWeekYear': '$date'}, 'isoWeek': {'$isoWeek': '$date'}}}
+        elif period == 'month':
+            key = {'$dateFromParts': {'year': {'$year': '$date'}, 'month': {'$month': '$date'}}}
+        else:
+            raise ValueError(f'Unknown period: {period!r}')
+        pipeline = [
+            {'$match': {'user_id': user_id, 'date': {'$gte': start, '$lte': end}}},
+            {'$project': {'_id': False, 'date': True, **{field: True for field in fields}}},
+            {'$group': {'_id': key, 'days': {'$sum': 1}, **{field: {'$sum': f'${field}'} for field in fields}}},
+            {'$sort': {'_id': 1}},
+            {'$project': {'_id': False, 'start': '$_id', 'days': True, **{field: True for field in fields}}}
+        ]
+        return list(self.db.nutrition_entries.aggregate(pipeline))
+
+    def upsert_day(self, user_id, date, defaults, foods=None, increments=None):
+        """Return the entry of user_id for date, creating it from defaults if it does not exist.
+
+        One find_one_and_update against the unique (user_id, date) index; foods
+        ({meal_type: [food, ...]}) are pushed with $each (and increments applied)
+        in the same round trip. Defaults are only written on insert and skip the
+        paths the food update touches, which MongoDB would reject as conflicts.
+        """
+        update = {}
+        if foods:
+            update['$push'] = {meal_path(meal_type): {'$each': items} for meal_type, items in foods.items()}
+            update['$inc'] = increments
+        touched = set(update.get('$push', {})) | set(update.get('$inc', {}))
+        # Embedded documents (meals) are set per field so the pushed meal can be left out
+        set_on_insert = {}
+        for field, value in defaults.items():
+            if isinstance(value, dict):
+                set_on_insert.update({f'{field}.{key}': item for key, item in value.items()})
+            else:
+                set_on_insert[field] = value
+        update['$setOnInsert'] = {path: value for path, value in set_on_insert.items() if path not in touched}
+
+        query = {'user_id': user_id, 'date': date}
+        try:
+            return self.db.nutrition_entries.find_one_and_update(
+                query, update, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Lost the race to create the day; the other request's insert is there now
+            return self.db.nutrition_entries.find_one_and_update(
+                query, update, upsert=True, return_document=ReturnDocument.AFTER
+            )
+
+    def push_entry_food(self, entry_id, meal_type, food, increments):
+        """Append food to a meal and $inc the totals in one atomic update.
+
+        Returns the updated total fields, or None if the entry does not exist.
+        """
+        return self.db.nutrition_entries.find_one_and_update(
+            {'_id': entry_id},
+            {'$push': {meal_path(meal_type): food}, '$inc': increments},
+            projection={'_id': False, **{field: True for field in increments}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def pull_entry_food(self, entry_id, meal_type, food_id, increments):
+        """Remove a food from a meal and $inc the totals in one atomic update.
+
+        The filter requires the food to still be in the meal, so the totals are
+        only adjusted by the call that actually removes it. Returns the updated
+        total fields, or None if there was nothing to remove.
+        """
+        path = meal_path(meal_type)
+        return self.db.nutrition_entries.find_one_and_update(
+            {'_id': entry_id, f'{path}.id': food_id},
+            {'$pull': {path: {'id': food_id}}, '$inc': increments},
+            projection={'_id': False, **{field: True for field in increments}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    # Meal plans
+
+    def find_meal_plan(self, user_id, week_start):
+        return self.db.meal_plans.find_one({'user_id': user_id, 'week_start': week_start})
+
+    def save_meal_plan(self, document):
+        """Store the plan of a user's week, replacing an earlier plan of the same week; returns its _id.
+
+        Fields the document does not set, such as the prefilled days, are kept.
+        """
+        query = {'user_id': document['user_id'], 'week_start': document['week_start']}
+        update = {'$set': {k: v for k, v in document.items() if k != '_id'}}
+        try:
+            stored = self.db.meal_plans.find_one_and_update(
+                query, update, projection={'_id': True}, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            stored = self.db.meal_plans.find_one_and_update(
+                query, update, projection={'_id': True}, return_document=ReturnDocument.AFTER
+            )
+        return stored['_id']
+
+    def claim_meal_plan_day(self, user_id, week_start, date):
+        """Record date of the user's week plan as prefilled; False if it already was or there is no plan.
+
+        One conditional update, so concurrent prefills of a day cannot both succeed.
+        """
+        claimed = self.db.meal_plans.find_one_and_update(
+            {'user_id': user_id, 'week_start': week_start, 'prefilled': {'$ne': date}},
+            {'$addToSet': {'prefilled': date}}, projection={'_id': True}
+        )
+        return claimed is not None
+
+    def release_meal_plan_day(self, user_id, week_start, date):
+        self.db.meal_plans.update_one({'user_id': user_id, 'week_start': week_start}, {'$pull': {'prefilled': date}})
+
+    # Rollups
+
+    def increment_rollups(self, user_id, periods, date, increments, tracked=True):
+        """$inc the sums of the user's rollup of each (period, start) and add date to (or, when
+        not tracked, remove it from) its tracked days.
+
+        Rollups are created on first use; both periods go out in one unordered bulk_write.
+        """
+        dates = {'$addToSet' if tracked else '$pull': {'dates': date}}
+        self._upsert_rollups([
+            UpdateOne({'user_id': user_id, 'period': period, 'start': start}, {'$inc': increments, **dates}, upsert=True)
+            for period, start in periods
+        ])
+
+    def _upsert_rollups(self, operations):
+        try:
+            self.db.nutrition_rollups.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # An upsert that raced with the concurrent creation of the same rollup updates it on retry
+            errors = e.details.get('writeErrors', [])
+            if any(error.get('code') != 11000 for error in errors):
+                raise
+            self.db.nutrition_rollups.bulk_write([operations[error['index']] for error in errors], ordered=False)
+
+    def find_rollups(self, user_id, period, start, end):
+        """Rollups of a user's period starting within [start, end], oldest first"""
+        return list(self.db.nutrition_rollups.find({
+            'user_id': user_id,
+            'period': period,
+            'start': {'$gte': start, '$lte': end}
+        }).sort('start', 1))
+
+    def replace_rollups(self, user_id, documents):
+        """Replace all of a user's rollups with documents (used by rebuilds).
+
+        Each document is upserted by (user_id, period, start) before the user's
+        rollups that were not written are deleted, so readers never find the
+        rollups missing.
+        """
+        starts = {}
+        for document in documents:
+            starts.setdefault(document['period'], []).append(document['start'])
+        if documents:
+            self._upsert_rollups([
+                ReplaceOne({'user_id': user_id, 'period': document['period'], 'start': document['start']},
+                           {k: v for k, v in document.items() if k != '_id'}, upsert=True)
+                for document in documents
+            ])
+        stale = {'user_id': user_id}
+        if starts:
+            stale['$nor'] = [{'period': period, 'start': {'$in': values}} for period, values in starts.items()]
+        self.db.nutrition_rollups.delete_many(stale)
+
+    def iter_entries(self, user_id=None, projection=None, batch_size=1000):
+        """Stream the entries of one user (or of all users) in (user_id, date) order.
+
+        The cursor fetches batch_size documents per round trip, so memory stays
+        bounded however long the history is.
+        """
+        query = {'user_id': user_id} if user_id is not None else {}
+        return self.db.nutrition_entries.find(query, projection).sort(
+            [('user_id', 1), ('date', 1)]).batch_size(batch_size)
+
+
+    # Trends
+
+    def find_trend(self, user_id, date):
+        return self.db.nutrition_trends.find_one({'user_id': user_id, 'date': date})
+
+    def find_trends(self, user_id, start, end):
+        """Trends of a user dated within [start, end], oldest first"""
+        return list(self.db.nutrition_trends.find({
+            'user_id': user_id,
+            'date': {'$gte': start, '$lte': end}
+        }).sort('date', 1))
+
+    def save_trends(self, documents):
+        """Store trend documents, replacing those of the same user and date, in one unordered bulk_write"""
+        operations = [
+            ReplaceOne({'user_id': document['user_id'], 'date': document['date']},
+                       {k: v for k, v in document.items() if k != '_id'}, upsert=True)
+            for document in documents
+        ]
+        if not operations:
+            return
+        try:
+            self.db.nutrition_trends.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(error.get('code') != 11000 for error in errors):
+                raise
+            self.db.nutrition_trends.bulk_write([operations[error['index']] for error in errors], ordered=False)
+
+    def delete_trends(self, user_id):
+        self.db.nutrition_trends.delete_many({'user_id': user_id})
+
+    def mark_trends_stale(self, user_id, date):
+        """Record that the user's trends from date on are out of date: one upsert widening the
+        stale range [since, until] and bumping its version"""
+        self.db.nutrition_trend_refreshes.update_one(
+            {'_id': user_id}, {'$min': {'since': date}, '$max': {'until': date}, '$inc': {'version': 1}}, upsert=True
+        )
+
+    def find_stale_trends(self, user_id):
+        """The user's stale range {'since', 'until', 'version'}, or None if the trends are current"""
+        return self.db.nutrition_trend_refreshes.find_one({'_id': user_id})
+
+    def clear_stale_trends(self, user_id, version):
+        """Forget the stale range, unless it was marked again since version was read"""
+        self.db.nutrition_trend_refreshes.delete_one({'_id': user_id, 'version': version})
+
+
+def encode_cursor(created_at, doc_id):
+    """Opaque keyset cursor for the position just after (created_at, doc_id)"""
+    return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{doc_id}'.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        created_at, doc_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|', 1)
+        object_id = to_object_id(doc_id)
+        if object_id is None:
+            raise ValueError('bad id')
+        return datetime.fromisoformat(created_at), object_id
+    except (UnicodeError, ValueError, binascii.Error) as e:
+        raise ValueError(f'Invalid cursor: {cursor!r}') from e
+
+
+def project(document, projection):
+    """Apply a MongoDB-style inclusion or exclusion projection to a document"""
+    if not projection:
+        return document
+    if any(projection.values()):
+        return {field: value for field, value in document.items()
+                if projection.get(field, field == '_id')}
+    return {field: value for field, value in document.items() if field not in projection}
+
+
+class _SortedIndex:
+    """Sorted list of (group, sort value, id) keys supporting range scans within a group"""
+
+    def __init__(self):
+        self._keys = []
+
+    def add(self, group, value, doc_id):
+        bisect.insort(self._keys, (group, value, doc_id))
+
+    def remove(self, group, value, doc_id):
+        position = bisect.bisect_left(self._keys, (group, value, doc_id))
+        if position < len(self._keys) and self._keys[position] == (group, value, doc_id):
+            del self._keys[position]
+
+    def range(self, group, low=None, high=None):
+        """Ids in group with low <= value <= high (either bound optional), in ascending order"""
+        if low is None:
+            start = bisect.bisect_left(self._keys, (group,))
+        else:
+            start = bisect.bisect_left(self._keys, (group, low))
+        if high is None:
+            end = bisect.bisect_left(self._keys, (group + '\uffff',), lo=start)
+        else:
+            end = bisect.bisect_right(self._keys, (group, high, '\uffff'), lo=start)
+        return [doc_id for _, _, doc_id in self._keys[start:end]]
+
+    def descending(self, group, before=None, limit=None):
+        """Ids in group from the highest (value, id) down, starting below the (value, id) key before"""
+        start = bisect.bisect_left(self._keys, (group,))
+        if before is None:
+            end = bisect.bisect_left(self._keys, (group + '\uffff',), lo=start)
+        else:
+            end = bisect.bisect_left(self._keys, (group,) + tuple(before), lo=start)
+        low = start if limit is None else max(start, end - limit)
+        return [doc_id for _, _, doc_id in reversed(self._keys[low:end])]
+
+    def ids(self):
+        """Ids of all groups, in (group, value) order"""
+        return [doc_id for _, _, doc_id in self._keys]
+
+    def count(self, group):
+        return bisect.bisect_left(self._keys, (group + '\uffff',)) - bisect.bisect_left(self._keys, (group,))
+
+
+class MemoryStorage:
+    """Indexed in-process repository used when MongoDB is unavailable.
+
+    Documents are stored by str(_id); user ids in indexes are compared as
+    strings, so ObjectId and string ids find the same documents. All access
+    goes through one lock, which is cheap next to the request handling around it.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._users = {}
+        self._users_by_email = {}
+        self._users_by_username = {}
+        self._recommendations = {}
+        self._recommendations_by_user = _SortedIndex()
+        self._recommendations_by_selection = _SortedIndex()
+        self._recommendations_by_inputs = {}
+        self._entries = {}
+        self._entries_by_user_date = _SortedIndex()
+        self._meal_plans = {}
+        self._rollups = {}
+        self._trends = {}
+        self._stale_trends = {}
+
+    @staticmethod
+    def _new_id(document):
+        return document.get('_id') or ObjectId()
+
+    # Users
+
+    def _index_user(self, document, add=True):
+        doc_id = str(document['_id'])
+        for index, field in ((self._users_by_email, 'email'), (self._users_by_username, 'username')):
+            value = document.get(field)
+            if value is None:
+                continue
+            if add:
+                index[value] = doc_id
+            elif index.get(value) == doc_id:
+                del index[value]
+
+    def _check_unique_user(self, document, doc_id):
+        """Same guarantee as the unique email and username indexes in MongoDB"""
+        for index, field in ((self._users_by_email, 'email'), (self._users_by_username, 'username')):
+            value = document.get(field)
+            if value is not None and index.get(value, doc_id) != doc_id:
+                raise DuplicateKeyError(f"User with {field} {value} already exists")
+
+    def _get_user(self, doc_id, projection=None):
+        document = self._users.get(doc_id) if doc_id else None
+        return dict(project(document, projection)) if document is not None else None
+
+    def find_user_by_id(self, user_id, projection=None):
+        with self._lock:
+            return self._get_user(str(user_id), projection)
+
+    def find_user_by_email(self, email):
+        with self._lock:
+            return self._get_user(self._users_by_email.get(email))
+
+    def find_user_by_username(self, username):
+        with self._lock:
+            return self._get_user(self._users_by_username.get(username))
+
+    def insert_user(self, document):
+        document = dict(document, _id=self._new_id(document))
+        doc_id = str(document['_id'])
+        with self._lock:
+            if doc_id in self._users:
+                raise DuplicateKeyError(f"User {doc_id} already exists")
+            self._check_unique_user(document, doc_id)
+            self._users[doc_id] = document
+            self._index_user(document)
+        return document['_id']
+
+    def update_user(self, user_id, fields):
+        with self._lock:
+            document = self._users.get(str(user_id))
+            if document is None:
+                return
+            self._check_unique_user(fields, str(user_id))
+            self._index_user(document, add=False)
+            document.update(fields)
+            self._index_user(document)
+
+    def _user_ids_after(self, after):
+        ids = sorted(self._users)
+        return ids[bisect.bisect_right(ids, str(after)):] if after is not None else ids
+
+    def count_users(self, after=None):
+        with self._lock:
+            return len(self._user_ids_after(after))
+
+    def find_users(self, after=None, limit=None, projection=None):
+        with self._lock:
+            ids = self._user_ids_after(after)
+            return [self._get_user(doc_id, projection) for doc_id in (ids[:limit] if limit else ids)]
+
+    # Nutrition recommendations
+
+    def find_recommendation(self, rec_id):
+        with self._lock:
+            document = self._recommendations.get(str(rec_id))
+            return dict(document) if document is not None else None
+
+    def find_recommendations(self, user_id, limit=None, before=None, projection=None):
+        if before is not None:
+            before = (before[0], str(before[1]))
+        with self._lock:
+            ids = self._recommendations_by_user.descending(str(user_id), before=before, limit=limit or None)
+            return [dict(project(self._recommendations[doc_id], projection)) for doc_id in ids]
+
+    @staticmethod
+    def _selection_key(document):
+        # Documents stored before selected_at existed were selected when they were created
+        return (document.get('selected_at') or document['created_at'], document['created_at'])
+
+    def _index_recommendation(self, document, add=True):
+        doc_id = str(document['_id'])
+        user_id = str(document['user_id'])
+        if add:
+            self._recommendations_by_user.add(user_id, document['created_at'], doc_id)
+            self._recommendations_by_selection.add(user_id, self._selection_key(document), doc_id)
+        else:
+            self._recommendations_by_user.remove(user_id, document['created_at'], doc_id)
+            self._recommendations_by_selection.remove(user_id, self._selection_key(document), doc_id)
+
+    def find_latest_recommendation(self, user_id):
+        with self._lock:
+            ids = self._recommendations_by_selection.descending(str(user_id), limit=1)
+            return dict(self._recommendations[ids[0]]) if ids else None
+
+    def select_recommendation(self, rec_id, selected_at):
+        self.update_recommendation(rec_id, {'selected_at': selected_at})
+
+    def count_recommendations(self, user_id):
+        with self._lock:
+            return self._recommendations_by_user.count(str(user_id))
+
+    def insert_recommendation(self, document):
+        document = dict(document, _id=self._new_id(document))
+        doc_id = str(document['_id'])
+        with self._lock:
+            self._recommendations[doc_id] = document
+            self._index_recommendation(document)
+            if document.get('inputs_hash'):
+                self._recommendations_by_inputs[(str(document['user_id']), document['inputs_hash'])] = doc_id
+        return document['_id']
+
+    def update_recommendation(self, rec_id, fields):
+        doc_id = str(rec_id)
+        with self._lock:
+            document = self._recommendations.get(doc_id)
+            if document is None:
+                return
+            self._index_recommendation(document, add=False)
+            document.update(fields)
+            self._index_recommendation(document)
+
+    def find_recommendation_by_inputs(self, user_id, inputs_hash):
+        with self._lock:
+            doc_id = self._recommendations_by_inputs.get((str(user_id), inputs_hash))
+            return dict(self._recommendations[doc_id]) if doc_id else None
+
+    def insert_recommendation_once(self, document):
+        with self._lock:
+            existing = self.find_recommendation_by_inputs(document['user_id'], document['inputs_hash'])
+            if existing is None:
+                rec_id = self.insert_recommendation(document)
+            else:
+                rec_id = existing['_id']
+                self.select_recommendation(rec_id, document['selected_at'])
+            return dict(self._recommendations[str(rec_id)])
+
+    def insert_recommendations_once(self, documents):
+        inserted = 0
+        with self._lock:
+            for document in documents:
+                existing = self.find_recommendation_by_inputs(document['user_id'], document['inputs_hash'])
+                if existing is None:
+                    self.insert_recommendation(document)
+                    inserted += 1
+                else:
+                    self.select_recommendation(existing['_id'], document['selected_at'])
+        return inserted
+
+    def latest_recommendation_inputs(self, user_ids):
+        latest = {}
+        with self._lock:
+            for user_id in user_ids:
+                ids = self._recommendations_by_selection.descending(str(user_id), limit=1)
+                if ids:
+                    document = self._recommendations[ids[0]]
+                    latest[str(user_id)] = {'diet_type': document.get('diet_type'),
+                                            'health_focus': document.get('health_focus')}
+        return latest
+
+    # Nutrition entries
+
+    def find_entry(self, entry_id):
+        with self._lock:
+            document = self._entries.get(str(entry_id))
+            return copy.deepcopy(document) if document is not None else None
+
+    def find_entries(self, user_id, start, end, limit=None):
+        with self._lock:
+            ids = self._entries_by_user_date.range(str(user_id), start, end)
+            ids.reverse()
+            if limit:
+                ids = ids[:limit]
+            return [copy.deepcopy(self._entries[doc_id]) for doc_id in ids]
+
+    def _find_day(self, user_id, date):
+        ids = self._entries_by_user_date.range(str(user_id), date, date)
+        return self._entries[ids[0]] if ids else None
+
+    def insert_entry(self, document):
+        document = copy.deepcopy(dict(document, _id=self._new_id(document)))
+        doc_id = str(document['_id'])
+        with self._lock:
+            # Same guarantee as the unique (user_id, date) index in MongoDB
+            if self._find_day(document['user_id'], document['date']) is not None:
+                raise DuplicateKeyError(f"Entry for {document['user_id']} on {document['date']} already exists")
+            self._entries[doc_id] = document
+            self._entries_by_user_date.add(str(document['user_id']), document['date'], doc_id)
+        return document['_id']
+
+    def update_entry(self, entry_id, fields):
+        doc_id = str(entry_id)
+        fields = copy.deepcopy(fields)
+        with self._lock:
+            document = self._entries.get(doc_id)
+            if document is None:
+                return
+            self._entries_by_user_date.remove(str(document['user_id']), document['date'], doc_id)
+            document.update(fields)
+            self._entries_by_user_date.add(str(document['user_id']), document['date'], doc_id)
+
+    def aggregate_entries(self, user_id, start, end, period, fields):
+        period_start(period, start)  # rejects unknown periods, like MongoStorage
+        rows = {}
+        with self._lock:
+            for doc_id in self._entries_by_user_date.range(str(user_id), start, end):
+                document = self._entries[doc_id]
+                key = period_start(period, document['date'])
+                row = rows.get(key)
+                if row is None:
+                    row = rows[key] = dict({field: 0 for field in fields}, start=key, days=0)
+                row['days'] += 1
+                for field in fields:
+                    row[field] += document.get(field) or 0
+        return [rows[key] for key in sorted(rows)]
+
+    def _increment_entry(self, document, increments):
+        for field, amount in increments.items():
+            document[field] = document.get(field, 0) + amount
+        return {field: document[field] for field in increments}
+
+    def upsert_day(self, user_id, date, defaults, foods=None, increments=None):
+        for meal_type in foods or {}:
+            meal_path(meal_type)
+        with self._lock:
+            document = self._find_day(user_id, date)
+            if document is None:
+                doc_id = self.insert_entry(dict(defaults, user_id=user_id, date=date))
+                document = self._entries[str(doc_id)]
+            if foods:
+                for meal_type, items in foods.items():
+                    document.setdefault('meals', {}).setdefault(meal_type, []).extend(copy.deepcopy(items))
+                self._increment_entry(document, increments)
+            return copy.deepcopy(document)
+
+    def push_entry_food(self, entry_id, meal_type, food, increments):
+        meal_path(meal_type)
+        with self._lock:
+            document = self._entries.get(str(entry_id))
+            if document is None:
+                return None
+            document.setdefault('meals', {}).setdefault(meal_type, []).append(copy.deepcopy(food))
+            return self._increment_entry(document, increments)
+
+    def pull_entry_food(self, entry_id, meal_type, food_id, increments):
+        meal_path(meal_type)
+        with self._lock:
+            document = self._entries.get(str(entry_id))
+            foods = (document or {}).get('meals', {}).get(meal_type, [])
+            remaining = [food for food in foods if food.get('id') != food_id]
+            if len(remaining) == len(foods):
+                return None
+            document['meals'][meal_type] = remaining
+            return self._increment_entry(document, increments)
+
+    # Meal plans
+
+    def find_meal_plan(self, user_id, week_start):
+        with self._lock:
+            document = self._meal_plans.get((str(user_id), week_start))
+            return copy.deepcopy(document) if document is not None else None
+
+    def save_meal_plan(self, document):
+        key = (str(document['user_id']), document['week_start'])
+        with self._lock:
+            existing = self._meal_plans.get(key)
+            # Like the $set of MongoStorage: fields the document does not set are kept
+            document = copy.deepcopy(dict(existing or {}, **document))
+            document['_id'] = existing['_id'] if existing else self._new_id(document)
+            self._meal_plans[key] = document
+            return document['_id']
+
+    def claim_meal_plan_day(self, user_id, week_start, date):
+        with self._lock:
+            document = self._meal_plans.get((str(user_id), week_start))
+            if document is None or date in document.get('prefilled', []):
+                return False
+            document.setdefault('prefilled', []).append(date)
+            return True
+
+    def release_meal_plan_day(self, user_id, week_start, date):
+        with self._lock:
+            document = self._meal_plans.get((str(user_id), week_start))
+            if document is not None and date in document.get('prefilled', []):
+                document['prefilled'].remove(date)
+
+    # Rollups
+
+    def increment_rollups(self, user_id, periods, date, increments, tracked=True):
+        with self._lock:
+            rollups = self._rollups.setdefault(str(user_id), {})
+            for period, start in periods:
+                document = rollups.get((period, start))
+                if document is None:
+                    document = rollups[(period, start)] = {'_id': ObjectId(), 'user_id': user_id, 'period': period,
+                                                           'start': start, 'dates': []}
+                self._increment_entry(document, increments)
+                if tracked and date not in document['dates']:
+                    document['dates'].append(date)
+                elif not tracked and date in document['dates']:
+                    document['dates'].remove(date)
+
+    def find_rollups(self, user_id, period, start, end):
+        with self._lock:
+            rollups = self._rollups.get(str(user_id), {})
+            return [copy.deepcopy(rollups[key]) for key in sorted(rollups)
+                    if key[0] == period and start <= key[1] <= end]
+
+    def replace_rollups(self, user_id, documents):
+        documents = [copy.deepcopy(dict(document, _id=self._new_id(document))) for document in documents]
+        with self._lock:
+            self._rollups[str(user_id)] = {(document['period'], document['start']): document
+                                           for document in documents}
+
+    # Trends
+
+    def find_trend(self, user_id, date):
+        with self._lock:
+            document = self._trends.get(str(user_id), {}).get(date)
+            return copy.deepcopy(document) if document is not None else None
+
+    def find_trends(self, user_id, start, end):
+        with self._lock:
+            trends = self._trends.get(str(user_id), {})
+            return [copy.deepcopy(trends[date]) for date in sorted(trends) if start <= date <= end]
+
+    def save_trends(self, documents):
+        with self._lock:
+            for document in documents:
+                trends = self._trends.setdefault(str(document['user_id']), {})
+                existing = trends.get(document['date'])
+                trends[document['date']] = copy.deepcopy(
+                    dict(document, _id=existing['_id'] if existing else self._new_id(document)))
+
+    def delete_trends(self, user_id):
+        with self._lock:
+            self._trends.pop(str(user_id), None)
+
+    def mark_trends_stale(self, user_id, date):
+        with self._lock:
+            stale = self._stale_trends.get(str(user_id))
+            if stale is None:
+                self._stale_trends[str(user_id)] = {'_id': user_id, 'since': date, 'until': date, 'version': 1}
+            else:
+                stale.update(since=min(stale['since'], date), until=max(stale['until'], date),
+                             version=stale['version'] + 1)
+
+    def find_stale_trends(self, user_id):
+        with self._lock:
+            stale = self._stale_trends.get(str(user_id))
+            return dict(stale) if stale is not None else None
+
+    def clear_stale_trends(self, user_id, version):
+        with self._lock:
+            stale = self._stale_trends.get(str(user_id))
+            if stale is not None and stale['version'] == version:
+                del self._stale_trends[str(user_id)]
+
+    def iter_entries(self, user_id=None, projection=None, batch_size=1000):
+        with self._lock:
+            if user_id is not None:
+                ids = self._entries_by_user_date.range(str(user_id))
+            else:
+                ids = self._entries_by_user_date.ids()
+        # Copied a batch at a time, like a cursor, so a long history is never duplicated at once
+        for offset in range(0, len(ids), batch_size):
+            with self._lock:
+                batch = [self._entries.get(doc_id) for doc_id in ids[offset:offset + batch_size]]
+                batch = [copy.deepcopy(project(document, projection)) for document in batch if document is not None]
+            yield from batch
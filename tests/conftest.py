@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+# Tests never touch a real database or the Nutritionix cache file: an unreachable
+# MongoDB makes app.py fall back to MemoryStorage right away
+os.environ['MONGODB_URI'] = 'mongodb://127.0.0.1:1/nutrition_test?serverSelectionTimeoutMS=100'
+os.environ.setdefault('NUTRITIONIX_CACHE_PATH', '')
+os.environ.setdefault('MEAL_PLAN_WORKERS', '0')
+
+
+@pytest.fixture
+def user():
+    """A new user with a complete profile, stored in the app's MemoryStorage"""
+    from bson.objectid import ObjectId
+    from models import User
+    name = f'user_{ObjectId()}'
+    return User(username=name, email=f'{name}@example.com', password_hash='x', age=30, gender='female',
+                weight=60, height=165, activity_level='moderate').save()
+
+
+@pytest.fixture
+def client(user):
+    """A test client logged in as user"""
+    import routes  # noqa: F401  registers the URL handlers
+    from app import app
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session['_user_id'] = user.get_id()
+            session['_fresh'] = True
+        yield client
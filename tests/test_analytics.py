@@ -0,0 +1,50 @@
+import numpy as np
+
+from analytics import lttb
+
+
+def test_lttb_keeps_everything_when_there_are_few_points():
+    assert lttb([0, 1, 2], [5, 6, 7], 10) == [0, 1, 2]
+    assert lttb(range(10), range(10), 2) == list(range(10))
+
+
+def test_lttb_keeps_endpoints_and_one_point_per_bucket():
+    n, threshold = 1000, 50
+    rng = np.random.default_rng(3)
+    kept = lttb(np.arange(n), rng.normal(size=n), threshold)
+    assert len(kept) == threshold
+    assert kept[0] == 0 and kept[-1] == n - 1
+    assert kept == sorted(set(kept))
+    edges = np.arange(threshold - 1) * (n - 2) // (threshold - 2) + 1
+    for bucket, index in enumerate(kept[1:-1]):
+        assert edges[bucket] <= index < edges[bucket + 1]
+
+
+def test_lttb_keeps_spikes():
+    y = np.zeros(300)
+    y[123] = 100
+    y[250] = -80
+    kept = lttb(np.arange(300), y, 20)
+    assert 123 in kept and 250 in kept
+
+
+def test_lttb_matches_reference_implementation():
+    # Straightforward LTTB with the same integer bucket edges
+    def reference(x, y, threshold):
+        n = len(x)
+        edges = [i * (n - 2) // (threshold - 2) + 1 for i in range(threshold - 1)]
+        kept = [0]
+        for i in range(threshold - 2):
+            following = range(edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n)
+            avg_x = sum(x[j] for j in following) / len(following)
+            avg_y = sum(y[j] for j in following) / len(following)
+            a = kept[-1]
+            areas = [abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a]))
+                     for j in range(edges[i], edges[i + 1])]
+            kept.append(edges[i] + areas.index(max(areas)))
+        return kept + [n - 1]
+
+    rng = np.random.default_rng(7)
+    x = np.cumsum(rng.uniform(0.5, 2, size=333))
+    y = rng.normal(size=333)
+    assert lttb(x, y, 40) == reference(list(x), list(y), 40)
@@ -0,0 +1,59 @@
+import time
+
+from cache import LRUCache, SQLiteCache, TwoTierCache, build_two_tier_cache
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_lru_expires_entries():
+    cache = LRUCache(ttl=60)
+    cache.set('a', 1, ttl=-1)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_sqlite_cache_persists_and_bounds_size(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = SQLiteCache(path, max_entries=2, ttl=60)
+    cache.set('a', {'calories': 1})
+    time.sleep(0.01)
+    cache.set('b', {'calories': 2})
+    time.sleep(0.01)
+    cache.set('c', {'calories': 3})
+    assert len(cache) == 2
+    assert cache.get('a') is None
+
+    reopened = SQLiteCache(path, max_entries=2, ttl=60)
+    assert reopened.get('c') == {'calories': 3}
+    reopened.set('d', 4, ttl=-1)
+    assert reopened.get('d') is None
+
+
+def test_two_tier_cache_promotes_disk_hits_and_counts(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    build_two_tier_cache(path, 10, 10, 60).set('apple', {'calories': 95})
+
+    cache = build_two_tier_cache(path, 10, 10, 60)
+    assert cache.get('apple') == {'calories': 95}
+    assert cache.get('apple') == {'calories': 95}
+    assert cache.get('pear') is None
+    stats = cache.stats()
+    assert (stats['disk_hits'], stats['memory_hits'], stats['misses']) == (1, 1, 1)
+    assert stats['persistent']
+    assert cache.peek('apple') == {'calories': 95}
+    assert cache.stats()['memory_hits'] == 1
+
+
+def test_two_tier_cache_without_disk():
+    cache = TwoTierCache(LRUCache())
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    assert not cache.stats()['persistent']
@@ -0,0 +1,71 @@
+import csv
+import gzip
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+
+import export
+from app import storage
+from export import CSV_COLUMNS, export_filename, export_history
+
+DAY = datetime(2024, 5, 1)
+
+
+@pytest.fixture
+def user_id():
+    user_id = ObjectId()
+    for day in range(40):
+        storage.insert_entry({
+            'user_id': user_id, 'date': DAY + timedelta(days=day), 'total_calories': 1500 + day,
+            'total_protein': 80, 'water_intake': 1000,
+            'meals': {'breakfast': [{'id': f'f{day}', 'food_name': 'Oatmeal'}], 'lunch': [{'name': 'Soup, tomato'}]},
+            'notes': 'line one\nline "two"' if day == 3 else ''
+        })
+    storage.insert_entry({'user_id': ObjectId(), 'date': DAY, 'total_calories': 1})
+    return user_id
+
+
+def test_csv_export_streams_the_header_first(user_id):
+    chunks = export_history(user_id, 'csv', batch_size=7)
+    header = next(chunks)
+    assert header == (','.join(CSV_COLUMNS) + '\r\n').encode('utf-8')
+    rows = list(csv.DictReader(io.StringIO((header + b''.join(chunks)).decode('utf-8'), newline='')))
+    assert [row['date'] for row in rows] == [(DAY + timedelta(days=day)).strftime('%Y-%m-%d') for day in range(40)]
+    assert rows[0]['total_calories'] == '1500'
+    assert rows[0]['foods'] == 'Oatmeal; Soup, tomato'
+    assert rows[3]['notes'] == 'line one\nline "two"'
+
+
+def test_gzip_export_round_trips(user_id, monkeypatch):
+    # Small chunks, so the export is encoded and compressed in many pieces
+    monkeypatch.setattr(export, '_CHUNK_SIZE', 256)
+    for fmt in ('csv', 'ndjson'):
+        plain = b''.join(export_history(user_id, fmt))
+        assert len(list(export_history(user_id, fmt))) > 5
+        chunks = list(export_history(user_id, fmt, compress=True, batch_size=3))
+        assert gzip.decompress(b''.join(chunks)) == plain
+        # The first chunk is flushed, so it decodes on its own to the first row
+        first = zlib.decompressobj(wbits=31).decompress(chunks[0])
+        assert first and plain.startswith(first)
+
+
+def test_ndjson_export_has_every_field_but_the_user(user_id):
+    lines = b''.join(export_history(user_id, 'ndjson')).decode('utf-8').splitlines()
+    assert len(lines) == 40
+    first = json.loads(lines[0])
+    assert first['date'] == '2024-05-01'
+    assert first['meals']['breakfast'] == [{'id': 'f0', 'food_name': 'Oatmeal'}]
+    assert isinstance(first['_id'], str)
+    assert 'user_id' not in first
+
+
+def test_export_formats_and_filenames():
+    with pytest.raises(ValueError):
+        next(export_history(ObjectId(), 'xml'))
+    assert list(export_history(ObjectId(), 'ndjson')) == []
+    assert export_filename('csv', date=DAY) == 'nutrition-history-2024-05-01.csv'
+    assert export_filename('ndjson', compress=True, date=DAY) == 'nutrition-history-2024-05-01.ndjson.gz'
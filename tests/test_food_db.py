@@ -0,0 +1,65 @@
+import csv
+
+import numpy as np
+import pytest
+
+from food_db import build_food_database, open_food_database, read_source
+
+FOODS = [
+    {'name': 'Chicken Breast', 'calories': 165, 'protein_g': 31, 'fat_g': 3.6, 'serving_g': 100, 'popularity': 9},
+    {'name': 'Chicken Thigh', 'calories': 209, 'protein_g': 26, 'fat_g': 10.9, 'serving_g': 100, 'popularity': 5},
+    {'name': 'Broccoli', 'calories': 55, 'protein_g': 3.7, 'carbs_g': 11.2, 'fiber_g': 5.1, 'serving_g': 156},
+    {'name': 'Brown Rice', 'calories': 216, 'carbs_g': 45, 'serving_g': 195, 'popularity': 7},
+    {'name': 'broccoli!', 'calories': 1, 'popularity': -1},
+]
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'foods.fdb')
+    assert build_food_database(FOODS, path) == 4
+    database = open_food_database(path)
+    yield database
+    database.close()
+
+
+def test_round_trip_keeps_nutrients_and_names(database):
+    assert len(database) == 4
+    assert 'chicken breast' in database
+    assert database.get('chicken breast') == {
+        'food_name': 'Chicken Breast (100 g)', 'serving_g': 100.0, 'calories': 165.0, 'protein_g': 31.0,
+        'carbs_g': 0.0, 'fat_g': 3.6, 'fiber_g': 0.0
+    }
+    # Colliding names keep the most popular food
+    assert database.get('broccoli')['calories'] == 55.0
+    vector, portions = database.nutrients('broccoli')
+    np.testing.assert_allclose(vector, np.array([55, 3.7, 11.2, 0, 5.1]) * 100 / 156, rtol=1e-5)
+    assert portions == {'serving': 156.0}
+
+
+def test_round_trip_search_indexes(database):
+    assert database.match('Brown rice') == ('brown rice', True)
+    assert database.match('rice') is None
+    assert database.search('brocoli', limit=1)[0][0] == 'broccoli'
+    assert database.autocomplete('chi') == ['chicken breast', 'chicken thigh']
+    assert database.autocomplete('rice') == ['brown rice']
+
+
+def test_read_source_csv(tmp_path):
+    path = tmp_path / 'foods.csv'
+    with open(path, 'w', newline='') as handle:
+        writer = csv.DictWriter(handle, fieldnames=['description', 'energy_kcal'])
+        writer.writeheader()
+        writer.writerow({'description': 'Apple', 'energy_kcal': '52'})
+    database_path = str(tmp_path / 'foods.fdb')
+    build_food_database(read_source(str(path)), database_path)
+    database = open_food_database(database_path)
+    assert database.get('apple')['calories'] == 52.0
+    database.close()
+
+
+def test_open_missing_or_invalid_file(tmp_path):
+    assert open_food_database(str(tmp_path / 'missing.fdb')) is None
+    path = tmp_path / 'bad.fdb'
+    path.write_bytes(b'not a food database')
+    assert open_food_database(str(path)) is None
@@ -0,0 +1,20 @@
+from food_search import PrefixIndex, TrigramIndex, normalize_query
+
+
+def test_normalize_query():
+    assert normalize_query('  Chicken-Breast, GRILLED ') == 'chicken breast grilled'
+
+
+def test_trigram_index_tolerates_typos():
+    names = ['broccoli', 'brown rice', 'chicken breast']
+    index = TrigramIndex.build(names)
+    assert index.search('brocoli')[0][0] == 0
+    assert index.search('chiken breast', limit=1)[0][0] == 2
+    assert index.search('zzzz', min_score=0.5) == []
+
+
+def test_prefix_index_ranks_by_popularity():
+    index = PrefixIndex.build([('chicken breast', 0), ('chicken thigh', 1), ('breast', 0), ('thigh', 1)], [1, 5])
+    assert index.complete('chicken') == [1, 0]
+    assert index.complete('th') == [1]
+    assert index.complete('x') == []
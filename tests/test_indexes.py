@@ -0,0 +1,122 @@
+import pytest
+from pymongo.errors import OperationFailure
+
+import indexes
+from indexes import IndexSpec, bootstrap_indexes, ensure_indexes, index_health, index_report
+from storage import MemoryStorage, MongoStorage
+
+
+class FakeCollection:
+    """The few collection methods index management uses, over in-process state"""
+
+    def __init__(self, name, fail=False):
+        self.name = name
+        self.indexes = {'_id_': {'key': [('_id', 1)]}}
+        self.documents = {}
+        self.fail = fail
+
+    def index_information(self):
+        return dict(self.indexes)
+
+    def create_indexes(self, models):
+        for model in models:
+            document = model.document
+            if self.fail:
+                raise OperationFailure('E11000 duplicate key error')
+            self.indexes[document['name']] = {'key': list(document['key'].items()),
+                                              'unique': document.get('unique', False)}
+
+    def aggregate(self, pipeline):
+        return [{'name': name, 'accesses': {'ops': 0}} for name in self.indexes]
+
+    def find_one(self, query):
+        return self.documents.get(query['_id'])
+
+    def update_one(self, query, update, upsert=False):
+        self.documents.setdefault(query['_id'], {'_id': query['_id']}).update(update['$set'])
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection(name)
+        return self[name]
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+calls = []
+
+
+def fix_up_data(db):
+    calls.append(sorted(db['entries'].indexes))
+    return 3
+
+
+class Entry:
+    collection = 'entries'
+    indexes = [IndexSpec([('user_id', 1), ('date', 1)], unique=True, critical=True, migration=fix_up_data),
+               IndexSpec([('tag', 1)])]
+
+
+class Recommendation:
+    collection = 'recommendations'
+    indexes = [IndexSpec([('user_id', 1), ('created_at', -1)], critical=True)]
+
+
+MODELS = [Entry, Recommendation]
+
+
+@pytest.fixture(autouse=True)
+def fresh_health(monkeypatch):
+    calls.clear()
+    monkeypatch.setitem(indexes._health, 'result', None)
+
+
+def test_ensure_indexes_runs_migrations_before_building_and_is_idempotent():
+    db = FakeDatabase()
+    result = ensure_indexes(db, MODELS)
+    assert result['created'] == ['entries.user_id_1_date_1', 'entries.tag_1', 'recommendations.user_id_1_created_at_-1']
+    assert result['migrated'] == {'fix_up_data': 3}
+    # The migration ran while its index was still missing, and was recorded
+    assert calls == [['_id_']]
+    assert db['migrations'].find_one({'_id': 'fix_up_data'})['result'] == 3
+
+    assert ensure_indexes(db, MODELS) == {'created': [], 'failed': {}, 'migrated': {}}
+    assert index_report(db, MODELS)['missing'] == []
+
+
+def test_failed_index_does_not_stop_the_others():
+    db = FakeDatabase()
+    db['entries'] = FakeCollection('entries', fail=True)
+    result = ensure_indexes(db, MODELS)
+    assert sorted(result['failed']) == ['entries.tag_1', 'entries.user_id_1_date_1']
+    assert result['created'] == ['recommendations.user_id_1_created_at_-1']
+
+
+def test_index_with_a_pending_migration_is_not_critical_yet():
+    db = FakeDatabase()
+    report = index_report(db, MODELS)
+    assert report['missing'] == ['entries.user_id_1_date_1', 'entries.tag_1', 'recommendations.user_id_1_created_at_-1']
+    assert report['critical_missing'] == ['recommendations.user_id_1_created_at_-1']
+    db['migrations'].update_one({'_id': 'fix_up_data'}, {'$set': {'result': 0}}, upsert=True)
+    assert index_report(db, MODELS)['critical_missing'] == ['entries.user_id_1_date_1',
+                                                            'recommendations.user_id_1_created_at_-1']
+
+
+def test_bootstrap_only_verifies_by_default():
+    db = FakeDatabase()
+    storage = MongoStorage(db)
+    bootstrap_indexes(storage, MODELS)
+    assert calls == []
+    assert db['entries'].indexes == {'_id_': {'key': [('_id', 1)]}}
+    healthy, details = index_health(storage, MODELS)
+    assert not healthy and details['critical_missing'] == ['recommendations.user_id_1_created_at_-1']
+
+    bootstrap_indexes(storage, MODELS, create=True)
+    assert calls == [['_id_']]
+    assert index_health(storage, MODELS)[0]
+
+
+def test_memory_storage_is_always_healthy():
+    assert index_health(MemoryStorage(), MODELS) == (True, {'storage': 'memory'})
@@ -0,0 +1,42 @@
+from meal_parser import ParsedItem, parse_item, parse_meal, split_items
+
+
+def test_parse_item_quantity_unit_and_food():
+    assert parse_item('1 cup skim milk') == ParsedItem('1 cup skim milk', 1.0, 'cup', 'skim milk')
+    assert parse_item('200g chicken breast') == ParsedItem('200g chicken breast', 200.0, 'g', 'chicken breast')
+    assert parse_item('2 slices of whole wheat bread').unit == 'slice'
+
+
+def test_parse_item_number_words_and_fractions():
+    assert parse_item('a banana').quantity == 1.0
+    assert parse_item('two dozen eggs').quantity == 24.0
+    assert parse_item('a couple of apples') == ParsedItem('a couple of apples', 2.0, None, 'apples')
+    assert parse_item('1 1/2 cups rice').quantity == 1.5
+    assert parse_item('½ cup oats').quantity == 0.5
+
+
+def test_unit_needs_a_food_after_it():
+    assert parse_item('2 l') == ParsedItem('2 l', 2.0, None, 'l')
+
+
+def test_size_words_stay_in_the_food_unless_they_must_be_the_unit():
+    assert parse_item('2 whole wheat bread').food == 'whole wheat bread'
+    assert parse_item('2 large eggs').food == 'large eggs'
+
+    foods = {'egg', 'eggs', 'whole wheat bread'}
+    resolves = foods.__contains__
+    assert parse_item('2 large eggs', resolves) == ParsedItem('2 large eggs', 2.0, 'piece', 'eggs')
+    assert parse_item('2 whole wheat bread', resolves).food == 'whole wheat bread'
+
+
+def test_split_items_keeps_known_dishes_whole():
+    assert split_items('eggs and toast, coffee') == ['eggs', 'toast', 'coffee']
+    assert split_items('mac and cheese plus salad', is_food={'mac and cheese'}.__contains__) == ['mac and cheese',
+                                                                                               'salad']
+
+
+def test_parse_meal_skips_items_without_a_food():
+    items = parse_meal('2 eggs, a banana and 1 cup skim milk, 3')
+    assert [(item.quantity, item.unit, item.food) for item in items] == [
+        (2.0, None, 'eggs'), (1.0, None, 'banana'), (1.0, 'cup', 'skim milk')
+    ]
@@ -0,0 +1,117 @@
+import pytest
+
+from food_catalog import FOOD_CATALOG
+from meal_planner import (MEAL_SLOTS, PLAN_TOLERANCE, PORTION_STEP, _bounds, excluded_foods, plan_day, plan_foods,
+                          plan_week)
+
+
+def planned(plan):
+    return [item for content in plan['meals'].values() for item in content['items']]
+
+
+def assert_valid(plan, excluded=()):
+    items = planned(plan)
+    assert items
+    assert set(plan['meals']) == set(MEAL_SLOTS)
+    for item in items:
+        low, high, _ = _bounds(item['food'])
+        assert low <= item['grams'] <= high
+        # Rounded to the step, unless that would leave the bounds
+        assert item['grams'] % PORTION_STEP == 0 or item['grams'] in (low, high)
+        assert item['food'] not in excluded
+    assert plan['totals']['calories'] == pytest.approx(sum(item['calories'] for item in items), abs=0.5)
+
+
+def test_plan_day_meets_the_targets_within_bounds():
+    plan = plan_day(2200, 140, 220, 80, diet_type='omnivore')
+    assert_valid(plan)
+    assert plan['within_tolerance']
+    assert all(abs(value) <= PLAN_TOLERANCE for value in plan['deviation'].values())
+    assert plan['totals']['calories'] == pytest.approx(2200, rel=PLAN_TOLERANCE)
+
+
+def test_plan_day_respects_diet_and_allergies():
+    excluded = excluded_foods('vegan', 'peanuts, avocado')
+    assert 'avocado' in excluded and 'peanut butter' in excluded and 'chicken breast' in excluded
+    plan = plan_day(2000, 90, 250, 70, diet_type='vegan', allergies='peanuts, avocado')
+    assert_valid(plan, excluded)
+    for item in planned(plan):
+        assert not {'meat', 'poultry', 'fish', 'egg', 'dairy'}.intersection(FOOD_CATALOG.tags(item['food']))
+
+
+def test_plan_day_is_deterministic_per_seed():
+    first = plan_day(1800, 100, 180, 60, diet_type='mediterranean', seed=1)
+    assert plan_day(1800, 100, 180, 60, diet_type='mediterranean', seed=1) == first
+    other = plan_day(1800, 100, 180, 60, diet_type='mediterranean', seed=2)
+    assert [item['food'] for item in planned(other)] != [item['food'] for item in planned(first)]
+
+
+def test_plan_foods_are_tracker_foods_in_grams():
+    plan = plan_day(2200, 140, 220, 80, diet_type='omnivore')
+    foods = plan_foods(plan)
+    assert [food['quantity'] for meal in MEAL_SLOTS for food in foods[meal]] == [item['grams'] for item in planned(plan)]
+    assert all(food['unit'] == 'g' and food['source'] == 'meal_plan' for meal in foods.values() for food in meal)
+
+
+def test_plan_week_uses_different_foods_every_day():
+    week = plan_week(2000, 120, 200, 70, diet_type='vegan', deadline=60)
+    assert week['complete'] and [day['day'] for day in week['days']] == list(range(7))
+    for day in week['days']:
+        assert not day['fallback'] and day['plan']['within_tolerance']
+    assert len({frozenset(item['food'] for item in planned(day['plan'])) for day in week['days']}) == 7
+
+
+def test_days_missing_the_deadline_get_greedy_plans():
+    week = plan_week(2100, 125, 210, 72, diet_type='omnivore', deadline=0)
+    assert not week['complete']
+    assert all(day['fallback'] for day in week['days'])
+    for day in week['days']:
+        assert_valid(day['plan'])
+        # Greedy plans scale their portions to the calorie target
+        assert abs(day['plan']['deviation']['calories']) <= PLAN_TOLERANCE
+    assert len({frozenset(item['food'] for item in planned(day['plan'])) for day in week['days']}) > 1
+
+
+def test_week_plan_routes(client):
+    client.post('/nutrition/recommendations', data={'diet_type': 'vegetarian', 'health_focus': 'maintenance'})
+    assert client.get('/api/meal_plan/week?date=2024-05-01').status_code == 404
+
+    created = client.post('/api/meal_plan/week', json={'date': '2024-05-01'})
+    assert created.status_code == 200
+    assert created.json['week_start'].startswith('2024-04-29') and len(created.json['days']) == 7
+    stored = client.get('/api/meal_plan/week?date=2024-05-05').json
+    assert not stored['outdated'] and stored['days'] == created.json['days']
+
+    prefill = client.post('/api/meal_plan/week/prefill', json={'date': '2024-05-01'})
+    planned_foods = sum(len(content['items']) for content in created.json['days'][2]['plan']['meals'].values())
+    assert prefill.status_code == 200 and prefill.json['foods_added'] == planned_foods
+    assert prefill.json['totals']['total_calories'] > 0
+    # A day's foods are logged once; days without a plan cannot be prefilled
+    assert client.post('/api/meal_plan/week/prefill', json={'date': '2024-05-01'}).status_code == 409
+    assert client.post('/api/meal_plan/week/prefill', json={'date': '2024-05-08'}).status_code == 404
+
+
+def test_prefill_writes_the_day_once(client, user, monkeypatch):
+    from app import storage
+    from models import NutritionEntry
+    client.post('/nutrition/recommendations', data={'diet_type': 'omnivore', 'health_focus': 'weight_loss'})
+    created = client.post('/api/meal_plan/week', json={'date': '2024-06-03'}).json
+    calls = []
+
+    def counted(name, method):
+        def call(*args, **kwargs):
+            calls.append(name)
+            return method(*args, **kwargs)
+        return call
+
+    for name in ('upsert_day', 'push_entry_food', 'increment_rollups', 'mark_trends_stale'):
+        monkeypatch.setattr(storage, name, counted(name, getattr(storage, name)))
+
+    prefill = client.post('/api/meal_plan/week/prefill', json={'date': '2024-06-03'}).json
+    assert sorted(calls) == ['increment_rollups', 'mark_trends_stale', 'upsert_day']
+    entry = NutritionEntry.get_or_create_day(user.id, '2024-06-03')
+    plan = created['days'][0]['plan']
+    assert [food['food_name'] for food in entry.meals['lunch']] == [
+        FOOD_CATALOG.get(item['food'])['food_name'] for item in plan['meals']['lunch']['items']]
+    assert entry.total_calories == pytest.approx(plan['totals']['calories'], abs=1)
+    assert prefill['totals']['total_calories'] == entry.total_calories
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from nutrients import (food_servings, food_totals, is_liquid, normalize_unit, portion_grams, scale_nutrients,
+                       scale_nutrition, serving_portions)
+
+BANANA = {'food_name': 'Banana (1 medium)', 'serving_g': 118, 'calories': 105, 'protein_g': 1.3, 'carbs_g': 27,
+          'fat_g': 0.4, 'fiber_g': 3.1}
+OLIVE_OIL = {'food_name': 'Olive oil (1 tbsp)', 'serving_g': 13.5, 'calories': 119, 'protein_g': 0, 'carbs_g': 0,
+             'fat_g': 13.5, 'fiber_g': 0}
+
+
+def test_normalize_unit():
+    assert normalize_unit('Tablespoons') == 'tbsp'
+    assert normalize_unit('oz.') == 'oz'
+    assert normalize_unit('medium') == 'piece'
+    assert normalize_unit('handful') is None
+
+
+def test_serving_portions_derive_volume_units_from_the_serving():
+    portions = serving_portions('Lentils (1/2 cup, cooked)', 99)
+    assert portions['serving'] == 99
+    assert portions['cup'] == pytest.approx(198)
+    assert serving_portions(OLIVE_OIL['food_name'], 13.5)['tsp'] == pytest.approx(4.5)
+
+
+def test_portion_grams():
+    portions = serving_portions(BANANA['food_name'], 118)
+    assert portion_grams(portions, 2) == 236
+    assert portion_grams(portions, 50, 'g') == 50
+    assert portion_grams(portions, 1, 'piece') == 118
+    assert portion_grams(portions, 1, 'slice') is None
+
+
+def test_volume_units_without_a_portion_only_convert_for_liquids():
+    apple = {'food_name': 'Apple (1 medium)', 'serving_g': 182, 'calories': 95}
+    granola = {'food_name': 'granola', 'serving_g': 60, 'calories': 280}
+    juice = {'food_name': 'orange juice', 'serving_g': 248, 'calories': 112}
+    assert scale_nutrition(apple, 1, 'cup') is None
+    assert scale_nutrition(granola, 1, 'cup') is None
+    assert food_servings(dict(granola, quantity=1, unit='cup')) is None
+    assert scale_nutrition(juice, 1, 'cup')['grams'] == 240
+    assert food_servings(dict(juice, quantity=2, unit='tbsp')) == pytest.approx(30 / 248)
+    # An explicit flag wins over the name
+    assert scale_nutrition(dict(granola, liquid=True), 1, 'cup')['grams'] == 240
+    # Mass units convert for every food
+    assert scale_nutrition(granola, 30, 'g')['calories'] == 140
+
+
+@pytest.mark.parametrize('food, liquid', [
+    ({'food_name': 'Skim Milk (1 cup)'}, True),
+    ({'food_name': 'Milk, whole'}, True),
+    ({'food_name': 'Olive Oil (1 tbsp)'}, True),
+    ({'food_name': 'Milk Chocolate'}, False),
+    ({'food_name': 'Apple (1 medium)'}, False),
+    ({'food_name': 'chicken soup', 'liquid': False}, False),
+    ({}, False),
+])
+def test_is_liquid(food, liquid):
+    assert is_liquid(food) is liquid
+
+
+def test_scale_nutrients_rows_and_totals():
+    items, totals = scale_nutrients([[100, 10, 0, 0, 0], [50, 0, 10, 0, 0]], [200, 50])
+    np.testing.assert_allclose(items, [[200, 20, 0, 0, 0], [25, 0, 5, 0, 0]])
+    np.testing.assert_allclose(totals, [225, 20, 5, 0, 0])
+
+
+def test_scale_nutrition():
+    scaled = scale_nutrition(BANANA, 2)
+    assert scaled['calories'] == 210
+    assert scaled['grams'] == 236
+    assert scale_nutrition(OLIVE_OIL, 1, 'tsp')['calories'] == pytest.approx(39.7)
+    assert scale_nutrition(BANANA, 1, 'handful') is None
+    # Without a serving weight only serving counts can be scaled
+    assert scale_nutrition({'calories': 100}, 3)['calories'] == 300
+    assert scale_nutrition({'calories': 100}, 200, 'g') is None
+
+
+@pytest.mark.parametrize('food, servings', [
+    ({'calories': 100}, 1),
+    ({'calories': 100, 'quantity': 3}, 3),
+    ({'calories': 100, 'quantity': 2, 'unit': 'piece'}, 2),
+    ({'calories': 100, 'quantity': 200, 'unit': 'g'}, None),
+    ({'calories': 100, 'quantity': 1, 'unit': 'handful'}, None),
+    (dict(BANANA, quantity=59, unit='g'), 0.5),
+    (dict(BANANA, quantity=2, unit='large'), 2),
+])
+def test_food_servings(food, servings):
+    assert food_servings(food) == (pytest.approx(servings) if servings is not None else None)
+
+
+def test_food_totals_match_scale_nutrition():
+    foods = [dict(BANANA, quantity=59, unit='g'), dict(OLIVE_OIL, quantity=2, unit='tsp'), {'calories': 80}]
+    totals = food_totals(foods)
+    expected = sum(scale_nutrition(food, food.get('quantity', 1), food.get('unit'))['calories'] for food in foods)
+    assert totals['calories'] == pytest.approx(expected, abs=0.1)
+    assert food_totals([]) == {'calories': 0, 'protein_g': 0, 'carbs_g': 0, 'fat_g': 0, 'fiber_g': 0}
+
+
+def test_food_totals_refuse_units_they_cannot_convert():
+    with pytest.raises(ValueError):
+        food_totals([{'food_name': 'Mystery', 'calories': 100, 'quantity': 200, 'unit': 'g'}])
@@ -0,0 +1,173 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import utils
+from cache import build_two_tier_cache
+from nutritionix import CircuitBreaker, CircuitOpenError, NutritionixClient
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers POSTs with the next (status, body) of the server's script, then with the last one"""
+
+    def do_POST(self):
+        server = self.server
+        query = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['query']
+        server.queries.append(query)
+        status, body = server.script[min(len(server.queries), len(server.script)) - 1]
+        if body is None:
+            body = json.dumps({'foods': [{'food_name': query, 'nf_calories': 42}]})
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        for start in range(0, len(payload), server.piece_size):
+            self.wfile.write(payload[start:start + server.piece_size])
+            self.wfile.flush()
+            time.sleep(server.piece_delay)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.queries = []
+    server.script = [(200, None)]
+    # Bodies are written in pieces of piece_size bytes, piece_delay seconds apart
+    server.piece_size, server.piece_delay = 1 << 20, 0
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server, **options):
+    options.setdefault('backoff', 0.001)
+    return NutritionixClient('app-id', 'api-key', f'http://127.0.0.1:{server.server_port}/v2/natural/nutrients',
+                             **options)
+
+
+def test_breaker_opens_after_threshold_and_half_opens_after_timeout():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    # Only one trial call at a time
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()['times_opened'] == 1
+
+
+def test_failed_trial_opens_the_breaker_again():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()['times_opened'] == 2
+
+
+def test_client_returns_the_first_food(stub):
+    client = make_client(stub)
+    assert client.natural_nutrients('apple') == {'food_name': 'apple', 'nf_calories': 42}
+    assert stub.queries == ['apple']
+    stub.script = [(200, json.dumps({'foods': []}))]
+    assert client.natural_nutrients('nothing') is None
+    assert client.stats()['calls'] == 2
+
+
+def test_client_retries_transient_statuses(stub):
+    stub.script = [(503, '{}'), (200, None)]
+    client = make_client(stub, max_retries=2)
+    assert client.natural_nutrients('rice')['food_name'] == 'rice'
+    assert len(stub.queries) == 2
+    assert client.stats()['retries'] == 1
+
+
+def test_client_errors_open_the_breaker_but_client_errors_do_not(stub):
+    stub.script = [(500, '{}')]
+    client = make_client(stub, max_retries=1, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.HTTPError):
+            client.natural_nutrients('rice')
+    assert len(stub.queries) == 4
+    with pytest.raises(CircuitOpenError):
+        client.natural_nutrients('rice')
+    assert len(stub.queries) == 4
+
+    stub.script = [(400, '{}')]
+    client = make_client(stub, breaker=CircuitBreaker(failure_threshold=1))
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.natural_nutrients('rice')
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_not_found_means_no_match(stub):
+    stub.script = [(404, json.dumps({'message': "We couldn't match any of your foods"}))]
+    client = make_client(stub, breaker=CircuitBreaker(failure_threshold=1))
+    assert client.natural_nutrients('xyzzy') is None
+    assert client.breaker.state == CircuitBreaker.CLOSED
+    assert client.stats()['failures'] == 0
+
+
+def test_slow_body_is_bounded_by_the_total_timeout(stub):
+    stub.script = [(200, json.dumps({'foods': [], 'padding': ' ' * 8192}))]
+    stub.piece_size, stub.piece_delay = 1024, 0.1
+    client = make_client(stub, read_timeout=1, total_timeout=0.25, max_retries=2)
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.Timeout):
+        client.natural_nutrients('rice')
+    assert time.monotonic() - started < 0.6
+    # No time left for a retry
+    assert len(stub.queries) == 1
+
+
+def test_retries_share_one_deadline(stub):
+    stub.script = [(503, '{}')]
+    client = make_client(stub, backoff=0.1, max_retries=10, total_timeout=0.3)
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.natural_nutrients('rice')
+    assert time.monotonic() - started < 0.5
+    assert 1 < len(stub.queries) < 10
+
+
+def test_invalid_body_counts_as_a_failure(stub):
+    stub.script = [(200, 'not json')]
+    client = make_client(stub, breaker=CircuitBreaker(failure_threshold=1))
+    with pytest.raises(ValueError):
+        client.natural_nutrients('rice')
+    assert client.breaker.state == CircuitBreaker.OPEN
+    assert client.stats()['failures'] == 1
+
+
+def test_no_match_is_cached_for_the_miss_ttl(stub, monkeypatch):
+    stub.script = [(404, json.dumps({'message': "We couldn't match any of your foods"}))]
+    monkeypatch.setattr(utils, 'NUTRITIONIX_CLIENT', make_client(stub))
+    monkeypatch.setattr(utils, 'NUTRITIONIX_CACHE', build_two_tier_cache('', 16, 0, ttl=60))
+    for _ in range(2):
+        assert 'note' in utils.get_food_nutrition('qqxzzv')
+    assert stub.queries == ['qqxzzv']
+
+    monkeypatch.setattr(utils, 'NUTRITIONIX_MISS_TTL', -1)
+    utils.NUTRITIONIX_CACHE.delete('qqxzzv')
+    utils.get_food_nutrition('qqxzzv')
+    utils.get_food_nutrition('qqxzzv')
+    assert len(stub.queries) == 3
@@ -0,0 +1,21 @@
+from models import NutritionRecommendation, User
+
+
+def recommend(client, diet_type):
+    response = client.post('/nutrition/recommendations', data={'diet_type': diet_type, 'health_focus': 'maintenance'})
+    assert response.status_code == 200
+    return response
+
+
+def test_reused_recommendation_becomes_the_latest_again(client, user):
+    recommend(client, 'omnivore')
+    recommend(client, 'keto')
+    assert NutritionRecommendation.get_latest(user.id).diet_type == 'keto'
+
+    response = recommend(client, 'omnivore')
+    assert b'have not changed' in response.data
+    assert NutritionRecommendation.get_latest(user.id).diet_type == 'omnivore'
+    assert User.get_by_id(user.id).latest_recommendation.diet_type == 'omnivore'
+    # Reuse stores nothing new, and the history keeps its creation order
+    history, _ = NutritionRecommendation.get_history(user.id)
+    assert [document['diet_type'] for document in history] == ['keto', 'omnivore']
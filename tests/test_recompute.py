@@ -0,0 +1,77 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from bson.objectid import ObjectId
+
+from recompute import build_recommendations, compute_targets, recompute_recommendations
+from storage import MemoryStorage
+from utils import DIET_MACROS, HEALTH_FOCUS_MODIFIERS, generate_nutrition_recommendation
+
+
+def random_profiles(count, seed=5):
+    rng = np.random.default_rng(seed)
+    profiles = []
+    for _ in range(count):
+        profile = {
+            '_id': ObjectId(),
+            'age': int(rng.integers(16, 90)),
+            'gender': str(rng.choice(['male', 'Male', 'female', 'other'])),
+            'weight': round(float(rng.uniform(40, 150)), 1),
+            'height': round(float(rng.uniform(140, 210)), 1),
+            'activity_level': str(rng.choice(['sedentary', 'light', 'moderate', 'active', 'extra_active', 'unknown'])),
+            'allergies': str(rng.choice(['', 'peanuts', 'dairy, gluten']))
+        }
+        # Some incomplete profiles, which fall back to the default BMR
+        if rng.random() < 0.2:
+            profile[str(rng.choice(['age', 'gender', 'weight', 'height']))] = None
+        profiles.append(profile)
+    return profiles
+
+
+def test_compute_targets_match_generate_nutrition_recommendation():
+    profiles = random_profiles(300)
+    rng = np.random.default_rng(9)
+    diet_types = [str(rng.choice(list(DIET_MACROS) + ['unknown'])) for _ in profiles]
+    health_focuses = [str(rng.choice(list(HEALTH_FOCUS_MODIFIERS))) for _ in profiles]
+    targets = compute_targets(profiles, diet_types, health_focuses)
+
+    for i, profile in enumerate(profiles):
+        expected = generate_nutrition_recommendation(SimpleNamespace(**profile), diet_types[i], health_focuses[i])
+        assert int(targets['calories'][i]) == expected['daily_calories']
+        for macro in ('protein', 'carbs', 'fats'):
+            assert round(float(targets[macro][i]), 1) == expected[macro]
+
+
+def test_built_documents_equal_generated_recommendations():
+    profiles = random_profiles(50, seed=6)
+    inputs = {str(profile['_id']): {'diet_type': 'keto', 'health_focus': 'weight_loss'} for profile in profiles[::2]}
+    now = datetime(2024, 5, 1)
+    documents = build_recommendations(profiles, inputs, now)
+    assert len(documents) == 25
+
+    for document, profile in zip(documents, profiles[::2]):
+        expected = generate_nutrition_recommendation(SimpleNamespace(**profile), 'keto', 'weight_loss')
+        assert {key: document[key] for key in expected} == expected
+        assert (document['user_id'], document['created_at'], document['health_focus']) == (
+            profile['_id'], now, 'weight_loss')
+
+
+def test_recompute_is_idempotent_and_resumable():
+    storage = MemoryStorage()
+    ids = [storage.insert_user(profile) for profile in random_profiles(7, seed=8)]
+    for user_id in ids[:5]:
+        storage.insert_recommendation({'user_id': user_id, 'created_at': datetime(2024, 1, 1),
+                                       'diet_type': 'vegan', 'health_focus': 'maintenance'})
+
+    progress = list(recompute_recommendations(storage, batch_size=3))
+    assert [(users, written) for _, users, written in progress] == [(3, 3), (3, 2), (1, 0)]
+    assert storage.find_latest_recommendation(ids[0])['diet_type'] == 'vegan'
+    assert storage.find_latest_recommendation(ids[0])['inputs_hash']
+
+    # A rerun, or resuming after the second batch, stores nothing new
+    assert sum(written for _, _, written in recompute_recommendations(storage, batch_size=3)) == 0
+    assert sum(written for _, _, written in recompute_recommendations(storage, after=progress[1][0])) == 0
+    assert storage.count_recommendations(ids[0]) == 2
+    assert storage.count_recommendations(ids[6]) == 0
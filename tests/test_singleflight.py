@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight, StripedFileLock
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('key', slow))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while flight.stats()['coalesced'] < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert results == ['result'] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {'executed': 1, 'coalesced': 3, 'in_flight': 0}
+
+
+def test_single_flight_propagates_errors():
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError('upstream down')
+
+    with pytest.raises(RuntimeError):
+        flight.do('key', fail)
+    assert flight.do('key', lambda: 'ok') == 'ok'
+
+
+def test_striped_file_lock_is_exclusive(tmp_path):
+    locks = StripedFileLock(str(tmp_path / 'locks'), stripes=4)
+    inside, overlaps = [], []
+
+    def work():
+        with locks.lock('apple'):
+            inside.append(1)
+            overlaps.append(len(inside))
+            time.sleep(0.01)
+            inside.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert overlaps == [1, 1, 1, 1]
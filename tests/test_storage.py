@@ -0,0 +1,171 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from migrations import _merge_entries
+from storage import MemoryStorage, decode_cursor, encode_cursor, meal_path, period_start
+
+DAY = datetime(2024, 5, 1)
+
+
+@pytest.fixture
+def storage():
+    return MemoryStorage()
+
+
+def test_users_are_indexed_by_email_and_username(storage):
+    user_id = storage.insert_user({'username': 'ann', 'email': 'ann@example.com', 'password_hash': 'x'})
+    assert storage.find_user_by_email('ann@example.com')['_id'] == user_id
+    assert storage.find_user_by_id(str(user_id), projection={'password_hash': False}) == {
+        '_id': user_id, 'username': 'ann', 'email': 'ann@example.com'}
+    storage.update_user(user_id, {'email': 'ann@example.org'})
+    assert storage.find_user_by_email('ann@example.com') is None
+    assert storage.find_user_by_username('ann')['email'] == 'ann@example.org'
+
+
+def test_user_email_and_username_are_unique(storage):
+    ann = storage.insert_user({'username': 'ann', 'email': 'ann@example.com'})
+    bob = storage.insert_user({'username': 'bob', 'email': 'bob@example.com'})
+    with pytest.raises(DuplicateKeyError):
+        storage.insert_user({'username': 'ann', 'email': 'other@example.com'})
+    with pytest.raises(DuplicateKeyError):
+        storage.insert_user({'username': 'other', 'email': 'ann@example.com'})
+    with pytest.raises(DuplicateKeyError):
+        storage.update_user(bob, {'email': 'ann@example.com'})
+    # A failed update changes nothing; saving a user's own values again is fine
+    assert storage.find_user_by_email('bob@example.com')['_id'] == bob
+    storage.update_user(ann, {'username': 'ann', 'email': 'ann@example.com'})
+    assert storage.find_user_by_username('ann')['_id'] == ann
+
+
+def test_entries_are_found_by_user_and_date_range(storage):
+    for day in range(5):
+        storage.insert_entry({'user_id': 'u', 'date': DAY + timedelta(days=day), 'n': day})
+    storage.insert_entry({'user_id': 'other', 'date': DAY, 'n': -1})
+    entries = storage.find_entries('u', DAY + timedelta(days=1), DAY + timedelta(days=3))
+    assert [entry['n'] for entry in entries] == [3, 2, 1]
+    # Returned documents are copies
+    entries[0]['n'] = 99
+    assert [entry['n'] for entry in storage.find_entries('u', DAY, DAY + timedelta(days=9), limit=2)] == [4, 3]
+
+
+def test_meal_path_rejects_other_fields():
+    assert meal_path('breakfast') == 'meals.breakfast'
+    for meal in ('', 'a.b', '$set'):
+        with pytest.raises(ValueError):
+            meal_path(meal)
+
+
+def test_push_and_pull_entry_food(storage):
+    entry_id = storage.insert_entry({'user_id': 'u', 'date': DAY, 'meals': {'lunch': [{'id': 'f1'}]},
+                                     'total_calories': 100})
+    assert storage.push_entry_food(entry_id, 'lunch', {'id': 'f2'}, {'total_calories': 50}) == {
+        'total_calories': 150}
+    assert storage.pull_entry_food(entry_id, 'lunch', 'f1', {'total_calories': -100}) == {'total_calories': 50}
+    # Pulling a food that is gone again changes nothing
+    assert storage.pull_entry_food(entry_id, 'lunch', 'f1', {'total_calories': -100}) is None
+    entry = storage.find_entry(entry_id)
+    assert (entry['total_calories'], [food['id'] for food in entry['meals']['lunch']]) == (50, ['f2'])
+
+
+def test_upsert_day_creates_the_day_once(storage):
+    defaults = {'meals': {'breakfast': []}, 'total_calories': 0}
+    entry = storage.upsert_day('u', DAY, defaults, {'lunch': [{'id': 'f1'}, {'id': 'f2'}], 'dinner': [{'id': 'f3'}]},
+                               {'total_calories': 100})
+    again = storage.upsert_day('u', DAY, defaults)
+    assert again['_id'] == entry['_id']
+    assert again['total_calories'] == 100
+    assert [food['id'] for food in again['meals']['lunch']] == ['f1', 'f2']
+    assert again['meals']['breakfast'] == [] and len(again['meals']['dinner']) == 1
+    with pytest.raises(DuplicateKeyError):
+        storage.insert_entry({'user_id': 'u', 'date': DAY})
+
+
+def test_merge_duplicate_entries_combines_foods_and_totals():
+    keep = {'_id': 1, 'meals': {'breakfast': [{'id': 'a'}]}, 'total_calories': 100, 'water_intake': 500,
+            'notes': 'x'}
+    duplicate = {'_id': 2, 'meals': {'breakfast': [{'id': 'a'}, {'id': 'b'}], 'lunch': [{'id': 'c'}]},
+                 'total_calories': 50, 'water_intake': 800, 'notes': 'y'}
+    merged = _merge_entries(keep, [duplicate])
+    assert merged['meals'] == {'breakfast': [{'id': 'a'}, {'id': 'b'}], 'lunch': [{'id': 'c'}]}
+    assert (merged['total_calories'], merged['water_intake'], merged['notes']) == (150, 800, 'x\ny')
+    assert merged['_id'] == 1
+
+
+def test_cursor_round_trip():
+    doc_id = ObjectId()
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 250000)
+    assert decode_cursor(encode_cursor(created_at, doc_id)) == (created_at, doc_id)
+    for cursor in ('', 'not a cursor', encode_cursor(created_at, 'bad-id')):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+def test_recommendations_page_with_keyset_cursors(storage):
+    for i in range(5):
+        storage.insert_recommendation({'user_id': 'u', 'created_at': DAY + timedelta(hours=i), 'n': i})
+    storage.insert_recommendation({'user_id': 'other', 'created_at': DAY, 'n': -1})
+
+    first = storage.find_recommendations('u', limit=2)
+    assert [document['n'] for document in first] == [4, 3]
+    last = first[-1]
+    second = storage.find_recommendations('u', limit=2, before=decode_cursor(encode_cursor(last['created_at'],
+                                                                                          last['_id'])))
+    assert [document['n'] for document in second] == [2, 1]
+    assert storage.count_recommendations('u') == 5
+
+
+def test_meal_plan_days_are_claimed_once(storage):
+    week = period_start('week', DAY)
+    assert not storage.claim_meal_plan_day('u', week, DAY)
+    storage.save_meal_plan({'user_id': 'u', 'week_start': week, 'days': [], 'complete': True})
+    assert storage.claim_meal_plan_day('u', week, DAY)
+    assert not storage.claim_meal_plan_day('u', week, DAY)
+    # Replanning the week keeps the claims
+    storage.save_meal_plan({'user_id': 'u', 'week_start': week, 'days': [{'date': DAY}], 'complete': True})
+    assert storage.find_meal_plan('u', week)['prefilled'] == [DAY]
+    storage.release_meal_plan_day('u', week, DAY)
+    assert storage.claim_meal_plan_day('u', week, DAY)
+
+
+def test_period_start():
+    assert period_start('week', datetime(2024, 5, 5, 18)) == datetime(2024, 4, 29)
+    assert period_start('month', datetime(2024, 5, 5)) == datetime(2024, 5, 1)
+    with pytest.raises(ValueError):
+        period_start('year', DAY)
+
+
+def test_rollup_dates_follow_the_tracked_flag(storage):
+    periods = [('week', period_start('week', DAY))]
+    storage.increment_rollups('u', periods, DAY, {'total_calories': 100})
+    assert storage.find_rollups('u', 'week', DAY - timedelta(days=7), DAY)[0]['dates'] == [DAY]
+    storage.increment_rollups('u', periods, DAY, {'total_calories': -100}, tracked=False)
+    rollup = storage.find_rollups('u', 'week', DAY - timedelta(days=7), DAY)[0]
+    assert (rollup['dates'], rollup['total_calories']) == ([], 0)
+
+    storage.replace_rollups('u', [{'user_id': 'u', 'period': 'month', 'start': datetime(2024, 5, 1), 'dates': []}])
+    assert storage.find_rollups('u', 'week', datetime(2024, 1, 1), DAY) == []
+    assert len(storage.find_rollups('u', 'month', datetime(2024, 1, 1), DAY)) == 1
+
+
+def test_aggregate_entries_groups_by_period(storage):
+    for day in range(10):
+        storage.insert_entry({'user_id': 'u', 'date': DAY + timedelta(days=day), 'total_calories': 100})
+    weeks = storage.aggregate_entries('u', DAY, DAY + timedelta(days=9), 'week', ['total_calories'])
+    assert [(row['start'], row['days'], row['total_calories']) for row in weeks] == [
+        (datetime(2024, 4, 29), 5, 500), (datetime(2024, 5, 6), 5, 500)
+    ]
+
+
+def test_stale_trends_are_cleared_only_at_the_version_read(storage):
+    storage.mark_trends_stale('u', DAY + timedelta(days=3))
+    storage.mark_trends_stale('u', DAY)
+    stale = storage.find_stale_trends('u')
+    assert (stale['since'], stale['until']) == (DAY, DAY + timedelta(days=3))
+    storage.mark_trends_stale('u', DAY + timedelta(days=1))
+    storage.clear_stale_trends('u', stale['version'])
+    assert storage.find_stale_trends('u') is not None
+    storage.clear_stale_trends('u', storage.find_stale_trends('u')['version'])
+    assert storage.find_stale_trends('u') is None
@@ -0,0 +1,86 @@
+import logging
+
+import numpy as np
+import pytest
+
+from trends import EWMA_SPAN, METRICS, SHORT_WINDOW, WINDOW, rolling_stats
+
+
+def brute_force(values, tracked, day):
+    def average(days):
+        rows = [values[i] for i in days if tracked[i]]
+        return [round(float(np.mean([row[m] for row in rows])), 1) if rows else 0 for m in range(len(METRICS))]
+
+    alpha = 2 / (EWMA_SPAN + 1)
+    weights = [((1 - alpha) ** age, values[day - age]) for age in range(WINDOW) if tracked[day - age]]
+    total = sum(weight for weight, _ in weights)
+    ewma = [round(float(sum(weight * row[m] for weight, row in weights) / total), 1) if total else 0
+            for m in range(len(METRICS))]
+    return {
+        'avg_7': average(range(day - SHORT_WINDOW + 1, day + 1)),
+        'avg_30': average(range(day - WINDOW + 1, day + 1)),
+        'ewma': ewma
+    }
+
+
+def test_rolling_stats_match_brute_force():
+    rng = np.random.default_rng(11)
+    n = WINDOW + 40
+    values = rng.uniform(0, 3000, size=(n, len(METRICS)))
+    tracked = rng.random(n) < 0.7
+    stats = rolling_stats(values, tracked, streak_before=4)
+    assert len(stats) == n - WINDOW + 1
+
+    streak = 4
+    for offset, stat in enumerate(stats):
+        day = WINDOW - 1 + offset
+        streak = streak + 1 if tracked[day] else 0
+        expected = brute_force(values, tracked, day)
+        assert stat['tracked'] == tracked[day]
+        assert stat['streak'] == streak
+        assert stat['days_7'] == int(tracked[day - SHORT_WINDOW + 1:day + 1].sum())
+        assert stat['days_30'] == int(tracked[day - WINDOW + 1:day + 1].sum())
+        for key in ('avg_7', 'avg_30', 'ewma'):
+            assert list(stat[key].values()) == pytest.approx(expected[key], abs=0.11)
+
+
+def test_untracked_days_do_not_pull_averages_down():
+    values = np.full((WINDOW, len(METRICS)), 2000.0)
+    tracked = np.zeros(WINDOW, dtype=bool)
+    tracked[-3:] = True
+    values[~tracked] = 0
+    # The streak of the computed day continues the one before it, not the feed-only days
+    stat = rolling_stats(values, tracked, streak_before=2)[0]
+    assert stat['avg_30']['calories'] == 2000
+    assert stat['ewma']['calories'] == 2000
+    assert (stat['days_7'], stat['days_30'], stat['streak']) == (3, 3, 3)
+
+
+def test_empty_window():
+    stat = rolling_stats(np.zeros((WINDOW, len(METRICS))), np.zeros(WINDOW, dtype=bool), streak_before=9)[0]
+    assert stat['streak'] == 0 and stat['days_30'] == 0
+    assert stat['avg_7'] == {metric: 0 for metric in METRICS}
+
+
+def test_failed_recompute_keeps_trends_stale(user, monkeypatch, caplog):
+    import models
+    from models import NutritionEntry, NutritionTrend
+    food = {'food_name': 'Rice', 'calories': 200, 'protein_g': 4, 'carbs_g': 44, 'fat_g': 0.4, 'fiber_g': 0.6}
+    NutritionEntry.get_or_create_day(user.id, '2024-06-03', 'lunch', food)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('database unavailable')
+
+    monkeypatch.setattr(models.storage, 'aggregate_entries', fail)
+    with caplog.at_level(logging.ERROR):
+        trend = NutritionTrend.get(user.id, '2024-06-03')
+    assert trend.to_dict()['stale'] is True
+    assert any(record.levelno == logging.ERROR and str(user.id) in record.getMessage() for record in caplog.records)
+    assert models.storage.find_stale_trends(user.id) is not None
+
+    # The next read after the failure recomputes and clears the marker
+    monkeypatch.undo()
+    trend = NutritionTrend.get(user.id, '2024-06-03')
+    assert trend.stale is False
+    assert (trend.tracked, trend.avg_7['calories']) == (True, 200)
+    assert models.storage.find_stale_trends(user.id) is None
@@ -0,0 +1,73 @@
+"""
+Rolling statistics of a user's daily intake.
+
+For every day the trend holds 7- and 30-day averages of calories and macros,
+an exponentially weighted average, and the tracking streak. The averages
+are taken over the tracked days of each window (days with calories logged),
+so untracked days do not pull them towards zero. The EWMA weights the
+tracked days of the last WINDOW days by age with span EWMA_SPAN.
+
+A day's totals only enter the windows of the WINDOW days starting at it,
+which is what lets NutritionTrend recompute a bounded range of days when
+one entry changes instead of the whole history.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Longest window: a day's totals affect the statistics of the WINDOW days from it
+WINDOW = 30
+SHORT_WINDOW = 7
+EWMA_SPAN = 7
+
+# Averaged metrics and the entry total each one is taken from
+METRICS = {
+    'calories': 'total_calories',
+    'protein': 'total_protein',
+    'carbs': 'total_carbs',
+    'fat': 'total_fat'
+}
+
+# Weight of a day 0, 1, ... WINDOW-1 days old
+_WEIGHTS = (1 - 2 / (EWMA_SPAN + 1)) ** np.arange(WINDOW)
+
+
+def _averages(sums, days):
+    return {metric: round(float(total) / days, 1) if days else 0 for metric, total in zip(METRICS, sums)}
+
+
+def rolling_stats(values, tracked, streak_before=0):
+    """Statistics of the last len(values) - WINDOW + 1 of n consecutive days.
+
+    values is an (n, len(METRICS)) array of daily totals and tracked a boolean
+    array of the days with calories logged; the first WINDOW - 1 days only
+    feed the windows. streak_before is the streak of the day before the first
+    computed day. Returns one dict per computed day, oldest first.
+    """
+    values = np.where(tracked[:, None], values, 0.0)
+    sums = np.vstack([np.zeros(values.shape[1]), np.cumsum(values, axis=0)])
+    counts = np.concatenate([[0], np.cumsum(tracked)])
+    # Windows of WINDOW days ending on each computed day, newest day first
+    windows = sliding_window_view(values, WINDOW, axis=0)[:, :, ::-1]
+    weights = sliding_window_view(tracked, WINDOW)[:, ::-1] * _WEIGHTS
+    weighted = (windows * weights[:, None, :]).sum(axis=2)
+    weight_totals = weights.sum(axis=1)
+
+    stats = []
+    streak = streak_before
+    for i in range(WINDOW - 1, len(values)):
+        streak = streak + 1 if tracked[i] else 0
+        end = i + 1
+        days_7 = int(counts[end] - counts[end - SHORT_WINDOW])
+        days_30 = int(counts[end] - counts[end - WINDOW])
+        row = i - WINDOW + 1
+        ewma = weighted[row] / weight_totals[row] if weight_totals[row] else weighted[row]
+        stats.append({
+            'tracked': bool(tracked[i]),
+            'streak': streak,
+            'days_7': days_7,
+            'days_30': days_30,
+            'avg_7': _averages(sums[end] - sums[end - SHORT_WINDOW], days_7),
+            'avg_30': _averages(sums[end] - sums[end - WINDOW], days_30),
+            'ewma': _averages(ewma, 1)
+        })
+    return stats
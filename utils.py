@@ -1,12 +1,77 @@
 import os
+import hashlib
+import json
 import requests
 import logging
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import numpy as np
+
+from cache import build_two_tier_cache
+from food_catalog import FOODS, FUZZY_MATCH_THRESHOLD, normalize_query
+from meal_parser import parse_meal
+from nutrients import NUTRIENTS, nutrient_dict, scale_nutrition
+from nutritionix import CircuitBreaker, CircuitOpenError, NutritionixClient
+from singleflight import SingleFlight, StripedFileLock
+
 # Nutritionix API credentials
 NUTRITIONIX_APP_ID = os.environ.get("NUTRITIONIX_APP_ID", "")
 NUTRITIONIX_API_KEY = os.environ.get("NUTRITIONIX_API_KEY", "")
+NUTRITIONIX_ENDPOINT = os.environ.get("NUTRITIONIX_ENDPOINT", "https://trackapi.nutritionix.com/v2/natural/nutrients")
+
+# Shared, pooled client so a slow or failing upstream can never hold a worker for long
+NUTRITIONIX_CLIENT = NutritionixClient(
+    app_id=NUTRITIONIX_APP_ID,
+    api_key=NUTRITIONIX_API_KEY,
+    endpoint=NUTRITIONIX_ENDPOINT,
+    connect_timeout=float(os.environ.get("NUTRITIONIX_CONNECT_TIMEOUT", 2)),
+    read_timeout=float(os.environ.get("NUTRITIONIX_READ_TIMEOUT", 5)),
+    max_retries=int(os.environ.get("NUTRITIONIX_MAX_RETRIES", 2)),
+    total_timeout=float(os.environ.get("NUTRITIONIX_TOTAL_TIMEOUT", 8)),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.environ.get("NUTRITIONIX_BREAKER_THRESHOLD", 5)),
+        reset_timeout=float(os.environ.get("NUTRITIONIX_BREAKER_RESET", 30))
+    )
+)
+
+# Cache for Nutritionix responses: an in-process LRU backed by a SQLite file shared by all workers on the host.
+# Set NUTRITIONIX_CACHE_PATH to an empty string to keep the cache in memory only.
+NUTRITIONIX_CACHE = build_two_tier_cache(
+    path=os.environ.get("NUTRITIONIX_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'nutritionix_cache.db')),
+    memory_entries=int(os.environ.get("NUTRITIONIX_CACHE_SIZE", 1024)),
+    disk_entries=int(os.environ.get("NUTRITIONIX_CACHE_DISK_SIZE", 50000)),
+    ttl=int(os.environ.get("NUTRITIONIX_CACHE_TTL", 7 * 24 * 3600))
+)
+
+# Queries Nutritionix cannot match are cached as NUTRITIONIX_NO_MATCH for a shorter time,
+# so unknown foods do not cost an upstream call on every lookup but are retried eventually
+NUTRITIONIX_NO_MATCH = {'no_match': True}
+NUTRITIONIX_MISS_TTL = int(os.environ.get("NUTRITIONIX_MISS_TTL", 3600))
+
+# Coalesce identical in-flight Nutritionix lookups: one upstream call per normalized query within a worker,
+# and, when the cache is shared on disk, one per query across the workers on the host
+NUTRITIONIX_FLIGHTS = SingleFlight()
+NUTRITIONIX_LOCKS = None
+if NUTRITIONIX_CACHE.disk is not None:
+    try:
+        NUTRITIONIX_LOCKS = StripedFileLock(os.path.join(os.path.dirname(NUTRITIONIX_CACHE.disk.path) or '.', 'locks'))
+    except OSError as e:
+        logging.warning(f"Cross-process Nutritionix locks unavailable: {str(e)}")
+
+# Batch lookups: upper bound on queries per request, and the shared pool that resolves catalog misses concurrently
+MAX_BATCH_QUERIES = int(os.environ.get("FOOD_BATCH_MAX_QUERIES", 50))
+FOOD_LOOKUP_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("FOOD_LOOKUP_WORKERS", 8)),
+    thread_name_prefix='food-lookup'
+)
+
+# Meal descriptions: longest accepted text, and how many parsed items were resolved locally vs. remotely
+MAX_MEAL_TEXT_LENGTH = int(os.environ.get("MEAL_TEXT_MAX_LENGTH", 2000))
+MEAL_PARSER_STATS = {'meals': 0, 'items': 0, 'local_items': 0, 'remote_items': 0}
+_MEAL_PARSER_STATS_LOCK = threading.Lock()
 
 # Base macronutrient ratios for different diet types
 DIET_MACROS = {
@@ -83,6 +148,35 @@ FOOD_SUGGESTIONS = {
     }
 }
 
+# Activity level multipliers applied to BMR
+ACTIVITY_MULTIPLIERS = {
+    'sedentary': 1.2,
+    'light': 1.375,
+    'moderate': 1.55,
+    'active': 1.725,
+    'extra_active': 1.9
+}
+
+# Profile fields a recommendation depends on
+RECOMMENDATION_PROFILE_FIELDS = ('age', 'gender', 'weight', 'height', 'activity_level', 'allergies')
+
+# Fingerprint of the tables above; editing any of them changes every inputs hash, so
+# recommendations generated from the old tables are not reused
+RECOMMENDATION_TABLES_FINGERPRINT = hashlib.sha256(json.dumps(
+    [DIET_MACROS, HEALTH_FOCUS_MODIFIERS, FOOD_SUGGESTIONS, ACTIVITY_MULTIPLIERS], sort_keys=True
+).encode('utf-8')).hexdigest()[:16]
+
+def recommendation_inputs_hash(user, diet_type, health_focus):
+    """Content address of a recommendation: a hash of everything generate_nutrition_recommendation reads"""
+    profile = {field: getattr(user, field, None) for field in RECOMMENDATION_PROFILE_FIELDS}
+    return profile_inputs_hash(profile, diet_type, health_focus)
+
+def profile_inputs_hash(profile, diet_type, health_focus):
+    """recommendation_inputs_hash for a user document (dict) instead of a User"""
+    inputs = {field: profile.get(field) for field in RECOMMENDATION_PROFILE_FIELDS}
+    inputs.update({'diet_type': diet_type, 'health_focus': health_focus, 'tables': RECOMMENDATION_TABLES_FINGERPRINT})
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
 def calculate_bmr(user):
     """Calculate Basal Metabolic Rate using the Mifflin-St Jeor Equation"""
     if not user.weight or not user.height or not user.age or not user.gender:
@@ -100,19 +194,17 @@ def calculate_tdee(user):
     """Calculate Total Daily Energy Expenditure based on BMR and activity level"""
     bmr = calculate_bmr(user)
     
-    activity_multipliers = {
-        'sedentary': 1.2,
-        'light': 1.375,
-        'moderate': 1.55,
-        'active': 1.725,
-        'extra_active': 1.9
-    }
-    
-    multiplier = activity_multipliers.get(user.activity_level, 1.375)  # Default to lightly active
+    multiplier = ACTIVITY_MULTIPLIERS.get(user.activity_level, 1.375)  # Default to lightly active
     return bmr * multiplier
 
 def generate_nutrition_recommendation(user, diet_type, health_focus):
-    """Generate personalized nutrition recommendations based on user profile and preferences"""
+    """Generate personalized nutrition recommendations based on user profile and preferences.
+    
+    Deterministic: meal suggestions are drawn with a generator seeded from the
+    inputs hash, so the same inputs always produce the same recommendation.
+    """
+    inputs_hash = recommendation_inputs_hash(user, diet_type, health_focus)
+    
     # Calculate daily caloric needs
     tdee = calculate_tdee(user)
     
@@ -138,15 +230,37 @@ def generate_nutrition_recommendation(user, diet_type, health_focus):
     carbs_g = (adjusted_macros['carbs'] * adjusted_calories) / 4      # 4 calories per gram of carbs
     fats_g = (adjusted_macros['fats'] * adjusted_calories) / 9        # 9 calories per gram of fat
     
-    # Get food suggestions based on diet type
-    diet_suggestions = FOOD_SUGGESTIONS.get(diet_type, FOOD_SUGGESTIONS['omnivore'])
+    breakfast, lunch, dinner, snacks = suggest_meals(diet_type, inputs_hash)
+    additional_notes = recommendation_notes(health_focus, user.allergies)
     
-    breakfast = random.choice(diet_suggestions['breakfast'])
-    lunch = random.choice(diet_suggestions['lunch'])
-    dinner = random.choice(diet_suggestions['dinner'])
-    snacks = ', '.join(random.sample(diet_suggestions['snacks'], 2))
+    recommendation = {
+        'daily_calories': int(adjusted_calories),
+        'protein': round(protein_g, 1),
+        'carbs': round(carbs_g, 1),
+        'fats': round(fats_g, 1),
+        'breakfast_suggestion': breakfast,
+        'lunch_suggestion': lunch,
+        'dinner_suggestion': dinner,
+        'snacks_suggestion': snacks,
+        'additional_notes': additional_notes,
+        'inputs_hash': inputs_hash
+    }
+    
+    return recommendation
+
+def suggest_meals(diet_type, inputs_hash):
+    """Pick (breakfast, lunch, dinner, snacks) for a diet with a generator seeded from the inputs hash"""
+    rng = random.Random(int(inputs_hash[:16], 16))
+    diet_suggestions = FOOD_SUGGESTIONS.get(diet_type, FOOD_SUGGESTIONS['omnivore'])
     
-    # Generate additional notes based on health focus
+    breakfast = rng.choice(diet_suggestions['breakfast'])
+    lunch = rng.choice(diet_suggestions['lunch'])
+    dinner = rng.choice(diet_suggestions['dinner'])
+    snacks = ', '.join(rng.sample(diet_suggestions['snacks'], 2))
+    return breakfast, lunch, dinner, snacks
+
+def recommendation_notes(health_focus, allergies):
+    """Additional notes based on health focus and allergies"""
     additional_notes = ""
     if health_focus == 'weight_loss':
         additional_notes = "Focus on high-protein, high-fiber foods to help with satiety. Stay hydrated and consider eating smaller, more frequent meals."
@@ -160,527 +274,83 @@ def generate_nutrition_recommendation(user, diet_type, health_focus):
         additional_notes = "Include complex carbohydrates for sustained energy and ensure adequate hydration. Consider smaller, frequent meals."
     
     # Account for allergies if specified
-    if user.allergies:
-        additional_notes += f"\n\nNote: Please avoid {user.allergies} as per your allergy information."
+    if allergies:
+        additional_notes += f"\n\nNote: Please avoid {allergies} as per your allergy information."
+    return additional_notes
+
+def _fetch_nutritionix(query, cache_key):
+    """Query Nutritionix for a catalog miss and cache the result.
     
-    recommendation = {
-        'daily_calories': int(adjusted_calories),
-        'protein': round(protein_g, 1),
-        'carbs': round(carbs_g, 1),
-        'fats': round(fats_g, 1),
-        'breakfast_suggestion': breakfast,
-        'lunch_suggestion': lunch,
-        'dinner_suggestion': dinner,
-        'snacks_suggestion': snacks,
-        'additional_notes': additional_notes
-    }
+    Holds the cross-process lock for the query while calling the upstream, so a
+    worker that was waiting on another worker's call picks up the cached result
+    instead of repeating it. Returns None when Nutritionix has no match.
+    """
+    if NUTRITIONIX_LOCKS is None:
+        return _query_nutritionix(query, cache_key)
     
-    return recommendation
+    with NUTRITIONIX_LOCKS.lock(cache_key):
+        cached = NUTRITIONIX_CACHE.peek(cache_key)
+        if cached is not None:
+            logging.info(f"Using Nutritionix data fetched by another worker for: {query}")
+            return None if cached.get('no_match') else cached
+        return _query_nutritionix(query, cache_key)
+
+def _query_nutritionix(query, cache_key):
+    food = NUTRITIONIX_CLIENT.natural_nutrients(query)
+    if not food:
+        NUTRITIONIX_CACHE.set(cache_key, NUTRITIONIX_NO_MATCH, ttl=NUTRITIONIX_MISS_TTL)
+        return None
+    
+    nutrition = {
+        'food_name': food.get('food_name', query),
+        'serving_g': food.get('serving_weight_grams'),
+        'calories': food.get('nf_calories', 0),
+        'protein_g': food.get('nf_protein', 0),
+        'carbs_g': food.get('nf_total_carbohydrate', 0),
+        'fat_g': food.get('nf_total_fat', 0),
+        'fiber_g': food.get('nf_dietary_fiber', 0)
+    }
+    NUTRITIONIX_CACHE.set(cache_key, nutrition)
+    return nutrition
 
 def get_food_nutrition(query):
     """Get nutrition information for a food item using an extensive database of common foods"""
-    # Store a dictionary of common foods and their accurate nutrition values (per 100g unless specified)
-    common_foods = {
-        # Fruits
-        'apple': {
-            'food_name': 'Apple (1 medium)',
-            'calories': 95,
-            'protein_g': 0.5,
-            'carbs_g': 25.1,
-            'fat_g': 0.3,
-            'fiber_g': 4.4
-        },
-        'banana': {
-            'food_name': 'Banana (1 medium)',
-            'calories': 105,
-            'protein_g': 1.3,
-            'carbs_g': 27.0,
-            'fat_g': 0.4,
-            'fiber_g': 3.1
-        },
-        'orange': {
-            'food_name': 'Orange (1 medium)',
-            'calories': 62,
-            'protein_g': 1.2,
-            'carbs_g': 15.4,
-            'fat_g': 0.2,
-            'fiber_g': 3.1
-        },
-        'strawberry': {
-            'food_name': 'Strawberries (1 cup)',
-            'calories': 49,
-            'protein_g': 1.0,
-            'carbs_g': 11.7,
-            'fat_g': 0.5,
-            'fiber_g': 3.0
-        },
-        'blueberry': {
-            'food_name': 'Blueberries (1 cup)',
-            'calories': 84,
-            'protein_g': 1.1,
-            'carbs_g': 21.5,
-            'fat_g': 0.5,
-            'fiber_g': 3.6
-        },
-        'grape': {
-            'food_name': 'Grapes (1 cup)',
-            'calories': 104,
-            'protein_g': 1.1,
-            'carbs_g': 27.3,
-            'fat_g': 0.2,
-            'fiber_g': 1.4
-        },
-        'watermelon': {
-            'food_name': 'Watermelon (1 cup, diced)',
-            'calories': 46,
-            'protein_g': 0.9,
-            'carbs_g': 11.5,
-            'fat_g': 0.2,
-            'fiber_g': 0.6
-        },
-        'pineapple': {
-            'food_name': 'Pineapple (1 cup, chunks)',
-            'calories': 82,
-            'protein_g': 0.9,
-            'carbs_g': 21.6,
-            'fat_g': 0.2,
-            'fiber_g': 2.3
-        },
-        'mango': {
-            'food_name': 'Mango (1 cup, sliced)',
-            'calories': 99,
-            'protein_g': 1.4,
-            'carbs_g': 24.7,
-            'fat_g': 0.6,
-            'fiber_g': 2.6
-        },
-        'avocado': {
-            'food_name': 'Avocado (1/2 fruit)',
-            'calories': 160,
-            'protein_g': 2.0,
-            'carbs_g': 8.5,
-            'fat_g': 14.7,
-            'fiber_g': 6.7
-        },
-        
-        # Vegetables
-        'broccoli': {
-            'food_name': 'Broccoli (1 cup, chopped)',
-            'calories': 55,
-            'protein_g': 3.7,
-            'carbs_g': 11.2,
-            'fat_g': 0.6,
-            'fiber_g': 5.1
-        },
-        'spinach': {
-            'food_name': 'Spinach (1 cup, raw)',
-            'calories': 7,
-            'protein_g': 0.9,
-            'carbs_g': 1.1,
-            'fat_g': 0.1,
-            'fiber_g': 0.7
-        },
-        'kale': {
-            'food_name': 'Kale (1 cup, chopped)',
-            'calories': 33,
-            'protein_g': 2.9,
-            'carbs_g': 6.7,
-            'fat_g': 0.5,
-            'fiber_g': 1.3
-        },
-        'carrot': {
-            'food_name': 'Carrot (1 medium)',
-            'calories': 25,
-            'protein_g': 0.6,
-            'carbs_g': 5.8,
-            'fat_g': 0.1,
-            'fiber_g': 1.7
-        },
-        'bell pepper': {
-            'food_name': 'Bell Pepper (1 medium)',
-            'calories': 30,
-            'protein_g': 1.0,
-            'carbs_g': 7.0,
-            'fat_g': 0.2,
-            'fiber_g': 2.5
-        },
-        'onion': {
-            'food_name': 'Onion (1 medium)',
-            'calories': 44,
-            'protein_g': 1.2,
-            'carbs_g': 10.3,
-            'fat_g': 0.1,
-            'fiber_g': 1.9
-        },
-        'tomato': {
-            'food_name': 'Tomato (1 medium)',
-            'calories': 22,
-            'protein_g': 1.1,
-            'carbs_g': 4.8,
-            'fat_g': 0.2,
-            'fiber_g': 1.5
-        },
-        'potato': {
-            'food_name': 'Potato (1 medium, baked)',
-            'calories': 161,
-            'protein_g': 4.3,
-            'carbs_g': 36.6,
-            'fat_g': 0.2,
-            'fiber_g': 3.8
-        },
-        'sweet potato': {
-            'food_name': 'Sweet Potato (1 medium, baked)',
-            'calories': 103,
-            'protein_g': 2.3,
-            'carbs_g': 23.6,
-            'fat_g': 0.2,
-            'fiber_g': 3.8
-        },
-        'cucumber': {
-            'food_name': 'Cucumber (1/2 cup, sliced)',
-            'calories': 8,
-            'protein_g': 0.3,
-            'carbs_g': 1.9,
-            'fat_g': 0.1,
-            'fiber_g': 0.3
-        },
-        
-        # Protein Sources
-        'chicken breast': {
-            'food_name': 'Chicken Breast (3 oz, cooked)',
-            'calories': 165,
-            'protein_g': 31.0,
-            'carbs_g': 0.0,
-            'fat_g': 3.6,
-            'fiber_g': 0.0
-        },
-        'chicken thigh': {
-            'food_name': 'Chicken Thigh (3 oz, cooked)',
-            'calories': 209,
-            'protein_g': 24.7,
-            'carbs_g': 0.0,
-            'fat_g': 11.2,
-            'fiber_g': 0.0
-        },
-        'beef': {
-            'food_name': 'Beef (3 oz, lean, cooked)',
-            'calories': 213,
-            'protein_g': 26.0,
-            'carbs_g': 0.0,
-            'fat_g': 11.8,
-            'fiber_g': 0.0
-        },
-        'ground beef': {
-            'food_name': 'Ground Beef (3 oz, 85% lean, cooked)',
-            'calories': 218,
-            'protein_g': 24.0,
-            'carbs_g': 0.0,
-            'fat_g': 13.0,
-            'fiber_g': 0.0
-        },
-        'pork': {
-            'food_name': 'Pork Chop (3 oz, cooked)',
-            'calories': 198,
-            'protein_g': 26.0,
-            'carbs_g': 0.0,
-            'fat_g': 9.9,
-            'fiber_g': 0.0
-        },
-        'salmon': {
-            'food_name': 'Salmon (3 oz, cooked)',
-            'calories': 175,
-            'protein_g': 18.8,
-            'carbs_g': 0.0,
-            'fat_g': 10.5,
-            'fiber_g': 0.0
-        },
-        'tuna': {
-            'food_name': 'Tuna (3 oz, canned in water)',
-            'calories': 73,
-            'protein_g': 16.5,
-            'carbs_g': 0.0,
-            'fat_g': 0.8,
-            'fiber_g': 0.0
-        },
-        'shrimp': {
-            'food_name': 'Shrimp (3 oz, cooked)',
-            'calories': 84,
-            'protein_g': 18.0,
-            'carbs_g': 0.0,
-            'fat_g': 0.9,
-            'fiber_g': 0.0
-        },
-        'tofu': {
-            'food_name': 'Tofu (1/2 cup)',
-            'calories': 94,
-            'protein_g': 10.0,
-            'carbs_g': 2.3,
-            'fat_g': 5.9,
-            'fiber_g': 0.5
-        },
-        'tempeh': {
-            'food_name': 'Tempeh (3 oz)',
-            'calories': 160,
-            'protein_g': 15.0,
-            'carbs_g': 7.0,
-            'fat_g': 9.0,
-            'fiber_g': 4.8
-        },
-        'lentils': {
-            'food_name': 'Lentils (1/2 cup, cooked)',
-            'calories': 115,
-            'protein_g': 9.0,
-            'carbs_g': 20.0,
-            'fat_g': 0.4,
-            'fiber_g': 7.8
-        },
-        'chickpeas': {
-            'food_name': 'Chickpeas (1/2 cup, cooked)',
-            'calories': 134,
-            'protein_g': 7.0,
-            'carbs_g': 22.5,
-            'fat_g': 2.1,
-            'fiber_g': 6.2
-        },
-        'black beans': {
-            'food_name': 'Black Beans (1/2 cup, cooked)',
-            'calories': 114,
-            'protein_g': 7.6,
-            'carbs_g': 20.4,
-            'fat_g': 0.5,
-            'fiber_g': 7.5
-        },
-        
-        # Dairy & Eggs
-        'egg': {
-            'food_name': 'Egg (1 large)',
-            'calories': 72,
-            'protein_g': 6.3,
-            'carbs_g': 0.4,
-            'fat_g': 5.0,
-            'fiber_g': 0.0
-        },
-        'milk': {
-            'food_name': 'Milk (1 cup, whole)',
-            'calories': 149,
-            'protein_g': 7.7,
-            'carbs_g': 11.7,
-            'fat_g': 8.0,
-            'fiber_g': 0.0
-        },
-        'skim milk': {
-            'food_name': 'Skim Milk (1 cup)',
-            'calories': 83,
-            'protein_g': 8.3,
-            'carbs_g': 12.2,
-            'fat_g': 0.2,
-            'fiber_g': 0.0
-        },
-        'yogurt': {
-            'food_name': 'Greek Yogurt (1 cup, plain)',
-            'calories': 130,
-            'protein_g': 22.0,
-            'carbs_g': 9.0,
-            'fat_g': 0.0,
-            'fiber_g': 0.0
-        },
-        'cheese': {
-            'food_name': 'Cheddar Cheese (1 oz)',
-            'calories': 113,
-            'protein_g': 7.0,
-            'carbs_g': 0.4,
-            'fat_g': 9.3,
-            'fiber_g': 0.0
-        },
-        'cottage cheese': {
-            'food_name': 'Cottage Cheese (1/2 cup)',
-            'calories': 110,
-            'protein_g': 12.5,
-            'carbs_g': 3.5,
-            'fat_g': 4.5,
-            'fiber_g': 0.0
-        },
-        
-        # Grains & Cereals
-        'rice': {
-            'food_name': 'White Rice (1/2 cup, cooked)',
-            'calories': 121,
-            'protein_g': 2.5,
-            'carbs_g': 26.5,
-            'fat_g': 0.3,
-            'fiber_g': 0.3
-        },
-        'brown rice': {
-            'food_name': 'Brown Rice (1/2 cup, cooked)',
-            'calories': 109,
-            'protein_g': 2.3,
-            'carbs_g': 22.9,
-            'fat_g': 0.9,
-            'fiber_g': 1.8
-        },
-        'quinoa': {
-            'food_name': 'Quinoa (1/2 cup, cooked)',
-            'calories': 111,
-            'protein_g': 4.1,
-            'carbs_g': 19.7,
-            'fat_g': 1.8,
-            'fiber_g': 2.6
-        },
-        'bread': {
-            'food_name': 'White Bread (1 slice)',
-            'calories': 75,
-            'protein_g': 2.6,
-            'carbs_g': 13.8,
-            'fat_g': 1.0,
-            'fiber_g': 0.8
-        },
-        'whole wheat bread': {
-            'food_name': 'Whole Wheat Bread (1 slice)',
-            'calories': 81,
-            'protein_g': 4.0,
-            'carbs_g': 15.0,
-            'fat_g': 1.1,
-            'fiber_g': 2.0
-        },
-        'pasta': {
-            'food_name': 'Pasta (1 cup, cooked)',
-            'calories': 221,
-            'protein_g': 8.1,
-            'carbs_g': 43.2,
-            'fat_g': 1.3,
-            'fiber_g': 2.5
-        },
-        'whole wheat pasta': {
-            'food_name': 'Whole Wheat Pasta (1 cup, cooked)',
-            'calories': 174,
-            'protein_g': 7.5,
-            'carbs_g': 37.2,
-            'fat_g': 0.8,
-            'fiber_g': 6.3
-        },
-        'oats': {
-            'food_name': 'Oatmeal (1/2 cup, dry)',
-            'calories': 150,
-            'protein_g': 5.0,
-            'carbs_g': 27.0,
-            'fat_g': 3.0,
-            'fiber_g': 4.0
-        },
-        
-        # Nuts & Seeds
-        'almonds': {
-            'food_name': 'Almonds (1 oz, 23 nuts)',
-            'calories': 164,
-            'protein_g': 6.0,
-            'carbs_g': 6.1,
-            'fat_g': 14.0,
-            'fiber_g': 3.5
-        },
-        'walnuts': {
-            'food_name': 'Walnuts (1 oz, 14 halves)',
-            'calories': 185,
-            'protein_g': 4.3,
-            'carbs_g': 3.9,
-            'fat_g': 18.5,
-            'fiber_g': 1.9
-        },
-        'peanut butter': {
-            'food_name': 'Peanut Butter (2 tbsp)',
-            'calories': 188,
-            'protein_g': 8.0,
-            'carbs_g': 6.9,
-            'fat_g': 16.0,
-            'fiber_g': 1.9
-        },
-        'chia seeds': {
-            'food_name': 'Chia Seeds (1 tbsp)',
-            'calories': 58,
-            'protein_g': 2.0,
-            'carbs_g': 5.0,
-            'fat_g': 3.0,
-            'fiber_g': 4.0
-        },
-        'flax seeds': {
-            'food_name': 'Flax Seeds (1 tbsp)',
-            'calories': 55,
-            'protein_g': 1.9,
-            'carbs_g': 3.0,
-            'fat_g': 4.3,
-            'fiber_g': 2.8
-        },
-        
-        # Oils & Fats
-        'olive oil': {
-            'food_name': 'Olive Oil (1 tbsp)',
-            'calories': 119,
-            'protein_g': 0.0,
-            'carbs_g': 0.0,
-            'fat_g': 13.5,
-            'fiber_g': 0.0
-        },
-        'coconut oil': {
-            'food_name': 'Coconut Oil (1 tbsp)',
-            'calories': 121,
-            'protein_g': 0.0,
-            'carbs_g': 0.0,
-            'fat_g': 13.6,
-            'fiber_g': 0.0
-        },
-        'butter': {
-            'food_name': 'Butter (1 tbsp)',
-            'calories': 102,
-            'protein_g': 0.1,
-            'carbs_g': 0.0,
-            'fat_g': 11.5,
-            'fiber_g': 0.0
-        }
-    }
-    
     # Check if the query matches any of our common foods (case-insensitive)
-    query_lower = query.lower().strip()
-    
-    # First, try exact matches
-    if query_lower in common_foods:
-        logging.info(f"Found exact nutrition data for: {query}")
-        return common_foods[query_lower]
-    
-    # Then try partial matches
-    for food_key, nutrition in common_foods.items():
-        if food_key in query_lower or query_lower in food_key:
+    match = FOODS.match(query)
+    if match:
+        food_key, exact = match
+        if exact:
+            logging.info(f"Found exact nutrition data for: {query}")
+        else:
             logging.info(f"Found nutrition data for: {query} (matched with {food_key})")
-            return nutrition
+        return FOODS.get(food_key)
+    
+    # Tolerate typos ("brocoli", "chiken breast") before paying for an API call
+    candidates = FOODS.search(query, limit=1, min_score=FUZZY_MATCH_THRESHOLD)
+    if candidates:
+        food_key, score = candidates[0]
+        logging.info(f"Found nutrition data for: {query} (fuzzy match with {food_key}, score {score})")
+        return FOODS.get(food_key)
     
     # If we don't have a match, try using the Nutritionix API if credentials are available
-    if NUTRITIONIX_APP_ID and NUTRITIONIX_API_KEY:
-        headers = {
-            'x-app-id': NUTRITIONIX_APP_ID,
-            'x-app-key': NUTRITIONIX_API_KEY,
-            'x-remote-user-id': '0'
-        }
-        
-        endpoint = "https://trackapi.nutritionix.com/v2/natural/nutrients"
-        data = {
-            'query': query
-        }
-        
-        try:
-            response = requests.post(endpoint, headers=headers, json=data)
-            response.raise_for_status()
-            result = response.json()
-            
-            if 'foods' in result and len(result['foods']) > 0:
-                food = result['foods'][0]
-                return {
-                    'food_name': food.get('food_name', query),
-                    'calories': food.get('nf_calories', 0),
-                    'protein_g': food.get('nf_protein', 0),
-                    'carbs_g': food.get('nf_total_carbohydrate', 0),
-                    'fat_g': food.get('nf_total_fat', 0),
-                    'fiber_g': food.get('nf_dietary_fiber', 0)
-                }
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error querying Nutritionix API: {str(e)}")
-            # Fall through to default response
+    if NUTRITIONIX_CLIENT.configured:
+        cache_key = normalize_query(query)
+        cached = NUTRITIONIX_CACHE.get(cache_key)
+        if cached is not None and cached.get('no_match'):
+            logging.info(f"Nutritionix recently had no match for: {query}")
+        elif cached is not None:
+            logging.info(f"Using cached Nutritionix data for: {query}")
+            return dict(cached)
+        else:
+            try:
+                nutrition = NUTRITIONIX_FLIGHTS.do(cache_key, lambda: _fetch_nutritionix(query, cache_key))
+                if nutrition:
+                    return dict(nutrition)
+            except CircuitOpenError:
+                logging.warning(f"Nutritionix circuit breaker open, skipping API call for: {query}")
+            except requests.exceptions.RequestException as e:
+                logging.error(f"Error querying Nutritionix API: {str(e)}")
+                # Fall through to default response
     
     # If we reach here, use a generic response based on the query
     logging.info(f"Returning approximate nutrition data for: {query}")
@@ -693,3 +363,137 @@ def get_food_nutrition(query):
         'fiber_g': 2,
         'note': 'Approximate values - for educational purposes only'
     }
+
+def _batch_item(query, nutrition):
+    """Wrap a lookup result with its per-item status for batch responses"""
+    return {
+        'query': query,
+        'status': 'approximate' if 'note' in nutrition else 'ok',
+        'data': nutrition
+    }
+
+def get_food_nutrition_batch(queries):
+    """Look up nutrition data for several foods in one call.
+    
+    Repeated queries are resolved once, catalog hits are answered inline and the
+    remaining queries are resolved concurrently on FOOD_LOOKUP_POOL. Results are
+    returned in input order, one per query, each with its own status.
+    """
+    resolved = {}
+    pending = {}
+    for query in queries:
+        key = normalize_query(query)
+        if not key or key in resolved or key in pending:
+            continue
+        
+        match = FOODS.match(query)
+        if match:
+            resolved[key] = _batch_item(query, FOODS.get(match[0]))
+        else:
+            pending[key] = FOOD_LOOKUP_POOL.submit(get_food_nutrition, query)
+    
+    for key, future in pending.items():
+        try:
+            resolved[key] = _batch_item(key, future.result())
+        except Exception as e:
+            logging.error(f"Error retrieving nutrition data for {key}: {str(e)}")
+            resolved[key] = {'query': key, 'status': 'error', 'error': 'Unable to retrieve nutrition data'}
+    
+    results = []
+    for query in queries:
+        key = normalize_query(query)
+        if not key:
+            results.append({'query': query, 'status': 'error', 'error': 'Empty food query'})
+        else:
+            results.append({**resolved[key], 'query': query})
+    return results
+
+def _resolve_food(phrase):
+    """Resolve a food phrase against the local catalogs only; returns (key, source) or (None, None)"""
+    match = FOODS.match(phrase)
+    if match:
+        return match[0], 'catalog'
+    candidates = FOODS.search(phrase, limit=1, min_score=FUZZY_MATCH_THRESHOLD)
+    if candidates:
+        return candidates[0][0], 'fuzzy'
+    return None, None
+
+def _is_catalog_food(phrase):
+    match = FOODS.match(phrase)
+    return bool(match and match[1])
+
+def _is_local_food(phrase):
+    return FOODS.match(phrase) is not None
+
+def get_meal_nutrition(text):
+    """Parse a free-text meal description and return per-item and combined nutrition.
+    
+    Every item is resolved against the local catalogs first; only the food
+    phrases that could not be resolved locally go to the batch lookup (and so
+    possibly to Nutritionix), once per distinct phrase.
+    """
+    items = parse_meal(text, is_food=_is_catalog_food, resolves=_is_local_food)
+    truncated = len(items) > MAX_BATCH_QUERIES
+    items = items[:MAX_BATCH_QUERIES]
+    
+    resolved = []
+    remote_phrases = []
+    for item in items:
+        key, source = _resolve_food(item.food)
+        resolved.append((key, source))
+        if key is None and item.food not in remote_phrases:
+            remote_phrases.append(item.food)
+    remote = {result['query']: result for result in get_food_nutrition_batch(remote_phrases)} if remote_phrases else {}
+    
+    results = []
+    rows = []
+    for item, (key, source) in zip(items, resolved):
+        result = {'text': item.text, 'quantity': item.quantity, 'unit': item.unit, 'food': item.food, 'key': key}
+        if key is not None:
+            nutrition = FOODS.get(key)
+        else:
+            lookup = remote[item.food]
+            nutrition = lookup.get('data')
+            source = 'nutritionix' if lookup['status'] == 'ok' else lookup['status']
+        result['source'] = source
+        
+        if nutrition is not None:
+            scaled = scale_nutrition(nutrition, item.quantity, item.unit)
+            if scaled is None:
+                # The unit does not apply to this food ("2 slices of apple"), count servings instead
+                scaled = scale_nutrition(nutrition, item.quantity)
+                note = f'Could not measure in {item.unit}, counted {item.quantity:g} servings'
+                scaled['note'] = f"{scaled['note']}; {note}" if 'note' in scaled else note
+            result['data'] = scaled
+            rows.append([scaled[name] for name in NUTRIENTS])
+        results.append(result)
+    
+    with _MEAL_PARSER_STATS_LOCK:
+        MEAL_PARSER_STATS['meals'] += 1
+        MEAL_PARSER_STATS['items'] += len(items)
+        local_items = sum(1 for key, _ in resolved if key is not None)
+        MEAL_PARSER_STATS['local_items'] += local_items
+        MEAL_PARSER_STATS['remote_items'] += len(items) - local_items
+    
+    totals = nutrient_dict(np.asarray(rows, dtype=np.float64).sum(axis=0)) if rows else nutrient_dict([0] * len(NUTRIENTS))
+    return {'items': results, 'totals': totals, 'remote_lookups': len(remote_phrases), 'truncated': truncated}
+
+def meal_parser_stats():
+    with _MEAL_PARSER_STATS_LOCK:
+        stats = dict(MEAL_PARSER_STATS)
+    stats['local_rate'] = round(stats['local_items'] / stats['items'], 4) if stats['items'] else 0.0
+    return stats
+
+def search_foods(query, limit=10, min_score=0.3):
+    """Return the best catalog candidates for a food query, ranked by similarity score"""
+    return [
+        {'key': food_key, 'score': score, 'data': FOODS.get(food_key)}
+        for food_key, score in FOODS.search(query, limit=limit, min_score=min_score)
+    ]
+
+def autocomplete_foods(prefix, limit=8):
+    """Return catalog foods whose name starts with prefix, most popular first"""
+    suggestions = []
+    for food_key in FOODS.autocomplete(prefix, limit=limit):
+        suggestions.append({'key': food_key, 'food_name': FOODS.get(food_key)['food_name']})
+    return suggestions